@@ -0,0 +1,504 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:  # 可选依赖，未安装时只是不能使用异步引擎
+    aiohttp = None
+
+from downloader import (CHUNK_SIZE, EXPIRED_STATUS, JOURNAL_INTERVAL, MAX_URL_REFRESHES, MD5_PATTERN, MISMATCH,
+                        UNVERIFIABLE, VERIFIED, FrontierHasher, SegmentedDownloader, TaskInterrupted, format_speed)
+from ratelimit import bandwidth_limiter
+
+DEFAULT_CONCURRENCY = 256  # 同时进行的传输数
+DEFAULT_PER_HOST = 64  # 每个主机的最大连接数
+DEFAULT_API_CONCURRENCY = 16  # 同时进行的接口请求数（列目录、获取直链）
+DEFAULT_UPLOAD_WORKERS = 4  # 同时上传的文件数
+
+
+async def gather_or_cancel(aws):
+    """并发执行 aws，返回结果列表；任一项抛出异常时取消其余各项，等它们结束后再抛出
+
+    被取消的下载在退出前保存断点，调用方收到异常时不会再有协程写 .part 文件。
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class AsyncTransferEngine:
+    """基于asyncio的传输引擎
+
+    列目录、获取直链和下载以协程运行在同一个事件循环上，并发数只受连接池、concurrency
+    和 api_concurrency 限制，不再为每个传输占用一个线程，适合大量小文件的任务。接口请求
+    的地址和参数取自 Pan123，与同步实现共用列表缓存和直链缓存。单个文件用一个连接
+    流式传输，出错时用Range从已写入的位置继续，.part 和断点日志与 SegmentedDownloader 通用。
+
+    上传仍由 Pan123.upload_file 完成（会话保存与续传、分块ETag核对、缓存失效只有一份实现，
+    分块本身在其线程池中并行），在引擎自己的有界线程池中执行，同时上传 upload_workers 个文件，
+    不占用事件循环的默认线程池。
+
+    pan 为 Pan123 实例；只调用 download_url 时可以为None。
+    """
+
+    def __init__(self, pan=None, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST, timeout=30,
+                 max_retries=3, api_concurrency=DEFAULT_API_CONCURRENCY, upload_workers=DEFAULT_UPLOAD_WORKERS):
+        if aiohttp is None:
+            raise RuntimeError("异步传输引擎需要安装aiohttp: pip install aiohttp")
+        self.pan = pan
+        self.concurrency = max(1, int(concurrency))
+        self.per_host = max(1, int(per_host))
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.api_concurrency = max(1, int(api_concurrency))
+        self.upload_workers = max(1, int(upload_workers))
+        self.api_session = None
+        self.storage_session = None
+        self._transfers = None
+        self._api_calls = None
+        self._upload_pool = None
+
+    async def open(self):
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        # 接口和存储节点分开使用连接池，登录请求头只发给接口
+        self.api_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.api_concurrency), timeout=timeout
+        )
+        self.storage_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host), timeout=timeout
+        )
+        self._transfers = asyncio.Semaphore(self.concurrency)
+        self._api_calls = asyncio.Semaphore(self.api_concurrency)
+        self._upload_pool = ThreadPoolExecutor(max_workers=self.upload_workers, thread_name_prefix="aio-upload")
+
+    async def close(self):
+        for session in (self.api_session, self.storage_session):
+            if session is not None:
+                await session.close()
+        if self._upload_pool is not None:
+            self._upload_pool.shutdown(wait=False)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _api(self, method, url, **kwargs):
+        """请求接口并返回解析后的JSON；每次读取 Pan123 当前的登录请求头，重新登录后立即生效"""
+        async with self._api_calls:
+            async with self.api_session.request(method, url, headers=dict(self.pan.session.headers), **kwargs) as r:
+                return await r.json(content_type=None)
+
+    async def _list_page(self, parent_file_id, page):
+        url, params = self.pan.list_page_request(parent_file_id, page)
+        # aiohttp 只接受字符串参数，按 requests 的方式转换
+        res = await self._api("GET", url, params={key: str(value) for key, value in params.items()})
+        if res["code"] != 0:
+            print("code = 2 Error:" + str(res["code"]))
+            return res["code"], None
+        return 0, res["data"]
+
+    async def list_dir(self, parent_file_id, refresh=False):
+        """与 Pan123.list_dir 相同，共用列表缓存，拿到总数后其余分页并发获取，返回(状态码, 文件列表)"""
+        cache = self.pan.listing_cache
+        if not refresh:
+            lists = cache.get(parent_file_id)
+            if lists is not None:
+                return 0, lists
+        try:
+            code, data = await self._list_page(parent_file_id, 1)
+            if code != 0:
+                return code, []
+            lists = list(data["InfoList"])
+            page_size = self.pan.list_page_request(parent_file_id, 1)[1]["limit"]
+            pages = range(2, math.ceil(data["Total"] / page_size) + 1)
+            if lists and pages:
+                for code, data in await gather_or_cancel(self._list_page(parent_file_id, page) for page in pages):
+                    if code != 0:
+                        return code, []
+                    lists += data["InfoList"]
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+            print(f"列出文件夹失败: {parent_file_id}, {str(e)}")
+            return -1, []
+        for file_num, item in enumerate(lists):
+            item["FileNum"] = file_num
+        cache.put(parent_file_id, lists)
+        return 0, lists
+
+    async def link_file(self, file_detail, refresh=False):
+        """与 Pan123.link_file 相同，共用直链缓存，失败返回None"""
+        cache = self.pan.link_cache
+        # 文件夹打包链接每次单独生成，不缓存
+        cache_key = (file_detail["FileId"], file_detail.get("Etag")) if file_detail["Type"] == 0 else None
+        if cache_key is not None:
+            if refresh:
+                cache.invalidate(cache_key)
+            else:
+                url = cache.get(cache_key)
+                if url:
+                    return url
+        request_url, request_data = self.pan.link_request(file_detail)
+        try:
+            res = await self._api("POST", request_url, data=json.dumps(request_data))
+            if res["code"] != 0:
+                print("code = 3 Error:" + str(res["code"]))
+                return None
+            async with self.storage_session.get(res["data"]["DownloadUrl"], allow_redirects=False) as r:
+                page = await r.text()
+            url = self.pan.parse_redirect(page)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, IndexError) as e:
+            print(f"获取下载链接失败: {file_detail['FileName']}, {str(e)}")
+            return None
+        if cache_key is not None:
+            cache.put(cache_key, url)
+        return url
+
+    async def link_files(self, file_details):
+        """并发获取多个文件的直链，返回 {FileId: 直链}，失败的为None"""
+        files = [item for item in file_details if item["Type"] == 0]
+        urls = await gather_or_cancel(self.link_file(item) for item in files)
+        return {item["FileId"]: url for item, url in zip(files, urls)}
+
+    async def download_url(self, url, file_path, file_size=0, url_resolver=None, progress_callback=None,
+                           progress_info=None, task_bucket=None, control=None, expected_md5=None, etag=None):
+        """把直链下载到file_path，先写入.part，完成后改名，成功返回True
+
+        .part 和断点日志与 SegmentedDownloader 相同：已有日志且大小、ETag一致时从连续写完的
+        位置继续（包括 SegmentedDownloader 留下的多分段日志），下载中按 JOURNAL_INTERVAL
+        落盘并更新日志，两种引擎可以互相接着下载同一个文件。
+        url_resolver(refresh) 为协程函数，CDN返回403/410时用它刷新直链。
+        提供 expected_md5 时边写入边计算MD5，结果记录在进度信息的 verify 字段。
+        """
+        if expected_md5 and not MD5_PATTERN.match(expected_md5):
+            expected_md5 = None
+        async with self._transfers:
+            # 只借用 SegmentedDownloader 的断点日志读写，单连接下载只有一个分段
+            journal = SegmentedDownloader(url, file_path, file_size, etag=etag)
+            part_path = journal.part_path
+            done = journal.contiguous() if file_size > 0 and journal.restore_journal() else 0
+            journal.segments = [{"index": 0, "start": 0, "end": file_size - 1, "done": done, "saved": done}]
+            info = progress_info if progress_info is not None else {}
+            info['total'] = file_size
+            resumed = done
+            retries = 0
+            refreshes = 0
+            hasher = FrontierHasher(part_path) if expected_md5 else None
+            start_time = last_update = last_checkpoint = time.time()
+
+            def report(final=False):
+                info['downloaded'] = done
+                if final:
+                    info['percentage'] = 100
+                    info['speed'] = "完成"
+                else:
+                    info['percentage'] = int(done * 100 / file_size) if file_size > 0 else 0
+                    elapsed = time.time() - start_time
+                    info['speed'] = format_speed((done - resumed) / elapsed if elapsed > 0 else 0)
+                if progress_callback:
+                    progress_callback(info)
+
+            def checkpoint(f):
+                # 先把数据刷到磁盘，再更新断点日志
+                f.flush()
+                os.fsync(f.fileno())
+                journal.segments[0]["saved"] = done
+                journal.save_journal()
+
+            if done:
+                print(f"从断点继续下载: {done}/{file_size} 字节")
+                if hasher:
+                    await asyncio.to_thread(hasher.catch_up, done)
+            # 小文件的写入直接进入页缓存，耗时远小于网络等待，不必交给线程池
+            with open(part_path, "r+b" if done else "wb") as f:
+                if not done and file_size > 0:
+                    # 与 SegmentedDownloader 一样预先扩展到完整大小，断点日志据此判断 .part 是否完整
+                    f.truncate(file_size)
+                f.seek(done)
+                try:
+                    while True:
+                        if control:
+                            await self._check(control)
+                        headers = {"Range": f"bytes={done}-"} if done else {}
+                        try:
+                            async with self.storage_session.get(url, headers=headers) as r:
+                                if r.status in EXPIRED_STATUS and url_resolver and refreshes < MAX_URL_REFRESHES:
+                                    refreshes += 1
+                                    new_url = await url_resolver(True)
+                                    if new_url and new_url != url:
+                                        print("下载链接已过期，已重新获取")
+                                        url = new_url
+                                        continue
+                                r.raise_for_status()
+                                if done and r.status != 206:
+                                    # 服务器不支持Range，只能从头开始
+                                    f.seek(0)
+                                    f.truncate()
+                                    done = resumed = 0
+                                    if hasher:
+                                        hasher.reset()
+                                async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                                    if control and control.interrupted:
+                                        break
+                                    f.write(chunk)
+                                    if hasher:
+                                        hasher.update(done, chunk)
+                                    done += len(chunk)
+                                    wait = bandwidth_limiter.reserve("download", len(chunk), task_bucket)
+                                    if wait > 0:
+                                        await asyncio.sleep(wait)
+                                    if time.time() - last_update >= 1.0:
+                                        last_update = time.time()
+                                        report()
+                                    if file_size > 0 and time.time() - last_checkpoint >= JOURNAL_INTERVAL:
+                                        await asyncio.to_thread(checkpoint, f)
+                                        last_checkpoint = time.time()
+                            if control and control.interrupted:
+                                continue
+                            if file_size and done < file_size:
+                                raise aiohttp.ClientPayloadError("连接提前关闭")
+                            break
+                        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                            if control and control.interrupted:
+                                continue
+                            retries += 1
+                            print(f"下载出错 (重试 {retries}/{self.max_retries}): {os.path.basename(file_path)}, {str(e)}")
+                            if retries > self.max_retries:
+                                return False
+                            await asyncio.sleep(2)
+                finally:
+                    # 失败、暂停或取消时保留断点，下次从这里继续
+                    if done < file_size:
+                        checkpoint(f)
+            if hasher is None:
+                info['verify'] = UNVERIFIABLE
+            elif hasher.hexdigest() == expected_md5.lower():
+                info['verify'] = VERIFIED
+            else:
+                info['verify'] = MISMATCH
+                print(f"文件校验失败，MD5不一致: {os.path.basename(file_path)}")
+                for path in (part_path, journal.journal_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return False
+            os.replace(part_path, file_path)
+            if os.path.exists(journal.journal_path):
+                os.remove(journal.journal_path)
+            report(final=True)
+            return True
+
+    async def _check(self, control):
+        """任务被暂停时等待继续或取消，不占用线程，事件循环上的其他传输不受影响"""
+        if control.paused and not control.cancelled and not control.release_on_pause:
+            loop = asyncio.get_running_loop()
+            woken = asyncio.Event()
+
+            def wake():
+                loop.call_soon_threadsafe(woken.set)
+
+            control.add_listener(wake)
+            try:
+                # 登记之后再检查一次，避免错过登记前发生的继续
+                if control.paused:
+                    await woken.wait()
+            finally:
+                control.remove_listener(wake)
+        control.check()
+
+    async def download_file(self, file_detail, download_path="download/", progress_callback=None,
+                            task_bucket=None, control=None):
+        """下载单个文件（文件夹按ZIP打包），成功返回True"""
+        file_name = file_detail["FileName"] + (".zip" if file_detail["Type"] == 1 else "")
+        url = await self.link_file(file_detail)
+        if url is None:
+            print(f"获取下载链接失败: {file_name}")
+            return False
+        os.makedirs(download_path, exist_ok=True)
+        progress_info = {'filename': file_name, 'downloaded': 0, 'percentage': 0, 'speed': '0K/S'}
+        return await self.download_url(
+            url,
+            os.path.join(download_path, file_name),
+            file_detail["Size"],
+            url_resolver=lambda refresh: self.link_file(file_detail, refresh),
+            progress_callback=progress_callback,
+            progress_info=progress_info,
+            task_bucket=task_bucket,
+            control=control,
+            expected_md5=file_detail.get("Etag") if file_detail["Type"] == 0 else None,
+            etag=file_detail.get("Etag") or None,
+        )
+
+    async def download_folder(self, folder_detail, download_path="download/", progress_callback=None,
+                              task_bucket=None, control=None):
+        """并发遍历文件夹并下载全部文件，进度格式与 FolderDownloader 相同，全部成功返回True"""
+        state = {"total": 0, "files": 0, "done": 0, "failed": 0, "list_failed": False}
+        file_bytes = {}
+        start_time = time.time()
+        last_update = [0.0]
+
+        def report(final=False):
+            if not progress_callback:
+                return
+            downloaded = sum(file_bytes.values())
+            total = state["total"]
+            success = state["failed"] == 0 and not state["list_failed"]
+            percentage = 100 if final and success else (int(downloaded * 100 / total) if total > 0 else 0)
+            if final:
+                speed_text = '完成' if success else '下载失败'
+            else:
+                elapsed = time.time() - start_time
+                speed = format_speed(downloaded / elapsed if elapsed > 0 else 0)
+                speed_text = f"{state['done']}/{state['files']} 文件 {speed}"
+            progress_callback({
+                'filename': f"文件夹: {folder_detail['FileName']}",
+                'total': total,
+                'downloaded': downloaded,
+                'percentage': percentage,
+                'speed': speed_text,
+                'files_total': state["files"],
+                'files_done': state["done"],
+                'status': 'completed' if final and percentage == 100 else 'downloading',
+            })
+
+        async def fetch(item, local_path):
+            file_id = item["FileId"]
+            target = os.path.join(local_path, item["FileName"])
+            if os.path.exists(target) and not os.path.exists(target + ".part") \
+                    and os.path.getsize(target) == item["Size"]:
+                ok = True
+            else:
+                def file_progress(info):
+                    file_bytes[file_id] = info.get('downloaded', 0)
+                    if time.time() - last_update[0] >= 1.0:
+                        last_update[0] = time.time()
+                        report()
+                ok = await self.download_file(item, local_path, file_progress, task_bucket, control)
+            if ok:
+                state["done"] += 1
+                file_bytes[file_id] = item["Size"]
+            else:
+                state["failed"] += 1
+                print(f"文件下载失败: {item['FileName']}")
+
+        async def walk(folder, parent_path):
+            local_path = os.path.join(parent_path, folder["FileName"])
+            os.makedirs(local_path, exist_ok=True)
+            code, items = await self.list_dir(folder["FileId"])
+            if code != 0:
+                print(f"列出文件夹失败: {folder['FileName']}, 错误代码: {code}")
+                state["list_failed"] = True
+                return
+            jobs = []
+            for item in items:
+                if item["Type"] == 1:
+                    jobs.append(walk(item, local_path))
+                else:
+                    state["files"] += 1
+                    state["total"] += item["Size"]
+                    file_bytes[item["FileId"]] = 0
+                    jobs.append(fetch(item, local_path))
+            # 暂停或取消时其余的遍历和下载一起取消，保存断点后才向上抛出
+            await gather_or_cancel(jobs)
+
+        await walk(folder_detail, download_path)
+        success = state["failed"] == 0 and not state["list_failed"]
+        report(final=True)
+        return success
+
+    async def upload_file(self, file_path, parent_file_id, duplicate=0, task_bucket=None):
+        """在引擎的上传线程池中调用 Pan123.upload_file，成功返回True
+
+        上传会话的保存与续传、分块ETag核对、合并前的分块确认和列表缓存失效都与同步上传
+        相同。duplicate 为同名文件的处理方式：0跳过，1覆盖，2保留两者。
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._upload_pool, self.pan.upload_file, file_path, parent_file_id, duplicate, task_bucket
+            )
+        except (requests.exceptions.RequestException, OSError, ValueError, KeyError) as e:
+            print(f"上传失败: {os.path.basename(file_path)}, {str(e)}")
+            return False
+
+
+class TransferEngine:
+    """AsyncTransferEngine 的同步外观
+
+    在后台线程中运行一个事件循环，同步代码（Pan123、Flask路由）调用这里的方法时，
+    协程被提交到该循环并阻塞等待结果。多个线程可以同时调用，所有传输共享同一组连接。
+    """
+
+    def __init__(self, pan=None, **kwargs):
+        self._engine = AsyncTransferEngine(pan, **kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._call(self._engine.open())
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def list_dir(self, parent_file_id):
+        return self._call(self._engine.list_dir(parent_file_id))
+
+    def link_files(self, file_details):
+        return self._call(self._engine.link_files(file_details))
+
+    def download_urls(self, items, task_bucket=None):
+        """并发下载 (直链, 本地路径, 大小) 列表，返回与输入顺序一致的结果列表"""
+        async def run():
+            return await gather_or_cancel(
+                self._engine.download_url(url, path, size, task_bucket=task_bucket) for url, path, size in items
+            )
+        return self._call(run())
+
+    def download_files(self, file_details, download_path="download/", progress_callback=None, task_bucket=None,
+                       control=None):
+        """并发下载多个文件，返回 {FileId: 是否成功}"""
+        async def download(item):
+            try:
+                return await self._engine.download_file(item, download_path, progress_callback, task_bucket, control)
+            except TaskInterrupted:
+                raise
+            except Exception as e:
+                print(f"文件下载失败: {item['FileName']}, {str(e)}")
+                return False
+
+        async def run():
+            # 暂停或取消时其余文件一起取消，保存断点后才抛出 TaskInterrupted
+            results = await gather_or_cancel(download(item) for item in file_details)
+            return {item["FileId"]: result is True for item, result in zip(file_details, results)}
+        return self._call(run())
+
+    def download_folder(self, folder_detail, download_path="download/", progress_callback=None, task_bucket=None,
+                        control=None):
+        return self._call(
+            self._engine.download_folder(folder_detail, download_path, progress_callback, task_bucket, control)
+        )
+
+    def upload_files(self, file_paths, parent_file_id, duplicate=0, task_bucket=None):
+        """并发上传多个本地文件，返回 {路径: 是否成功}"""
+        async def run():
+            results = await asyncio.gather(*(
+                self._engine.upload_file(path, parent_file_id, duplicate, task_bucket) for path in file_paths
+            ))
+            return dict(zip(file_paths, results))
+        return self._call(run())
+
+    def close(self):
+        self._call(self._engine.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
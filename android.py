@@ -1,16 +1,164 @@
-import hashlib
+import calendar
 import json
+import logging
+import math
 import os
 import re
+import sys
+import threading
 import time
 
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from aio_transfer import TransferEngine
+from downloader import (DEFAULT_CONNECTIONS, MANIFEST_SUFFIX, MISMATCH, VERIFIED, FolderDownloader, SegmentedDownloader,
+                        TaskControl, TaskInterrupted, VolumeDownloader)
+from drive_index import SEARCH_LIMIT, DriveIndex
+from hashing import HashCache, HashService
+from ratelimit import bandwidth_limiter
+from uploader import (CONFLICT, DEFAULT_VOLUME_SIZE, NEEDS_TRANSFER, REUSED, FolderUploader, MultipartUploader, StreamUploader,
+                      UploadError, UploadProbe, UploadSessionExpired, UploadSessionStore, choose_part_size,
+                      upload_throughput)
+
+# 连接池与超时的默认值
+DEFAULT_POOL_SIZE = 10  # 每个主机保持的连接数
+DEFAULT_TIMEOUT = 10  # 接口请求超时（秒）
+LINK_DEFAULT_TTL = 600  # 无法从直链解析出过期时间时的缓存时长（秒）
+LINK_EXPIRY_MARGIN = 60  # 直链过期前提前失效的余量（秒）
+LINK_WORKERS = 8  # 批量获取直链的并发数
+LIST_PAGE_SIZE = 100  # 列目录每页的条目数
+LIST_PAGE_WORKERS = 8  # 列目录时并发获取后续页的数量
+LISTING_TTL = 60  # 文件夹列表缓存的有效期（秒）
+
+
+# 下载地址返回的跳转页中的真实直链
+REDIRECT_PATTERN = re.compile(r"href='(https?://[^']+)'")
+
+# 正在进行的文件夹下载的控制对象（顶级文件夹FileId -> TaskControl），可用于暂停/继续/取消
+folder_controls = {}
+
+
+def parse_url_expiry(url):
+    """从签名直链的参数中解析过期时间（Unix时间戳），解析不出时返回None"""
+    query = {k.lower(): v[0] for k, v in parse_qs(urlparse(url).query).items()}
+    try:
+        # 阿里云CDN鉴权: auth_key=过期时间戳-随机数-uid-签名
+        if "auth_key" in query:
+            return int(query["auth_key"].split("-")[0])
+        # S3 V4签名: X-Amz-Date + X-Amz-Expires
+        if "x-amz-date" in query and "x-amz-expires" in query:
+            signed_at = calendar.timegm(time.strptime(query["x-amz-date"], "%Y%m%dT%H%M%SZ"))
+            return signed_at + int(query["x-amz-expires"])
+        for name in ("expires", "e", "t"):
+            if name in query and query[name].isdigit():
+                return int(query[name])
+    except ValueError:
+        pass
+    return None
+
+
+class LinkCache:
+    """下载直链缓存，按(FileId, Etag)保存，有效期取自签名直链本身"""
+
+    def __init__(self, default_ttl=LINK_DEFAULT_TTL, margin=LINK_EXPIRY_MARGIN):
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self._links = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._links.get(key)
+            if entry is None:
+                return None
+            url, expires_at = entry
+            if time.time() >= expires_at:
+                del self._links[key]
+                return None
+            return url
+
+    def put(self, key, url):
+        now = time.time()
+        expires_at = parse_url_expiry(url)
+        # 解析出的时间不合理（已过期或远超默认值的千倍）时使用默认有效期
+        if expires_at is None or expires_at <= now or expires_at - now > self.default_ttl * 1000:
+            expires_at = now + self.default_ttl
+        with self._lock:
+            self._links[key] = (url, expires_at - self.margin)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._links.pop(key, None)
+
 
+class ListingCache:
+    """文件夹列表缓存，按父文件夹FileId保存
 
+    超过有效期后重新获取；本客户端的新建、删除、上传操作会直接修改或标记失效对应的列表。
+    """
+
+    def __init__(self, ttl=LISTING_TTL):
+        self.ttl = ttl
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def get(self, parent_file_id):
+        with self._lock:
+            entry = self._listings.get(parent_file_id)
+            if entry is None:
+                return None
+            items, expires_at = entry
+            if time.time() >= expires_at:
+                del self._listings[parent_file_id]
+                return None
+            return list(items)
+
+    def put(self, parent_file_id, items):
+        with self._lock:
+            self._listings[parent_file_id] = (list(items), time.time() + self.ttl)
+
+    def remove_item(self, parent_file_id, file_id):
+        """从缓存的列表中去掉一项，并重新编号 FileNum"""
+        with self._lock:
+            entry = self._listings.get(parent_file_id)
+            if entry is None:
+                return
+            items, expires_at = entry
+            items = [item for item in items if item["FileId"] != file_id]
+            for file_num, item in enumerate(items):
+                item["FileNum"] = file_num
+            self._listings[parent_file_id] = (items, expires_at)
+
+    def invalidate(self, parent_file_id):
+        with self._lock:
+            self._listings.pop(parent_file_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+
+
+class PooledSession(requests.Session):
+    """带连接池和默认超时的会话，复用到同一主机的TCP/TLS连接"""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, headers=None):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        if headers:
+            self.headers.update(headers)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
 
-# Global dictionary to track pause status for folder downloads
-folder_pause_flags = {}
 
 class Pan123:
     def __init__(
@@ -20,6 +168,8 @@ class Pan123:
             pass_word="",
             authorization="",
             input_pwd=True,
+            pool_size=DEFAULT_POOL_SIZE,
+            timeout=DEFAULT_TIMEOUT,
     ):
         self.cookies = None
         self.recycle_list = None
@@ -59,6 +209,19 @@ class Pan123:
             "app-version": "61",
             "x-app-version": "2.4.0"
         }
+        # 接口请求使用带登录请求头的连接池，存储节点/CDN使用不带请求头的连接池，避免把令牌发给第三方主机
+        self.session = PooledSession(pool_size, timeout, self.header_logined)
+        self.storage_session = PooledSession(pool_size, timeout)
+        self.link_cache = LinkCache()
+        self.listing_cache = ListingCache()
+        self.upload_sessions = UploadSessionStore()
+        self.hash_cache = HashCache()
+        # 需要本地文件Etag的地方共用的MD5计算线程池
+        self.hasher = HashService(cache=self.hash_cache)
+        self._transfer_engine = None
+        self._transfer_engine_lock = threading.Lock()
+        self._drive_index = None
+        self._drive_index_lock = threading.Lock()
         self.parent_file_id = 0  # 路径，文件夹的id,0为根目录
         self.parent_file_list = [0]
         res_code_getdir = self.get_dir()
@@ -81,11 +244,11 @@ class Pan123:
         
         try:
             print("发送登录请求...")
-            login_res = requests.post(
+            # 登录使用网页端请求头，走不带默认请求头的连接池
+            login_res = self.storage_session.post(
                 "https://www.123pan.com/b/api/user/sign_in",
                 headers=headers,
-                json=data,
-                timeout=10
+                json=data
             )
             print(f"响应状态码: {login_res.status_code}")
             
@@ -102,6 +265,9 @@ class Pan123:
             token = res_json["data"]["token"]
             self.authorization = f"Bearer {token}"
             self.header_logined["authorization"] = self.authorization
+            self.session.headers["authorization"] = self.authorization
+            # 可能换了账号，旧的文件夹列表不再可信
+            self.listing_cache.clear()
             self.save_file()
             print("登录成功")
             return 0
@@ -123,60 +289,104 @@ class Pan123:
             json.dump(config, f, indent=2)
         print("配置已保存到config.json")
 
-    def get_dir(self):
-        res_code_getdir = 0
-        page = 1
-        lists = []
-        lenth_now = 0
-        total = -1
-        while lenth_now < total or total == -1:
-            base_url = "https://www.123pan.com/b/api/file/list/new"
-            # print(self.headerLogined)
-            # sign = getSign("/b/api/file/list/new")
-            # print(sign)
-            params = {
-                # sign[0]: sign[1],
-                "driveId": 0,
-                "limit": 100,
-                "next": 0,
-                "orderBy": "file_id",
-                "orderDirection": "desc",
-                "parentFileId": str(self.parent_file_id),
-                "trashed": False,
-                "SearchData": "",
-                "Page": str(page),
-                "OnlyLookAbnormalFile": 0,
-            }
-            try:
-                a = requests.get(base_url, headers=self.header_logined, params=params, timeout=10)  # , verify=False)
-            except:
-                print("连接失败")
-                return -1
-            # print(a.text)
-            # print(a.headers)
-            text = a.json()
-            res_code_getdir = text["code"]
-            if res_code_getdir != 0:
-                #print(a.text)
-                #print(a.headers)
-                print("code = 2 Error:" + str(res_code_getdir))
-                return res_code_getdir
-            lists_page = text["data"]["InfoList"]
-            lists += lists_page
-            total = text["data"]["Total"]
-            lenth_now += len(lists_page)
-            page += 1
+    def get_dir(self, refresh=False):
+        res_code_getdir, lists = self.list_dir(self.parent_file_id, refresh)
+        if res_code_getdir != 0:
+            return res_code_getdir
+        self.list = lists
+        return res_code_getdir
+
+    def list_dir(self, parent_file_id, refresh=False, use_cache=True):
+        """列出指定文件夹的内容，不修改当前浏览状态，返回(状态码, 文件列表)
+
+        有效期内的列表直接从缓存返回，refresh=True 时强制重新获取；use_cache=False 时
+        既不读取也不写入缓存（遍历整个云盘时不把所有列表留在内存中）。
+        第一页返回总数后，其余各页有界并发获取，按页码顺序合并。
+        """
+        if use_cache and not refresh:
+            lists = self.listing_cache.get(parent_file_id)
+            if lists is not None:
+                return 0, lists
+        res_code_getdir, data = self._list_page(parent_file_id, 1)
+        if res_code_getdir != 0:
+            return res_code_getdir, []
+        lists = list(data["InfoList"])
+        total = data["Total"]
+        pages = range(2, math.ceil(total / LIST_PAGE_SIZE) + 1)
+        if lists and pages:
+            with ThreadPoolExecutor(max_workers=min(LIST_PAGE_WORKERS, len(pages))) as pool:
+                for res_code_getdir, data in pool.map(lambda page: self._list_page(parent_file_id, page), pages):
+                    if res_code_getdir != 0:
+                        return res_code_getdir, []
+                    lists += data["InfoList"]
         file_num = 0
         for i in lists:
             i["FileNum"] = file_num
             file_num += 1
 
-        self.list = lists
-        return res_code_getdir
+        if use_cache:
+            self.listing_cache.put(parent_file_id, lists)
+        return res_code_getdir, lists
+
+    def search(self, keyword, parent_file_id=0):
+        """服务器端按文件名搜索，生成器，逐页返回(状态码, 本页结果)
+
+        只在调用方需要下一页时才发请求，第一页到达即可显示；出错时返回一次错误码后结束。
+        """
+        page = 1
+        fetched = 0
+        while True:
+            res_code, data = self._list_page(parent_file_id, page, search_data=keyword)
+            if res_code != 0:
+                yield res_code, []
+                return
+            items = data["InfoList"]
+            if not items:
+                return
+            yield res_code, items
+            fetched += len(items)
+            if fetched >= data["Total"] or len(items) < LIST_PAGE_SIZE:
+                return
+            page += 1
+
+    @staticmethod
+    def list_page_request(parent_file_id, page, search_data=""):
+        """列表（或搜索）一页的请求地址和参数，异步传输引擎用同样的请求"""
+        base_url = "https://www.123pan.com/b/api/file/list/new"
+        # sign = getSign("/b/api/file/list/new")
+        params = {
+            # sign[0]: sign[1],
+            "driveId": 0,
+            "limit": LIST_PAGE_SIZE,
+            "next": 0,
+            "orderBy": "file_id",
+            "orderDirection": "desc",
+            "parentFileId": str(parent_file_id),
+            "trashed": False,
+            "SearchData": search_data,
+            "Page": str(page),
+            "OnlyLookAbnormalFile": 0,
+        }
+        return base_url, params
+
+    def _list_page(self, parent_file_id, page, search_data=""):
+        """获取文件夹列表（或搜索结果）的一页，返回(状态码, data)"""
+        base_url, params = self.list_page_request(parent_file_id, page, search_data)
+        try:
+            a = self.session.get(base_url, params=params)  # , verify=False)
+        except:
+            print("连接失败")
+            return -1, None
+        text = a.json()
+        res_code_getdir = text["code"]
+        if res_code_getdir != 0:
+            print("code = 2 Error:" + str(res_code_getdir))
+            return res_code_getdir, None
+        return res_code_getdir, text["data"]
 
     def show(self):
         print("--------------------")
-        for i in self.list:
+        for number, i in enumerate(self.list, 1):
             file_size = i["Size"]
             if file_size > 1048576:
                 download_size_print = str(round(file_size / 1048576, 2)) + "M"
@@ -186,7 +396,7 @@ class Pan123:
             if i["Type"] == 0:
                 print(
                     "\033[33m" + "编号:",
-                    self.list.index(i) + 1,
+                    number,
                     "\033[0m \t\t" + download_size_print + "\t\t\033[36m",
                     i["FileName"],
                     "\033[0m",
@@ -194,7 +404,7 @@ class Pan123:
             elif i["Type"] == 1:
                 print(
                     "\033[35m" + "编号:",
-                    self.list.index(i) + 1,
+                    number,
                     " \t\t\033[36m",
                     i["FileName"],
                     "\033[0m",
@@ -203,34 +413,32 @@ class Pan123:
         print("--------------------")
 
     # fileNumber 从0开始，0为第一个文件，传入时需要减一 ！！！
-    def link(self, file_number, showlink=True):
-        file_detail = self.list[file_number]
-        type_detail = file_detail["Type"]
-        if type_detail == 1:
-            down_request_url = "https://www.123pan.com/a/api/file/batch_download_info"
-            down_request_data = {"fileIdList": [{"fileId": int(file_detail["FileId"])}]}
+    def link(self, file_number, showlink=True, refresh=False):
+        return self.link_file(self.list[file_number], showlink, refresh)
 
-        else:
-            down_request_url = "https://www.123pan.com/a/api/file/download_info"
-            down_request_data = {
-                "driveId": 0,
-                "etag": file_detail["Etag"],
-                "fileId": file_detail["FileId"],
-                "s3keyFlag": file_detail["S3KeyFlag"],
-                "type": file_detail["Type"],
-                "fileName": file_detail["FileName"],
-                "size": file_detail["Size"],
-            }
+    def link_file(self, file_detail, showlink=True, refresh=False):
+        """根据文件详情获取下载直链，文件直链在有效期内从缓存返回，refresh=True时强制重新获取"""
+        type_detail = file_detail["Type"]
+        # 文件夹打包链接每次单独生成，不缓存
+        cache_key = (file_detail["FileId"], file_detail.get("Etag")) if type_detail == 0 else None
+        if cache_key is not None:
+            if refresh:
+                self.link_cache.invalidate(cache_key)
+            else:
+                redirect_url = self.link_cache.get(cache_key)
+                if redirect_url:
+                    if showlink:
+                        print(redirect_url)
+                    return redirect_url
+        down_request_url, down_request_data = self.link_request(file_detail)
         # print(down_request_data)
 
         # sign = getSign("/a/api/file/download_info")
 
-        link_res = requests.post(
+        link_res = self.session.post(
             down_request_url,
-            headers=self.header_logined,
             # params={sign[0]: sign[1]},
-            data=json.dumps(down_request_data),
-            timeout=10
+            data=json.dumps(down_request_data)
         )
         # print(linkRes.text)
         res_code_download = link_res.json()["code"]
@@ -239,343 +447,251 @@ class Pan123:
             # print(linkRes.json())
             return res_code_download
         down_load_url = link_res.json()["data"]["DownloadUrl"]
-        next_to_get = requests.get(down_load_url, timeout=10, allow_redirects=False).text
-        url_pattern = re.compile(r"href='(https?://[^']+)'")
-        redirect_url = url_pattern.findall(next_to_get)[0]
+        next_to_get = self.storage_session.get(down_load_url, allow_redirects=False).text
+        redirect_url = self.parse_redirect(next_to_get)
+        if cache_key is not None:
+            self.link_cache.put(cache_key, redirect_url)
         if showlink:
             print(redirect_url)
 
         return redirect_url
 
-    def download(self, file_number, download_path="download/", progress_callback=None, recursive=False):
-        file_detail = self.list[file_number]
-        if file_detail["Type"] == 1 and not recursive:
-            # 文件夹但未启用递归下载，使用ZIP打包
-            file_name = file_detail["FileName"] + ".zip"
-            print(f"开始下载文件夹（ZIP打包）: {file_name}")
-            down_load_url = self.link(file_number, showlink=False)
-            if down_load_url is None:
-                print("获取下载链接失败")
-                return False
-                
-            # 确保下载路径以斜杠结尾
-            download_path = download_path.rstrip("/") + "/"
-            
-            # 处理下载路径
-            if not os.path.exists(download_path):
-                os.makedirs(download_path)
-            file_path = os.path.join(download_path, file_name)
-                
-            # 优先使用文件详情中的大小（更可靠）
-            file_size = file_detail["Size"]
-            content_size = file_size
-            
-            print(f"文件大小: {content_size} 字节")
-            
-            # 初始化进度信息
-            progress_info = {
-                'filename': file_name,
-                'total': content_size,
-                'downloaded': 0,
-                'percentage': 0,
-                'speed': '0K/S'
+    @staticmethod
+    def link_request(file_detail):
+        """获取下载地址的接口和请求数据：文件夹为打包下载，文件为单文件下载"""
+        if file_detail["Type"] == 1:
+            down_request_url = "https://www.123pan.com/a/api/file/batch_download_info"
+            down_request_data = {"fileIdList": [{"fileId": int(file_detail["FileId"])}]}
+
+        else:
+            down_request_url = "https://www.123pan.com/a/api/file/download_info"
+            down_request_data = {
+                "driveId": 0,
+                "etag": file_detail["Etag"],
+                "fileId": file_detail["FileId"],
+                "s3keyFlag": file_detail["S3KeyFlag"],
+                "type": file_detail["Type"],
+                "fileName": file_detail["FileName"],
+                "size": file_detail["Size"],
             }
-            
-            if progress_callback:
-                progress_callback(progress_info)
-                
-            retry_count = 0
-            max_retries = 3
-            success = False
-            
-            while not success and retry_count < max_retries:
-                try:
-                    print(f"尝试下载 (重试 {retry_count+1}/{max_retries})")
-                    with requests.get(down_load_url, stream=True, timeout=30) as r:
-                        r.raise_for_status()
-                        
-                        # 获取实际内容长度（如果可用）
-                        content_length = r.headers.get('Content-Length')
-                        if content_length:
-                            content_size = int(content_length)
-                            print(f"从响应头获取文件大小: {content_size} 字节")
-                            progress_info['total'] = content_size
-                            if progress_callback:
-                                progress_callback(progress_info)
-                        
-                        downloaded = 0
-                        start_time = time.time()
-                        last_update = start_time
-                        
-                        with open(file_path, "wb") as f:
-                            for chunk in r.iter_content(chunk_size=8192):
-                                if chunk:
-                                    f.write(chunk)
-                                    downloaded += len(chunk)
-                                    
-                                    # 更新进度信息
-                                    progress_info['downloaded'] = downloaded
-                                    progress_info['percentage'] = int((downloaded / content_size) * 100) if content_size > 0 else 0
-                                    
-                                    # 每秒更新速度
-                                    current_time = time.time()
-                                    if current_time - last_update >= 1.0:
-                                        elapsed = current_time - start_time
-                                        speed = downloaded / elapsed if elapsed > 0 else 0
-                                        speed_m = speed / 1048576
-                                        if speed_m > 1:
-                                            progress_info['speed'] = f"{speed_m:.2f}M/S"
-                                        else:
-                                            progress_info['speed'] = f"{speed_m * 1024:.2f}K/S"
-                                        
-                                        if progress_callback:
-                                            progress_callback(progress_info)
-                                        last_update = current_time
-                                    
-                            # 最终进度更新
-                            if downloaded > 0:
-                                progress_info['downloaded'] = downloaded
-                                progress_info['percentage'] = 100
-                                progress_info['speed'] = "完成"
-                                if progress_callback:
-                                    progress_callback(progress_info)
-                                print("下载完成")
-                                success = True
-                                return True
-                            else:
-                                print("下载失败：未接收到数据")
-                                
-                except (requests.exceptions.ChunkedEncodingError,
-                        requests.exceptions.ConnectionError,
-                        requests.exceptions.Timeout,
-                        requests.exceptions.RequestException) as e:
-                    print(f"下载出错: {str(e)}")
-                    retry_count += 1
-                    time.sleep(2)
-                    
-            print("下载失败，超过最大重试次数")
-            return False
-        elif file_detail["Type"] == 1 and recursive:
+        return down_request_url, down_request_data
+
+    @staticmethod
+    def parse_redirect(page):
+        """从下载地址返回的跳转页中取出真实直链"""
+        return REDIRECT_PATTERN.findall(page)[0]
+
+    def link_files(self, file_details, workers=LINK_WORKERS):
+        """批量获取多个文件的下载直链，返回 {FileId: 直链}，获取失败的为None
+
+        batch_download_info 对多个文件只返回一个打包下载链接，所以这里对未命中缓存的
+        文件并发请求 download_info 并解析跳转，结果写入直链缓存供随后的下载使用。
+        """
+        results = {}
+        pending = []
+        for file_detail in file_details:
+            if file_detail["Type"] != 0:
+                continue
+            url = self.link_cache.get((file_detail["FileId"], file_detail.get("Etag")))
+            if url:
+                results[file_detail["FileId"]] = url
+            else:
+                pending.append(file_detail)
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+                for file_detail, url in zip(pending, pool.map(self._link_or_none, pending)):
+                    results[file_detail["FileId"]] = url
+        return results
+
+    def _link_or_none(self, file_detail):
+        try:
+            url = self.link_file(file_detail, showlink=False)
+        except Exception as e:
+            print(f"获取下载链接失败: {file_detail['FileName']}, {str(e)}")
+            return None
+        return url if isinstance(url, str) else None
+
+    def transfer_engine(self):
+        """返回基于asyncio的传输引擎（同步外观），首次调用时创建，需要安装aiohttp"""
+        with self._transfer_engine_lock:
+            if self._transfer_engine is None:
+                self._transfer_engine = TransferEngine(self)
+            return self._transfer_engine
+
+    def drive_index(self):
+        """返回云盘元数据的本地索引，首次调用时打开数据库"""
+        with self._drive_index_lock:
+            if self._drive_index is None:
+                self._drive_index = DriveIndex(self)
+            return self._drive_index
+
+    def find(self, name=None, ext=None, min_size=None, max_size=None, limit=SEARCH_LIMIT):
+        """在本地索引中查找文件并打印，索引为空时先建立索引"""
+        index = self.drive_index()
+        if index.stats()['updated'] is None:
+            print("索引为空，正在遍历云盘建立索引...")
+            self.update_index()
+        results = index.search(name=name, ext=ext, min_size=min_size, max_size=max_size, limit=limit)
+        print("--------------------")
+        for item in results:
+            size_print = str(round(item["Size"] / 1048576, 2)) + "M" if item["Type"] == 0 else "文件夹"
+            print(f"{item['FileId']:>12}  {size_print:>10}  {item['Path']}")
+        print(f"共 {len(results)} 项")
+        print("--------------------")
+        return results
+
+    def update_index(self, full=False):
+        """刷新本地索引，full=True 时重新遍历整个云盘"""
+        stats = self.drive_index().refresh(
+            full=full,
+            progress_callback=lambda s: print(
+                f"\r已列出 {s['folders_listed']} 个文件夹, {s['items']} 项", end=""
+            ),
+        )
+        print(f"\n索引刷新完成: 列出 {stats['folders_listed']} 个文件夹, "
+              f"其中 {stats['folders_skipped']} 个未变化, 失败 {stats['folders_failed']} 个")
+        return stats
+
+    def link_resolver(self, file_detail):
+        """返回供下载器使用的直链获取函数，直链失效（403/410）时由下载器调用刷新"""
+        def resolve(refresh=False):
+            url = self.link_file(file_detail, showlink=False, refresh=refresh)
+            return url if isinstance(url, str) else None
+        return resolve
+
+    def download(self, file_number, download_path="download/", progress_callback=None, recursive=False,
+                 connections=DEFAULT_CONNECTIONS, task_bucket=None, control=None):
+        file_detail = self.list[file_number]
+        if file_detail["Type"] == 1 and recursive:
             # 递归下载文件夹
             folder_name = file_detail["FileName"]
             print(f"开始递归下载文件夹: {folder_name}")
-            return self.download_folder_recursive(file_detail, download_path, progress_callback, file_detail["FileId"])
+            return self.download_folder_recursive(file_detail, download_path, progress_callback, file_detail["FileId"],
+                                                  task_bucket=task_bucket, control=control)
+
+        return self.download_file(file_detail, download_path, progress_callback, connections, task_bucket, control)
+
+    def download_file(self, file_detail, download_path="download/", progress_callback=None,
+                      connections=DEFAULT_CONNECTIONS, task_bucket=None, control=None):
+        """根据文件详情下载单个文件，文件夹按ZIP打包下载
+
+        control 为 TaskControl 时，暂停会断开连接并保存断点，继续后从断点下载。
+        """
+        if file_detail["Type"] == 1:
+            # 文件夹但未启用递归下载，使用ZIP打包
+            file_name = file_detail["FileName"] + ".zip"
+            print(f"开始下载文件夹（ZIP打包）: {file_name}")
         else:
             # 单个文件下载
             file_name = file_detail["FileName"]
             print(f"开始下载: {file_name}")
-            down_load_url = self.link(file_number, showlink=False)
-            if down_load_url is None:
-                print("获取下载链接失败")
-                return False
-                
-            # 确保下载路径以斜杠结尾
-            download_path = download_path.rstrip("/") + "/"
-            
-            # 处理下载路径
-            if not os.path.exists(download_path):
-                os.makedirs(download_path)
-            file_path = os.path.join(download_path, file_name)
-                
-            # 优先使用文件详情中的大小（更可靠）
-            file_size = file_detail["Size"]
-            content_size = file_size
-            
-            print(f"文件大小: {content_size} 字节")
-            
-            # 初始化进度信息
-            progress_info = {
-                'filename': file_name,
-                'total': content_size,
-                'downloaded': 0,
-                'percentage': 0,
-                'speed': '0K/S'
-            }
-            
-            if progress_callback:
-                progress_callback(progress_info)
-                
-            retry_count = 0
-            max_retries = 3
-            success = False
-            
-            while not success and retry_count < max_retries:
-                try:
-                    print(f"尝试下载 (重试 {retry_count+1}/{max_retries})")
-                    with requests.get(down_load_url, stream=True, timeout=30) as r:
-                        r.raise_for_status()
-                        
-                        # 获取实际内容长度（如果可用）
-                        content_length = r.headers.get('Content-Length')
-                        if content_length:
-                            content_size = int(content_length)
-                            print(f"从响应头获取文件大小: {content_size} 字节")
-                            progress_info['total'] = content_size
-                            if progress_callback:
-                                progress_callback(progress_info)
-                        
-                        downloaded = 0
-                        start_time = time.time()
-                        last_update = start_time
-                        
-                        with open(file_path, "wb") as f:
-                            for chunk in r.iter_content(chunk_size=8192):
-                                if chunk:
-                                    f.write(chunk)
-                                    downloaded += len(chunk)
-                                    
-                                    # 更新进度信息
-                                    progress_info['downloaded'] = downloaded
-                                    progress_info['percentage'] = int((downloaded / content_size) * 100) if content_size > 0 else 0
-                                    
-                                    # 每秒更新速度
-                                    current_time = time.time()
-                                    if current_time - last_update >= 1.0:
-                                        elapsed = current_time - start_time
-                                        speed = downloaded / elapsed if elapsed > 0 else 0
-                                        speed_m = speed / 1048576
-                                        if speed_m > 1:
-                                            progress_info['speed'] = f"{speed_m:.2f}M/S"
-                                        else:
-                                            progress_info['speed'] = f"{speed_m * 1024:.2f}K/S"
-                                        
-                                        if progress_callback:
-                                            progress_callback(progress_info)
-                                        last_update = current_time
-                                    
-                            # 最终进度更新
-                            if downloaded > 0:
-                                progress_info['downloaded'] = downloaded
-                                progress_info['percentage'] = 100
-                                progress_info['speed'] = "完成"
-                                if progress_callback:
-                                    progress_callback(progress_info)
-                                print("下载完成")
-                                success = True
-                                return True
-                            else:
-                                print("下载失败：未接收到数据")
-                                
-                except (requests.exceptions.ChunkedEncodingError,
-                        requests.exceptions.ConnectionError,
-                        requests.exceptions.Timeout,
-                        requests.exceptions.RequestException) as e:
-                    print(f"下载出错: {str(e)}")
-                    retry_count += 1
-                    time.sleep(2)
-                    
-            print("下载失败，超过最大重试次数")
+        down_load_url = self.link_file(file_detail, showlink=False)
+        if down_load_url is None or isinstance(down_load_url, int):
+            print("获取下载链接失败")
             return False
 
-    def download_folder_recursive(self, folder_detail, base_download_path="download/", progress_callback=None, top_folder_id=None):
-        """递归下载文件夹及其内容"""
-        folder_name = folder_detail["FileName"]
-        folder_id = folder_detail["FileId"]
-        
+        # 确保下载路径以斜杠结尾
+        download_path = download_path.rstrip("/") + "/"
+
+        # 处理下载路径（文件夹下载时多个线程可能同时创建）
+        os.makedirs(download_path, exist_ok=True)
+        file_path = os.path.join(download_path, file_name)
+
+        # 优先使用文件详情中的大小（更可靠）
+        file_size = file_detail["Size"]
+        print(f"文件大小: {file_size} 字节")
+
+        # 初始化进度信息
+        progress_info = {
+            'filename': file_name,
+            'total': file_size,
+            'downloaded': 0,
+            'percentage': 0,
+            'speed': '0K/S'
+        }
+
+        if progress_callback:
+            progress_callback(progress_info)
+
+        # 支持Range的文件按字节区间多连接并行下载，失败时只重试出错的分段，中断后可从断点继续
+        downloader = SegmentedDownloader(
+            down_load_url,
+            file_path,
+            file_size,
+            session=self.storage_session,
+            connections=connections,
+            progress_callback=progress_callback,
+            progress_info=progress_info,
+            etag=file_detail.get("Etag") or None,
+            url_resolver=self.link_resolver(file_detail),
+            task_bucket=task_bucket,
+            control=control,
+            expected_md5=file_detail.get("Etag") if file_detail["Type"] == 0 else None,
+        )
+        if downloader.run():
+            print("下载完成" + ("，MD5校验通过" if downloader.verify_status == VERIFIED else ""))
+            return True
+        if downloader.verify_status != MISMATCH:
+            print("下载失败，超过最大重试次数")
+        return False
+
+    def download_volumes(self, manifest_detail, download_path="download/", connections=DEFAULT_CONNECTIONS,
+                         task_bucket=None, control=None):
+        """根据 upload_stream 上传的清单下载全部分卷并拼接还原，核对大小和MD5，成功返回True"""
+        volume_downloader = VolumeDownloader(
+            self,
+            manifest_detail,
+            download_path,
+            connections=connections,
+            task_bucket=task_bucket,
+            control=control,
+        )
+        return volume_downloader.run()
+
+    def download_folder_recursive(self, folder_detail, base_download_path="download/", progress_callback=None, top_folder_id=None,
+                                  workers=4, connections=1, task_bucket=None, control=None, engine="thread"):
+        """递归下载文件夹及其内容
+
+        子文件夹并发列出，文件交给有界线程池并行下载，不改变当前目录状态。
+        engine="async" 时改用异步传输引擎，适合包含大量小文件的文件夹。
+        """
         # 如果是顶级文件夹，设置top_folder_id
         if top_folder_id is None:
-            top_folder_id = folder_id
-        
-        # 保存当前目录状态
-        current_parent = self.parent_file_id
-        current_list = self.list
-        
+            top_folder_id = folder_detail["FileId"]
+        if control is None:
+            control = TaskControl()
+        folder_controls[top_folder_id] = control
+
         try:
-            # 进入文件夹
-            self.parent_file_id = folder_id
-            self.get_dir()
-            
-            # 创建本地文件夹
-            local_folder_path = os.path.join(base_download_path, folder_name)
-            if not os.path.exists(local_folder_path):
-                os.makedirs(local_folder_path)
-            
-            total_files = 0
-            downloaded_files = 0
-            
-            # 首先统计所有文件数量
-            for item in self.list:
-                if item["Type"] == 0:  # 文件
-                    total_files += 1
-                elif item["Type"] == 1:  # 文件夹
-                    total_files += 1  # 计数文件夹本身，后续会递归
-            
-            if progress_callback:
-                progress_callback({
-                    'filename': f"文件夹: {folder_name}",
-                    'total': total_files,
-                    'downloaded': downloaded_files,
-                    'percentage': 0,
-                    'speed': '开始下载'
-                })
-            
-            # 遍历当前文件夹内容
-            for index, item in enumerate(self.list):
-                # 检查文件夹下载是否被暂停
-                while folder_pause_flags.get(top_folder_id, False):
-                    time.sleep(1)
-                    # 更新进度显示暂停状态
-                    if progress_callback:
-                        progress_callback({
-                            'filename': f"文件夹: {folder_name}",
-                            'status': 'paused',
-                            'downloaded': downloaded_files,
-                            'total': total_files,
-                            'percentage': int((downloaded_files / total_files) * 100) if total_files > 0 else 0,
-                            'speed': '已暂停'
-                        })
-                
-                if item["Type"] == 0:  # 文件
-                    # 下载文件
-                    file_name = item["FileName"]
-                    print(f"下载文件: {file_name}")
-                    if self.download(index, local_folder_path, progress_callback):
-                        downloaded_files += 1
-                    else:
-                        print(f"文件下载失败: {file_name}")
-                    
-                    # 更新文件夹下载进度
-                    if progress_callback:
-                        percentage = int((downloaded_files / total_files) * 100) if total_files > 0 else 0
-                        progress_callback({
-                            'filename': f"文件夹: {folder_name}",
-                            'total': total_files,
-                            'downloaded': downloaded_files,
-                            'percentage': percentage,
-                            'speed': f"{downloaded_files}/{total_files} 文件",
-                            'status': 'downloading'
-                        })
-                
-                elif item["Type"] == 1:  # 文件夹
-                    # 递归下载子文件夹
-                    print(f"进入子文件夹: {item['FileName']}")
-                    if self.download_folder_recursive(item, local_folder_path, progress_callback, top_folder_id):
-                        downloaded_files += 1
-                    else:
-                        print(f"文件夹下载失败: {item['FileName']}")
-                    
-                    # 更新文件夹下载进度
-                    if progress_callback:
-                        percentage = int((downloaded_files / total_files) * 100) if total_files > 0 else 0
-                        progress_callback({
-                            'filename': f"文件夹: {folder_name}",
-                            'total': total_files,
-                            'downloaded': downloaded_files,
-                            'percentage': percentage,
-                            'speed': f"{downloaded_files}/{total_files} 文件",
-                            'status': 'downloading'
-                        })
-            
-            return True
-            
+            if engine == "async":
+                try:
+                    transfer_engine = self.transfer_engine()
+                except RuntimeError as e:
+                    # 没有安装aiohttp时退回线程下载
+                    print(f"{str(e)}，改用线程下载")
+                else:
+                    return transfer_engine.download_folder(
+                        folder_detail, base_download_path, progress_callback, task_bucket, control
+                    )
+            folder_downloader = FolderDownloader(
+                self,
+                folder_detail,
+                base_download_path,
+                progress_callback,
+                workers=workers,
+                connections=connections,
+                task_bucket=task_bucket,
+                control=control,
+            )
+            return folder_downloader.run()
+        except TaskInterrupted:
+            raise
         except Exception as e:
             print(f"递归下载文件夹失败: {str(e)}")
             return False
         finally:
-            # 恢复目录状态
-            self.parent_file_id = current_parent
-            self.list = current_list
-            self.get_dir()
+            if folder_controls.get(top_folder_id) is control:
+                del folder_controls[top_folder_id]
 
     def recycle(self):
         recycle_id = 0
@@ -585,7 +701,7 @@ class Pan123:
                 + str(recycle_id)
                 + "&trashed=true&&Page=1"
         )
-        recycle_res = requests.get(url, headers=self.header_logined, timeout=10)
+        recycle_res = self.session.get(url)
         json_recycle = recycle_res.json()
         recycle_list = json_recycle["data"]["InfoList"]
         self.recycle_list = recycle_list
@@ -609,21 +725,34 @@ class Pan123:
             else:
                 print("文件不存在")
                 return
+        dele_json = self._trash(file_detail, operation)
+        print(dele_json)
+        message = dele_json["message"]
+        print(message)
+
+    def trash_file(self, file_detail):
+        """把任意文件夹中的一个文件移入回收站，不要求它在当前浏览的文件夹中，成功返回True"""
+        return self._trash(file_detail, True).get("code") == 0
+
+    def _trash(self, file_detail, operation=True):
+        """移入回收站（operation=True）或从回收站恢复，更新列表缓存，返回接口的JSON"""
         data_delete = {
             "driveId": 0,
             "fileTrashInfoList": file_detail,
             "operation": operation,
         }
-        delete_res = requests.post(
+        delete_res = self.session.post(
             "https://www.123pan.com/a/api/file/trash",
-            data=json.dumps(data_delete),
-            headers=self.header_logined,
-            timeout=10
+            data=json.dumps(data_delete)
         )
         dele_json = delete_res.json()
-        print(dele_json)
-        message = dele_json["message"]
-        print(message)
+        if dele_json.get("code") == 0:
+            parent_file_id = file_detail.get("ParentFileId", self.parent_file_id)
+            if operation:
+                self.listing_cache.remove_item(parent_file_id, file_detail["FileId"])
+            else:
+                self.listing_cache.invalidate(parent_file_id)
+        return dele_json
 
     def share(self):
         file_id_list = ""
@@ -655,11 +784,9 @@ class Pan123:
                 "sharePwd": share_pwd,
                 "event": "shareCreate"
             }
-            share_res = requests.post(
+            share_res = self.session.post(
                 "https://www.123pan.com/a/api/share/create",
-                headers=self.header_logined,
-                data=json.dumps(data),
-                timeout=10
+                data=json.dumps(data)
             )
             share_res_json = share_res.json()
             if share_res_json["code"] != 0:
@@ -674,7 +801,7 @@ class Pan123:
         else:
             print("退出分享")
 
-    def up_load(self, file_path):
+    def up_load(self, file_path, task_bucket=None):
         file_path = file_path.replace('"', "")
         file_path = file_path.replace("\\", "/")
         file_name = file_path.split("/")[-1]
@@ -683,40 +810,81 @@ class Pan123:
             print("文件不存在，请检查路径是否正确")
             return
         if os.path.isdir(file_path):
-            print("暂不支持文件夹上传")
-            return
+            return self.upload_folder(file_path, self.parent_file_id, task_bucket=task_bucket)
+        return self.upload_file(file_path, self.parent_file_id, task_bucket=task_bucket)
+
+    def upload_file(self, file_path, parent_file_id, duplicate=None, task_bucket=None):
+        """上传单个文件到指定文件夹，成功返回True
+
+        duplicate 为同名文件的处理方式（1覆盖，2保留两者），为None时遇到同名文件询问用户。
+        """
+        file_name = os.path.basename(file_path)
         fsize = os.path.getsize(file_path)
-        with open(file_path, "rb") as f:
-            md5 = hashlib.md5()
-            while True:
-                data = f.read(64 * 1024)
-                if not data:
-                    break
-                md5.update(data)
-            readable_hash = md5.hexdigest()
+        if task_bucket is None:
+            # 单独上传的文件是一个任务，按单任务上传限速
+            task_bucket = bandwidth_limiter.task_bucket("upload")
+        # 同一文件上次未完成的上传，沿用原会话只补传缺少的分块
+        session = self.upload_sessions.find(file_path, parent_file_id)
+        if session is not None:
+            print(f"发现未完成的上传，继续上传: {file_name}")
+            result = self._upload_parts(file_path, session, fsize, task_bucket, resume=True)
+            if result is not None:
+                return result
+            print("上次的上传已失效，重新开始")
+            self.upload_sessions.remove(file_path)
+
+        reuse, session = self._request_upload(file_path, parent_file_id, duplicate)
+        if reuse is None:
+            return False
+        if reuse:
+            self.listing_cache.invalidate(parent_file_id)
+            print(f"上传成功，文件已MD5复用: {file_name}")
+            return True
+        print("上传文件的fileId:", session["FileId"])
+        return self._upload_parts(file_path, session, fsize, task_bucket)
+
+    def _request_upload(self, file_path, parent_file_id, duplicate=None):
+        """计算MD5并发送 upload_request
+
+        返回 (是否秒传, 上传会话)：秒传成功时为 (True, None)；需要上传数据时保存新的上传会话，
+        返回 (False, 会话)；请求失败或取消时返回 (None, None)。
+        """
+        file_name = os.path.basename(file_path)
+        fsize = os.path.getsize(file_path)
+        # 分块大小按文件大小和实测速度选择，记录在上传会话中，续传时沿用
+        try:
+            part_size = choose_part_size(fsize, upload_throughput.rate)
+        except UploadError as e:
+            print(str(e))
+            return None, None
+
+        # 未改动的文件直接使用缓存的MD5；否则在哈希线程池中边预读边计算，
+        # 能留在页缓存中的文件，随后上传分块时直接命中缓存
+        readable_hash = self.hasher.file_md5(file_path)
 
         list_up_request = {
             "driveId": 0,
             "etag": readable_hash,
             "fileName": file_name,
-            "parentFileId": self.parent_file_id,
+            "parentFileId": parent_file_id,
             "size": fsize,
             "type": 0,
-            "duplicate": 0,
+            "duplicate": duplicate or 0,
         }
 
         # sign = getSign("/b/api/file/upload_request")
-        up_res = requests.post(
+        up_res = self.session.post(
             "https://www.123pan.com/b/api/file/upload_request",
-            headers=self.header_logined,
             # params={sign[0]: sign[1]},
-            data=list_up_request,
-            timeout=10
+            data=list_up_request
         )
         up_res_json = up_res.json()
         res_code_up = up_res_json["code"]
         if res_code_up == 5060:
-            sure_upload = input("检测到1个同名文件,输入1覆盖，2保留两者，0取消：")
+            if duplicate is None:
+                sure_upload = input("检测到1个同名文件,输入1覆盖，2保留两者，0取消：")
+            else:
+                sure_upload = str(duplicate)
             if sure_upload == "1":
                 list_up_request["duplicate"] = 1
 
@@ -724,14 +892,12 @@ class Pan123:
                 list_up_request["duplicate"] = 2
             else:
                 print("取消上传")
-                return
+                return None, None
             # sign = getSign("/b/api/file/upload_request")
-            up_res = requests.post(
+            up_res = self.session.post(
                 "https://www.123pan.com/b/api/file/upload_request",
-                headers=self.header_logined,
                 # params={sign[0]: sign[1]},
-                data=json.dumps(list_up_request),
-                timeout=10
+                data=json.dumps(list_up_request)
             )
             up_res_json = up_res.json()
         res_code_up = up_res_json["code"]
@@ -740,144 +906,140 @@ class Pan123:
             # print("上传请求成功")
             reuse = up_res_json["data"]["Reuse"]
             if reuse:
-                print("上传成功，文件已MD5复用")
-                return
+                return True, None
         else:
             print(up_res_json)
             print("上传请求失败")
-            return
+            return None, None
 
-        bucket = up_res_json["data"]["Bucket"]
-        storage_node = up_res_json["data"]["StorageNode"]
-        upload_key = up_res_json["data"]["Key"]
-        upload_id = up_res_json["data"]["UploadId"]
-        up_file_id = up_res_json["data"]["FileId"]  # 上传文件的fileId,完成上传后需要用到
-        print("上传文件的fileId:", up_file_id)
-
-        # 获取已将上传的分块
-        start_data = {
-            "bucket": bucket,
-            "key": upload_key,
-            "uploadId": upload_id,
-            "storageNode": storage_node,
-        }
-        start_res = requests.post(
-            "https://www.123pan.com/b/api/file/s3_list_upload_parts",
-            headers=self.header_logined,
-            data=json.dumps(start_data),
-            timeout=10
+        # 保存上传会话，中断后再次上传同一文件时从服务器已有的分块继续
+        session = self.upload_sessions.save(
+            file_path, parent_file_id, readable_hash, up_res_json["data"], part_size
         )
-        start_res_json = start_res.json()
-        res_code_up = start_res_json["code"]
-        if res_code_up == 0:
-            # print(startResJson)
-            pass
-        else:
-            print(start_data)
-            print(start_res_json)
+        return False, session
 
-            print("获取传输列表失败")
-            return
+    def upload_stream(self, stream, file_name, parent_file_id, volume_size=DEFAULT_VOLUME_SIZE, spool_dir=None,
+                      duplicate=0, task_bucket=None):
+        """从二进制流上传，例如 sys.stdin.buffer，成功返回True
 
-        # 分块，每一块取一次链接，依次上传
-        block_size = 5242880
-        with open(file_path, "rb") as f:
-            part_number_start = 1
-            put_size = 0
-            while True:
-                data = f.read(block_size)
+        按 volume_size 分卷上传并附带清单（用 download_volumes 还原），spool_dir 下的临时文件
+        最多占用两个分卷的空间；整个流不超过一个分卷时直接以 file_name 上传。
+        duplicate 为1时覆盖云盘上的同名文件，否则有同名文件时不上传。
+        """
+        if task_bucket is None:
+            task_bucket = bandwidth_limiter.task_bucket("upload")
+        stream_uploader = StreamUploader(
+            self,
+            stream,
+            file_name,
+            parent_file_id,
+            volume_size=volume_size,
+            spool_dir=spool_dir,
+            duplicate=duplicate,
+            task_bucket=task_bucket,
+        )
+        return stream_uploader.run()
 
-                precent = round(put_size / fsize, 2)
-                print("\r已上传：" + str(precent * 100) + "%", end="")
-                put_size = put_size + len(data)
+    def probe_file(self, file_path, parent_file_id, remote_files=None):
+        """只发送 upload_request 而不上传数据，返回 REUSED、NEEDS_TRANSFER、CONFLICT，失败时返回None
 
-                if not data:
-                    break
-                get_link_data = {
-                    "bucket": bucket,
-                    "key": upload_key,
-                    "partNumberEnd": part_number_start + 1,
-                    "partNumberStart": part_number_start,
-                    "uploadId": upload_id,
-                    "StorageNode": storage_node,
-                }
-
-                get_link_url = (
-                    "https://www.123pan.com/b/api/file/s3_repare_upload_parts_batch"
-                )
-                get_link_res = requests.post(
-                    get_link_url,
-                    headers=self.header_logined,
-                    data=json.dumps(get_link_data),
-                    timeout=10
-                )
-                get_link_res_json = get_link_res.json()
-                res_code_up = get_link_res_json["code"]
-                if res_code_up == 0:
-                    # print("获取链接成功")
-                    pass
-                else:
-                    print("获取链接失败")
-                    # print(getLinkResJson)
-                    return
-                # print(getLinkResJson)
-                upload_url = get_link_res_json["data"]["presignedUrls"][
-                    str(part_number_start)
-                ]
-                # print("上传链接",uploadUrl)
-                requests.put(upload_url, data=data, timeout=10)
-                # print("put")
-
-                part_number_start = part_number_start + 1
-
-        print("\n处理中")
-        # 完成标志
-        # 1.获取已上传的块
-        uploaded_list_url = "https://www.123pan.com/b/api/file/s3_list_upload_parts"
-        uploaded_comp_data = {
-            "bucket": bucket,
-            "key": upload_key,
-            "uploadId": upload_id,
-            "storageNode": storage_node,
-        }
-        # print(uploadedCompData)
-        requests.post(
-            uploaded_list_url,
-            headers=self.header_logined,
-            data=json.dumps(uploaded_comp_data),
-            timeout=10
-        )
-        compmultipart_up_url = (
-            "https://www.123pan.com/b/api/file/s3_complete_multipart_upload"
+        能秒传的文件就此上传完成；需要传输的文件保存上传会话，之后上传时直接沿用。
+        探测不覆盖任何文件：目标文件夹中已有同名文件时不发送请求，内容相同（ETag与本地
+        MD5一致）算作 REUSED，否则返回 CONFLICT；请求本身也以 duplicate=0 发送。
+        remote_files 为目标文件夹中的 {文件名: 文件详情}，为None时列出目标文件夹。
+        """
+        if self.upload_sessions.find(file_path, parent_file_id) is not None:
+            return NEEDS_TRANSFER
+        if remote_files is None:
+            code, items = self.list_dir(parent_file_id)
+            if code != 0:
+                return None
+            remote_files = {item["FileName"]: item for item in items if item["Type"] == 0}
+        existing = remote_files.get(os.path.basename(file_path))
+        if existing is not None:
+            if str(existing.get("Etag", "")).lower() == self.hasher.file_md5(file_path):
+                return REUSED
+            return CONFLICT
+        # duplicate=0：期间出现的同名文件只会让请求失败，不会被覆盖
+        reuse, _ = self._request_upload(file_path, parent_file_id, 0)
+        if reuse is None:
+            return None
+        if reuse:
+            self.listing_cache.invalidate(parent_file_id)
+            return REUSED
+        return NEEDS_TRANSFER
+
+    def probe_folder(self, folder_path, parent_file_id, workers=16, mkdir_workers=4, progress_callback=None):
+        """对本地文件夹做秒传探测，返回统计信息
+
+        在云盘上建好目录结构，所有文件并发计算MD5（走缓存）并发送 upload_request，
+        统计可以秒传和需要实际传输的文件数与字节数；可以秒传的文件同时完成上传。
+        云盘上已有的同名文件不会被覆盖。
+        """
+        probe = UploadProbe(
+            self,
+            folder_path,
+            parent_file_id,
+            workers=workers,
+            mkdir_workers=mkdir_workers,
+            progress_callback=progress_callback,
         )
-        requests.post(
-            compmultipart_up_url,
-            headers=self.header_logined,
-            data=json.dumps(uploaded_comp_data),
-            timeout=10
+        probe.run()
+        return probe.summary()
+
+    def upload_folder(self, folder_path, parent_file_id, workers=4, mkdir_workers=4, duplicate=None, task_bucket=None,
+                      progress_callback=None):
+        """递归上传本地文件夹到指定的云盘文件夹，全部成功返回True
+
+        远程目录树有界并发创建，建好一个目录就开始上传其中的文件，过程中不重新列目录。
+        duplicate 为同名文件的处理方式（1覆盖，2保留两者，0跳过），为None时第一次遇到内容不同的
+        同名文件询问一次；重复上传同一文件夹时内容未变的文件直接跳过。
+        整个文件夹作为一个任务共用一个单任务限速的令牌桶。
+        """
+        if task_bucket is None:
+            task_bucket = bandwidth_limiter.task_bucket("upload")
+        folder_uploader = FolderUploader(
+            self,
+            folder_path,
+            parent_file_id,
+            workers=workers,
+            mkdir_workers=mkdir_workers,
+            duplicate=duplicate,
+            task_bucket=task_bucket,
+            progress_callback=progress_callback,
         )
+        return folder_uploader.run()
+
+    def _upload_parts(self, file_path, session, fsize, task_bucket=None, resume=False):
+        """按保存的会话上传分块并完成上传，成功时删除会话并返回True
 
-        # 3.报告完成上传，关闭upload session
-        if fsize > 64 * 1024 * 1024:
-            time.sleep(3)
-        close_up_session_url = "https://www.123pan.com/b/api/file/upload_complete"
-        close_up_session_data = {"fileId": up_file_id}
-        # print(closeUpSessionData)
-        close_up_session_res = requests.post(
-            close_up_session_url,
-            headers=self.header_logined,
-            data=json.dumps(close_up_session_data),
-            timeout=10
+        失败时保留会话以便下次继续，返回False；会话在服务器上已失效时返回None。
+        """
+        # 分批申请上传链接，分块并发上传，失败的分块单独重试，合并前确认每个分块的ETag
+        uploader = MultipartUploader(
+            self,
+            file_path,
+            session,
+            fsize,
+            part_size=session["part_size"],
+            task_bucket=task_bucket,
+            progress_callback=lambda uploaded, total: print(
+                "\r已上传：" + str(round(uploaded / total * 100 if total else 100, 2)) + "%", end=""
+            ),
         )
-        close_res_json = close_up_session_res.json()
-        # print(closeResJson)
-        res_code_up = close_res_json["code"]
-        if res_code_up == 0:
-            print("上传成功")
-        else:
-            print("上传失败")
-            print(close_res_json)
-            return
+        try:
+            uploader.run(resume=resume)
+        except UploadSessionExpired as e:
+            print(f"\n{str(e)}")
+            return None
+        except (UploadError, requests.exceptions.RequestException) as e:
+            print("\n上传失败")
+            print(str(e))
+            return False
+        self.upload_sessions.remove(file_path)
+        self.listing_cache.invalidate(session["parent_file_id"])
+        print("\n上传成功")
+        return True
 
     # dirId 就是 fileNumber，从0开始，0为第一个文件，传入时需要减一 ！！！（好像文件夹都排在前面）
     def cd(self, dir_num):
@@ -911,12 +1073,13 @@ class Pan123:
         self.get_dir()
         self.show()
 
-    def cdById(self, file_id):
+    def cdById(self, file_id, show=True):
         self.parent_file_id = file_id
         self.parent_file_list.append(self.parent_file_id)
-        self.get_dir()
-        self.get_dir()
-        self.show()
+        code = self.get_dir()
+        if show:
+            self.show()
+        return code
 
     def read_ini(
             self,
@@ -971,12 +1134,19 @@ class Pan123:
                     print("文件夹已存在")
                     return i["FileId"]
 
+        folder_id = self.create_folder(dirname, self.parent_file_id)
+        if folder_id is not None:
+            self.get_dir()
+        return folder_id
+
+    def create_folder(self, dirname, parent_file_id):
+        """在指定文件夹下创建子文件夹，返回新文件夹的FileId，失败返回None；不刷新当前列表"""
         url = "https://www.123pan.com/a/api/file/upload_request"
         data_mk = {
             "driveId": 0,
             "etag": "",
             "fileName": dirname,
-            "parentFileId": self.parent_file_id,
+            "parentFileId": parent_file_id,
             "size": 0,
             "type": 1,
             "duplicate": 1,
@@ -985,12 +1155,10 @@ class Pan123:
             "operateType": 1,
         }
         # sign = getSign("/a/api/file/upload_request")
-        res_mk = requests.post(
+        res_mk = self.session.post(
             url,
-            headers=self.header_logined,
             data=json.dumps(data_mk),
-            # params={sign[0]: sign[1]},
-            timeout=10
+            # params={sign[0]: sign[1]}
         )
         try:
             res_json = res_mk.json()
@@ -1002,15 +1170,26 @@ class Pan123:
         code_mkdir = res_json["code"]
 
         if code_mkdir == 0:
+            self.listing_cache.invalidate(parent_file_id)
             print("创建成功: ", res_json["data"]["FileId"])
-            self.get_dir()
             return res_json["data"]["Info"]["FileId"]
         print(res_json)
         print("创建失败")
         return
 
-
 if __name__ == "__main__":
+    # 从标准输入上传：pg_dump db | python android.py stdin 文件名 [分卷大小MB]
+    if len(sys.argv) >= 3 and sys.argv[1] == "stdin":
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        pan = Pan123(readfile=True, input_pwd=False)
+        volume_mb = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        ok = pan.upload_stream(
+            sys.stdin.buffer,
+            sys.argv[2],
+            pan.parent_file_id,
+            volume_size=volume_mb * 1048576 if volume_mb else DEFAULT_VOLUME_SIZE,
+        )
+        sys.exit(0 if ok else 1)
     pan = Pan123(readfile=True, input_pwd=True)
     pan.show()
     while True:
@@ -1018,7 +1197,7 @@ if __name__ == "__main__":
         if command == "ls":
             pan.show()
         if command == "re":
-            code = pan.get_dir()
+            code = pan.get_dir(refresh=True)
             if code == 0:
                 print("刷新目录成功")
             pan.show()
@@ -1052,6 +1231,11 @@ if __name__ == "__main__":
                     sure = input()
                     if sure != "1":
                         continue
+                elif pan.list[int(command[9:]) - 1]["FileName"].endswith(MANIFEST_SUFFIX):
+                    print("这是分卷上传的清单，输入1下载并还原分卷，其他只下载清单:", end="")
+                    if input() == "1":
+                        pan.download_volumes(pan.list[int(command[9:]) - 1])
+                        continue
                 pan.download(int(command[9:]) - 1)
             else:
                 print("输入错误")
@@ -1075,6 +1259,40 @@ if __name__ == "__main__":
             pan.up_load(filepath)
             pan.get_dir()
             pan.show()
+        elif command == "probe":
+            folder_path = input("请输入要探测的文件夹路径：")
+            if os.path.isdir(folder_path):
+                pan.probe_folder(folder_path, pan.parent_file_id)
+                pan.get_dir()
+                pan.show()
+            else:
+                print("文件夹不存在，请检查路径是否正确")
+        elif command[:7] == "search ":
+            # 服务器端搜索，每页结果到达即打印
+            found = 0
+            for code, items in pan.search(command[7:].strip()):
+                if code != 0:
+                    print("搜索失败")
+                    break
+                for item in items:
+                    found += 1
+                    size_print = str(round(item["Size"] / 1048576, 2)) + "M" if item["Type"] == 0 else "文件夹"
+                    print(f"{item['FileId']:>12}  {size_print:>10}  {item['FileName']}")
+            print(f"共找到 {found} 项")
+        elif command in ("index", "index full"):
+            pan.update_index(full=command == "index full")
+        elif command[:5] == "find ":
+            # find 关键字 [.扩展名] [>最小MB] [<最大MB]
+            keywords = []
+            find_args = {}
+            for word in command[5:].split():
+                if word.startswith(".") and len(word) > 1:
+                    find_args["ext"] = word
+                elif word[0] in "<>" and word[1:].replace(".", "", 1).isdigit():
+                    find_args["max_size" if word[0] == "<" else "min_size"] = int(float(word[1:]) * 1048576)
+                else:
+                    keywords.append(word)
+            pan.find(" ".join(keywords) or None, **find_args)
         elif command == "share":
             pan.share()
         elif command[0:6] == "delete":
@@ -0,0 +1,72 @@
+"""本地文件MD5计算的吞吐测试
+
+生成一批临时文件，用 HashService 在不同线程数和读取块大小下计算MD5，输出总吞吐和
+每个核心的吞吐。临时文件刚写入，数据通常在页缓存中，测得的是计算能力而不是磁盘速度。
+
+    python bench_hashing.py --files 16 --size 67108864 --workers 1,2,4,8 --block-sizes 65536,4194304
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from hashing import HashService
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def make_files(directory, count, size):
+    paths = []
+    block = os.urandom(min(size, 1024 * 1024))
+    for index in range(count):
+        path = os.path.join(directory, f"{index}.bin")
+        with open(path, "wb") as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+        paths.append(path)
+    return paths
+
+
+def bench(paths, total_bytes, workers, block_size):
+    service = HashService(workers=workers, block_size=block_size)
+    try:
+        start = time.time()
+        futures = [service.submit(path) for path in paths]
+        ok = sum(1 for future in futures if future.result())
+        elapsed = time.time() - start
+    finally:
+        service.close()
+    megabytes = total_bytes / 1048576
+    cores = min(workers, os.cpu_count() or 1)
+    print(f"线程 {workers:<3} 块 {block_size // 1024:>6}KB  {ok}/{len(paths)} 个文件  耗时 {elapsed:.2f}s  "
+          f"{megabytes / elapsed:.1f} MB/s  每核心 {megabytes / elapsed / cores:.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地文件MD5计算的吞吐测试")
+    parser.add_argument("--files", type=int, default=16, help="文件数量")
+    parser.add_argument("--size", type=int, default=64 * 1024 * 1024, help="单个文件大小（字节）")
+    parser.add_argument("--workers", type=int_list, default=[1, 2, 4, 8], help="线程数，逗号分隔")
+    parser.add_argument("--block-sizes", type=int_list, default=[64 * 1024, 1024 * 1024, 4 * 1024 * 1024],
+                        help="读取块大小（字节），逗号分隔")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_hash_")
+    try:
+        paths = make_files(directory, args.files, args.size)
+        total_bytes = args.files * args.size
+        print(f"{args.files} 个文件 x {args.size} 字节, CPU核心数 {os.cpu_count()}")
+        for block_size in args.block_sizes:
+            for workers in args.workers:
+                bench(paths, total_bytes, workers, block_size)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
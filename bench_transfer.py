@@ -0,0 +1,139 @@
+"""线程下载与异步传输引擎的对比测试
+
+在本机启动一个模拟CDN的HTTP服务器（每个请求附加固定延迟），在相同的并发数下分别用
+线程池 + SegmentedDownloader 和 TransferEngine 下载同一批小文件，输出耗时、吞吐和线程数。
+
+    python bench_transfer.py --files 1000 --size 65536 --latency 0.05 --concurrency 16,64,256
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from android import PooledSession
+from aio_transfer import TransferEngine
+from downloader import SegmentedDownloader
+
+
+def serve(size, latency, port_queue):
+    body = os.urandom(size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(size, latency):
+    """在子进程中运行服务器，线程数统计只包含客户端"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(size, latency, port_queue), daemon=True)
+    process.start()
+    return process, port_queue.get()
+
+
+class ThreadSampler:
+    """后台记录测试期间的最大线程数"""
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.05):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def bench_threaded(urls, out_dir, size, threads):
+    session = PooledSession(pool_size=threads, timeout=30)
+
+    def fetch(index):
+        path = os.path.join(out_dir, f"{index}.bin")
+        return SegmentedDownloader(urls[index], path, size, session=session, connections=1).run()
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(fetch, range(len(urls))))
+
+
+def bench_async(engine, urls, out_dir, size):
+    items = [(url, os.path.join(out_dir, f"{index}.bin"), size) for index, url in enumerate(urls)]
+    return engine.download_urls(items)
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def report(name, concurrency, results, elapsed, size, peak_threads):
+    ok = sum(1 for result in results if result)
+    megabytes = ok * size / 1048576
+    print(f"{name:<8} 并发 {concurrency:<4} {ok}/{len(results)} 成功  耗时 {elapsed:.2f}s  "
+          f"{ok / elapsed:.1f} 文件/秒  {megabytes / elapsed:.2f} MB/s  峰值线程数 {peak_threads}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线程下载与异步传输引擎的对比测试")
+    parser.add_argument("--files", type=int, default=500, help="文件数量")
+    parser.add_argument("--size", type=int, default=64 * 1024, help="单个文件大小（字节）")
+    parser.add_argument("--latency", type=float, default=0.05, help="服务器每个请求的延迟（秒）")
+    parser.add_argument("--concurrency", type=int_list, default=[16, 64, 256],
+                        help="并发数，逗号分隔，两种模式在每个并发数下各测一次")
+    args = parser.parse_args()
+
+    server, port = start_server(args.size, args.latency)
+    urls = [f"http://127.0.0.1:{port}/{index}" for index in range(args.files)]
+    print(f"{args.files} 个文件 x {args.size} 字节, 请求延迟 {args.latency * 1000:.0f}ms")
+
+    try:
+        for concurrency in args.concurrency:
+            engine = TransferEngine(concurrency=concurrency, per_host=concurrency)
+            try:
+                for name, run in (
+                        ("threaded", lambda d: bench_threaded(urls, d, args.size, concurrency)),
+                        ("async", lambda d: bench_async(engine, urls, d, args.size)),
+                ):
+                    out_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+                    try:
+                        with ThreadSampler() as sampler:
+                            start = time.time()
+                            results = run(out_dir)
+                            elapsed = time.time() - start
+                        report(name, concurrency, results, elapsed, args.size, sampler.peak)
+                    finally:
+                        shutil.rmtree(out_dir, ignore_errors=True)
+            finally:
+                engine.close()
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,897 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from ratelimit import bandwidth_limiter
+
+# 分段下载默认参数
+DEFAULT_CONNECTIONS = 4  # 默认并发连接数
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024  # 单个分段的最小字节数，小文件不分段
+CHUNK_SIZE = 64 * 1024  # 每次读取的块大小
+EXPIRED_STATUS = (403, 410)  # 签名直链过期时CDN返回的状态码
+MAX_URL_REFRESHES = 3  # 单次下载最多刷新直链的次数
+JOURNAL_INTERVAL = 1.0  # 断点日志的最短落盘间隔（秒）
+HASH_READ_SIZE = 1024 * 1024  # 补算哈希时每次读取的字节数
+MANIFEST_SUFFIX = ".manifest.json"  # 分卷上传的清单文件后缀（见 StreamUploader）
+LINK_BATCH_SIZE = 16  # 文件夹下载时每批预先获取直链的文件数
+LINK_AHEAD = 64  # 已获取直链、尚未开始下载的文件数上限，避免直链在排队期间过期
+
+# 校验状态
+VERIFIED = 'verified'
+MISMATCH = 'mismatch'
+UNVERIFIABLE = 'unverifiable'
+MD5_PATTERN = re.compile(r"^[0-9a-fA-F]{32}$")
+
+# 同一进程内暂停/失败后保留的哈希进度（.part路径 -> (ETag, 已哈希字节数, md5对象)）
+_hash_states = {}
+_hash_states_lock = threading.Lock()
+
+
+class TaskInterrupted(Exception):
+    """传输被暂停或取消时由 TaskControl.check 抛出，下载器保存断点后原样向上传递"""
+
+
+class TaskControl:
+    """基于事件的传输任务暂停/继续/取消控制
+
+    暂停时立即关闭任务正在读取的HTTP响应，传输线程在 check() 中阻塞等待继续事件，
+    期间不占用CPU；继续后用Range请求从断点接着下载。release_on_pause 为True时，
+    暂停改为抛出 TaskInterrupted 让出工作线程，由调用方稍后重新执行任务。
+    """
+
+    def __init__(self, release_on_pause=False):
+        self.release_on_pause = release_on_pause
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+        self._responses = set()
+        self._listeners = set()
+        self._lock = threading.Lock()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def interrupted(self):
+        """是否需要中断当前的读取（已暂停或已取消）"""
+        return self.paused or self.cancelled
+
+    def pause(self):
+        self._running.clear()
+        self._close_responses()
+
+    def resume(self):
+        self._running.set()
+        self._notify()
+
+    def cancel(self):
+        self._cancelled.set()
+        # 唤醒暂停中等待的线程，让它们看到取消
+        self._running.set()
+        self._close_responses()
+        self._notify()
+
+    def add_listener(self, callback):
+        """登记继续或取消时调用的 callback()，在调用 resume/cancel 的线程中执行
+
+        供不能阻塞线程等待的调用方（异步传输引擎）使用。
+        """
+        with self._lock:
+            self._listeners.add(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            self._listeners.discard(callback)
+
+    def _notify(self):
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
+
+    def check(self):
+        """在传输的检查点调用：取消时抛出，暂停时阻塞到继续（或按 release_on_pause 抛出）"""
+        if self.cancelled:
+            raise TaskInterrupted("cancelled")
+        if self.paused:
+            if self.release_on_pause:
+                raise TaskInterrupted("paused")
+            self._running.wait()
+            if self.cancelled:
+                raise TaskInterrupted("cancelled")
+
+    def attach(self, response):
+        """登记正在读取的响应，暂停或取消时将其关闭"""
+        with self._lock:
+            self._responses.add(response)
+        if self.interrupted:
+            response.close()
+
+    def detach(self, response):
+        with self._lock:
+            self._responses.discard(response)
+
+    def _close_responses(self):
+        with self._lock:
+            responses = list(self._responses)
+        for response in responses:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+
+class FrontierHasher:
+    """按文件顺序增量计算MD5
+
+    MD5只能从头顺序计算。这里维护已哈希的连续前缀（frontier）：写入位置正好在
+    frontier的数据块在写入时直接计算；其他分段的数据先落盘，等frontier推进到那里
+    （前面的分段完成）时再从 .part 补算，这些数据刚写入不久，通常还在页缓存中。
+    单连接下载和同一进程内的暂停/继续全程无需回读文件。
+    """
+
+    def __init__(self, part_path, offset=0, md5=None):
+        self.part_path = part_path
+        self.offset = offset
+        self._md5 = md5 or hashlib.md5()
+        self._lock = threading.Lock()
+
+    def update(self, position, data):
+        """数据写入position之后调用，位于frontier的数据直接计算"""
+        # 正在补算时不等待，这块数据稍后由 catch_up 从磁盘读取
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if position == self.offset:
+                self._md5.update(data)
+                self.offset += len(data)
+        finally:
+            self._lock.release()
+
+    def catch_up(self, limit):
+        """从 .part 补算 [offset, limit) 范围内已经写入的数据"""
+        with self._lock:
+            if self.offset >= limit:
+                return
+            with open(self.part_path, "rb") as f:
+                f.seek(self.offset)
+                while self.offset < limit:
+                    data = f.read(min(HASH_READ_SIZE, limit - self.offset))
+                    if not data:
+                        break
+                    self._md5.update(data)
+                    self.offset += len(data)
+
+    def reset(self):
+        with self._lock:
+            self.offset = 0
+            self._md5 = hashlib.md5()
+
+    def snapshot(self):
+        with self._lock:
+            return self.offset, self._md5.copy()
+
+    def hexdigest(self):
+        with self._lock:
+            return self._md5.hexdigest()
+
+
+def format_size(size):
+    """把字节数格式化为界面使用的大小字符串"""
+    size_m = size / 1048576
+    if size_m > 1024:
+        return f"{size_m / 1024:.2f}G"
+    if size_m > 1:
+        return f"{size_m:.2f}M"
+    return f"{size_m * 1024:.2f}K"
+
+
+def format_speed(speed):
+    """把字节/秒格式化为界面使用的速度字符串"""
+    speed_m = speed / 1048576
+    if speed_m > 1:
+        return f"{speed_m:.2f}M/S"
+    return f"{speed_m * 1024:.2f}K/S"
+
+
+class SegmentedDownloader:
+    """多连接分段下载
+
+    把文件按字节区间切成若干分段，通过HTTP Range并行拉取，每个分段写入目标文件
+    对应的偏移位置。某个分段出错时只重试该分段未完成的部分。服务器不支持Range时
+    退化为单连接下载。
+
+    数据先写入 <文件名>.part，旁边的 <文件名>.part.json 记录文件大小、ETag和各分段
+    已落盘的字节数。进程被杀或连接中断后再次下载同一文件时，从日志记录的位置继续。
+
+    提供 url_resolver(refresh) 时，CDN返回403/410会调用它重新获取直链后继续下载。
+    写入的数据受全局下载限速约束，task_bucket 可额外限制单个任务的速度。
+    control 为 TaskControl 时支持暂停/继续/取消：暂停会立即断开连接并保存断点。
+
+    提供 expected_md5 时边写入边计算MD5（见 FrontierHasher），完成后在进度信息的
+    verify 字段给出 verified/mismatch/unverifiable；校验不一致时丢弃临时文件并返回False。
+    """
+
+    def __init__(
+            self,
+            url,
+            file_path,
+            file_size=0,
+            session=None,
+            connections=DEFAULT_CONNECTIONS,
+            progress_callback=None,
+            progress_info=None,
+            max_retries=3,
+            timeout=30,
+            etag=None,
+            control=None,
+            headers=None,
+            url_resolver=None,
+            task_bucket=None,
+            expected_md5=None,
+    ):
+        self.url = url
+        self.file_path = file_path
+        self.part_path = file_path + ".part"
+        self.journal_path = self.part_path + ".json"
+        self.etag = etag
+        self.control = control
+        self.headers = headers or {}
+        self.url_resolver = url_resolver
+        self.task_bucket = task_bucket
+        self.expected_md5 = expected_md5.lower() if expected_md5 and MD5_PATTERN.match(expected_md5) else None
+        self.hasher = None
+        self.verify_status = None
+        self._url_refreshes = 0
+        self.file_size = file_size
+        self.session = session or requests
+        self.connections = max(1, int(connections))
+        self.progress_callback = progress_callback
+        self.progress_info = progress_info if progress_info is not None else {}
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.ranged = False
+        self.segments = []
+        self.downloaded = 0
+        self.resumed = 0
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._failed = threading.Event()
+        self._start_time = 0
+        self._last_update = 0
+
+    def refresh_url(self, stale_url):
+        """直链过期时重新获取，多个分段同时失败只刷新一次"""
+        if not self.url_resolver:
+            return False
+        with self._lock:
+            if self.url != stale_url:
+                return True
+            if self._url_refreshes >= MAX_URL_REFRESHES:
+                return False
+            self._url_refreshes += 1
+            new_url = self.url_resolver(True)
+            if not new_url or new_url == stale_url:
+                return False
+            self.url = new_url
+        print("下载链接已过期，已重新获取")
+        return True
+
+    def probe(self):
+        """探测服务器是否支持Range，并获取文件真实大小"""
+        try:
+            url = self.url
+            with self.session.get(
+                    url, headers=dict(self.headers, Range="bytes=0-0"), stream=True, timeout=self.timeout
+            ) as r:
+                if r.status_code in EXPIRED_STATUS and self.refresh_url(url):
+                    return self.probe()
+                if self.etag is None:
+                    self.etag = r.headers.get("ETag")
+                if r.status_code == 206:
+                    match = re.match(r"bytes\s+\d+-\d+/(\d+)", r.headers.get("Content-Range", ""))
+                    if match:
+                        self.ranged = True
+                        self.file_size = int(match.group(1))
+                        return
+                content_length = r.headers.get("Content-Length")
+                if r.status_code == 200 and content_length:
+                    self.file_size = int(content_length)
+        except requests.exceptions.RequestException as e:
+            print(f"探测分段下载失败，使用单连接下载: {str(e)}")
+
+    def plan_segments(self):
+        """根据文件大小和连接数划分字节区间"""
+        if not self.ranged or self.connections == 1 or self.file_size < MIN_SEGMENT_SIZE * 2:
+            end = self.file_size - 1 if self.ranged else None
+            self.segments = [{"index": 0, "start": 0, "end": end, "done": 0, "saved": 0}]
+            return
+        segment_size = max(MIN_SEGMENT_SIZE, math.ceil(self.file_size / self.connections))
+        self.segments = []
+        for index, start in enumerate(range(0, self.file_size, segment_size)):
+            end = min(start + segment_size, self.file_size) - 1
+            self.segments.append({"index": index, "start": start, "end": end, "done": 0, "saved": 0})
+
+    def load_journal(self):
+        """读取断点日志，大小和ETag与当前文件一致时返回其中的分段"""
+        if not os.path.exists(self.journal_path) or not os.path.exists(self.part_path):
+            return None
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取断点日志失败，重新下载: {str(e)}")
+            return None
+        if journal.get("size") != self.file_size or journal.get("etag") != self.etag:
+            print("文件已变化，重新下载")
+            return None
+        if os.path.getsize(self.part_path) != self.file_size or not journal.get("segments"):
+            return None
+        return journal["segments"]
+
+    def restore_journal(self):
+        """按断点日志恢复各分段的进度，没有可用的日志时返回False"""
+        segments = self.load_journal()
+        if not segments:
+            return False
+        self.segments = [
+            {"index": i, "start": s["start"], "end": s["end"], "done": s["done"], "saved": s["done"]}
+            for i, s in enumerate(segments)
+        ]
+        self.downloaded = self.resumed = sum(s["done"] for s in self.segments)
+        return True
+
+    def save_journal(self):
+        """原子地写入断点日志，只记录已经落盘的字节"""
+        journal = {
+            "size": self.file_size,
+            "etag": self.etag,
+            "segments": [
+                {"start": s["start"], "end": s["end"], "done": s["saved"]} for s in self.segments
+            ],
+        }
+        with self._journal_lock:
+            temp_path = self.journal_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(journal, f)
+            os.replace(temp_path, self.journal_path)
+
+    def _checkpoint(self, f, segment):
+        """先把分段数据刷到磁盘，再更新断点日志"""
+        f.flush()
+        os.fsync(f.fileno())
+        segment["saved"] = segment["done"]
+        self.save_journal()
+
+    def run(self):
+        """执行下载，成功返回True"""
+        # 小文件重新下载的代价很低，只有较大的文件或存在断点日志时才探测Range
+        if self.file_size == 0 or self.file_size >= MIN_SEGMENT_SIZE or os.path.exists(self.journal_path):
+            self.probe()
+
+        resumed = self.ranged and self.restore_journal()
+        if resumed:
+            print(f"从断点继续下载: {self.downloaded}/{self.file_size} 字节")
+        else:
+            self.plan_segments()
+            # 预先创建临时文件，分段模式下直接扩展到完整大小
+            with open(self.part_path, "wb") as f:
+                if self.ranged and self.file_size > 0:
+                    f.truncate(self.file_size)
+            if self.ranged:
+                self.save_journal()
+
+        if self.expected_md5:
+            self.hasher = self._restore_hasher(resumed)
+            # 跨进程续传时只能从磁盘补算已下载部分的哈希，之后的数据在写入时计算
+            self.hasher.catch_up(self.contiguous())
+
+        self.progress_info['total'] = self.file_size
+        self._start_time = time.time()
+        self._last_update = self._start_time
+        if len(self.segments) > 1:
+            print(f"分段下载: {len(self.segments)} 段, {self.connections} 个连接")
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.connections, len(self.segments))) as pool:
+                results = list(pool.map(self._fetch_segment, self.segments))
+        except TaskInterrupted:
+            self._save_hash_state()
+            raise
+
+        if not all(results):
+            self._save_hash_state()
+            return False
+        if self.file_size > 0 and self.downloaded != self.file_size:
+            print(f"下载不完整: {self.downloaded}/{self.file_size}")
+            self._save_hash_state()
+            return False
+        if not self._verify():
+            return False
+        os.replace(self.part_path, self.file_path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._report(final=True)
+        return True
+
+    def contiguous(self):
+        """从文件开头起连续写入完成的字节数"""
+        position = 0
+        for segment in self.segments:
+            position = segment["start"] + segment["done"]
+            if segment["end"] is None or position <= segment["end"]:
+                break
+        return position
+
+    def _restore_hasher(self, resumed):
+        with _hash_states_lock:
+            state = _hash_states.pop(self.part_path, None)
+        if resumed and state and state[0] == self.etag and state[1] <= self.file_size:
+            return FrontierHasher(self.part_path, state[1], state[2])
+        return FrontierHasher(self.part_path)
+
+    def _save_hash_state(self):
+        """暂停或失败时保留哈希进度，同一进程内继续下载时不必回读已下载的部分"""
+        if self.hasher and self.ranged:
+            offset, md5 = self.hasher.snapshot()
+            with _hash_states_lock:
+                _hash_states[self.part_path] = (self.etag, offset, md5)
+
+    def _verify(self):
+        """比对下载内容的MD5，不一致时丢弃临时文件并返回False"""
+        if not self.hasher:
+            self.verify_status = UNVERIFIABLE
+        else:
+            self.hasher.catch_up(self.contiguous())
+            if self.hasher.hexdigest() == self.expected_md5:
+                self.verify_status = VERIFIED
+            else:
+                self.verify_status = MISMATCH
+        self.progress_info['verify'] = self.verify_status
+        if self.verify_status != MISMATCH:
+            return True
+        print(f"文件校验失败，MD5不一致: {os.path.basename(self.file_path)}")
+        for path in (self.part_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if self.progress_callback:
+            self.progress_callback(self.progress_info)
+        return False
+
+    def _fetch_segment(self, segment):
+        """下载单个分段，失败时从已写入的位置继续重试"""
+        retry_count = 0
+        control = self.control
+        while not self._failed.is_set():
+            if control:
+                # 暂停期间在这里阻塞，继续后从已落盘的位置重新发起Range请求
+                control.check()
+            start = segment["start"] + segment["done"]
+            if segment["end"] is not None and start > segment["end"]:
+                return True
+            headers = dict(self.headers)
+            if self.ranged:
+                headers["Range"] = f"bytes={start}-{segment['end']}"
+            elif start > 0:
+                # 不支持Range时只能从头开始
+                self._advance(-segment["done"])
+                segment["done"] = 0
+                if self.hasher:
+                    self.hasher.reset()
+            url = self.url
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+                    if r.status_code in EXPIRED_STATUS and self.refresh_url(url):
+                        # 换用新直链立即重试，不计入重试次数
+                        continue
+                    r.raise_for_status()
+                    if self.ranged and r.status_code != 206:
+                        raise requests.exceptions.RequestException(f"服务器未返回分段内容: {r.status_code}")
+                    if control:
+                        control.attach(r)
+                    try:
+                        self._write_stream(r, segment, start)
+                    finally:
+                        if control:
+                            control.detach(r)
+                if self._failed.is_set():
+                    return False
+                if control and control.interrupted:
+                    continue
+                if segment["end"] is not None and segment["start"] + segment["done"] <= segment["end"]:
+                    raise requests.exceptions.ChunkedEncodingError("连接提前关闭")
+                if self.hasher:
+                    # 本分段完成后frontier可能推进到后面已下载的分段
+                    self.hasher.catch_up(self.contiguous())
+                return True
+            except Exception as e:
+                if control and control.interrupted:
+                    # 暂停或取消时主动关闭了连接，读取报错属于预期
+                    continue
+                if not isinstance(e, (requests.exceptions.RequestException, OSError)):
+                    raise
+                retry_count += 1
+                print(f"分段 {segment['index']} 下载出错 (重试 {retry_count}/{self.max_retries}): {str(e)}")
+                if retry_count > self.max_retries:
+                    self._failed.set()
+                    return False
+                time.sleep(2)
+        return False
+
+    def _write_stream(self, r, segment, start):
+        """把响应数据写入分段对应的位置，暂停、取消或其他分段失败时提前返回"""
+        control = self.control
+        with open(self.part_path, "r+b") as f:
+            f.seek(start)
+            last_checkpoint = time.time()
+            try:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    if self._failed.is_set() or (control and control.interrupted):
+                        return
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    if self.hasher:
+                        # 补算哈希时从另一个句柄读取，需要先把数据交给操作系统
+                        f.flush()
+                        self.hasher.update(segment["start"] + segment["done"], chunk)
+                    segment["done"] += len(chunk)
+                    self._advance(len(chunk))
+                    bandwidth_limiter.consume("download", len(chunk), self.task_bucket)
+                    if self.ranged and time.time() - last_checkpoint >= JOURNAL_INTERVAL:
+                        self._checkpoint(f, segment)
+                        last_checkpoint = time.time()
+            finally:
+                if self.ranged:
+                    self._checkpoint(f, segment)
+
+    def _advance(self, size):
+        with self._lock:
+            self.downloaded += size
+            current_time = time.time()
+            if current_time - self._last_update >= 1.0:
+                self._last_update = current_time
+                self._report()
+
+    def _report(self, final=False):
+        info = self.progress_info
+        info['downloaded'] = self.downloaded
+        if final:
+            info['percentage'] = 100
+            info['speed'] = "完成"
+        else:
+            total = self.file_size
+            info['percentage'] = int((self.downloaded / total) * 100) if total > 0 else 0
+            elapsed = time.time() - self._start_time
+            info['speed'] = format_speed((self.downloaded - self.resumed) / elapsed if elapsed > 0 else 0)
+        if self.progress_callback:
+            self.progress_callback(info)
+
+
+class FolderDownloader:
+    """并行文件夹下载
+
+    用一个线程池并发列出各级子文件夹，发现的文件交给另一个有界的下载线程池。
+    只通过 Pan123.list_dir 读取目录，不改动 Pan123 实例当前的浏览状态。
+    进度按字节和文件数汇总后通过 progress_callback 上报。control 同时作用于
+    所有正在下载的文件，暂停时各下载线程阻塞等待，不再轮询。
+    文件的直链按 LINK_BATCH_SIZE 分批获取，获取一批就提交一批下载；已获取直链但还没
+    开始下载的文件达到 LINK_AHEAD 个时，遍历线程等待下载跟上再获取下一批。
+    """
+
+    def __init__(
+            self,
+            pan,
+            folder_detail,
+            download_path="download/",
+            progress_callback=None,
+            workers=4,
+            list_workers=4,
+            connections=1,
+            task_bucket=None,
+            control=None,
+    ):
+        self.pan = pan
+        self.folder_detail = folder_detail
+        self.download_path = download_path
+        self.progress_callback = progress_callback
+        self.workers = max(1, int(workers))
+        self.list_workers = max(1, int(list_workers))
+        self.connections = connections
+        self.task_bucket = task_bucket
+        self.control = control
+
+        self.total_bytes = 0
+        self.total_files = 0
+        self.done_files = 0
+        self.failed_files = 0
+        self._file_bytes = {}  # FileId -> 已下载字节数
+        self._pending_lists = 0
+        self._list_failed = False
+        self._interrupted = None
+        self._lock = threading.Lock()
+        self._listing_done = threading.Condition(self._lock)
+        self._linked_ahead = 0
+        self._link_slots = threading.Condition(self._lock)
+        self._start_time = 0
+        self._last_update = 0
+        self._list_pool = None
+        self._download_pool = None
+        self._futures = []
+
+    @property
+    def downloaded_bytes(self):
+        return sum(self._file_bytes.values())
+
+    def run(self):
+        """执行下载，全部文件成功返回True"""
+        folder_name = self.folder_detail["FileName"]
+        self._start_time = time.time()
+        self._last_update = self._start_time
+        self._report('开始下载')
+
+        with ThreadPoolExecutor(max_workers=self.list_workers) as list_pool, \
+                ThreadPoolExecutor(max_workers=self.workers) as download_pool:
+            self._list_pool = list_pool
+            self._download_pool = download_pool
+            self._submit_folder(self.folder_detail, self.download_path)
+            # 等待目录遍历结束，之后不会再提交新的文件
+            with self._listing_done:
+                while self._pending_lists > 0:
+                    self._listing_done.wait()
+            for future in list(self._futures):
+                future.result()
+
+        if self._interrupted is not None:
+            self._report('已暂停', status='paused')
+            raise self._interrupted
+
+        success = self.failed_files == 0 and not self._list_failed
+        if success:
+            print(f"文件夹下载完成: {folder_name} ({self.done_files} 个文件)")
+        else:
+            print(f"文件夹下载未完成: {folder_name}, 失败 {self.failed_files} 个文件")
+        self._report('完成' if success else '下载失败', final=True)
+        return success
+
+    def _submit_folder(self, folder_detail, parent_path):
+        with self._lock:
+            self._pending_lists += 1
+        self._list_pool.submit(self._walk_folder, folder_detail, parent_path)
+
+    def _walk_folder(self, folder_detail, parent_path):
+        """列出一个文件夹：子文件夹继续并发遍历，文件提交到下载线程池"""
+        try:
+            local_folder_path = os.path.join(parent_path, folder_detail["FileName"])
+            os.makedirs(local_folder_path, exist_ok=True)
+            if self._interrupted is not None:
+                return
+            code, items = self.pan.list_dir(folder_detail["FileId"])
+            if code != 0:
+                print(f"列出文件夹失败: {folder_detail['FileName']}, 错误代码: {code}")
+                self._list_failed = True
+                return
+            files = [item for item in items if item["Type"] == 0]
+            for item in items:
+                if item["Type"] == 1:
+                    print(f"进入子文件夹: {item['FileName']}")
+                    self._submit_folder(item, local_folder_path)
+            with self._lock:
+                self.total_files += len(files)
+                for item in files:
+                    self.total_bytes += item["Size"]
+                    self._file_bytes[item["FileId"]] = 0
+            # 分批获取直链，每批获取后立即提交下载，下载线程随后直接命中缓存
+            for start in range(0, len(files), LINK_BATCH_SIZE):
+                batch = files[start:start + LINK_BATCH_SIZE]
+                with self._link_slots:
+                    while self._linked_ahead >= LINK_AHEAD and self._interrupted is None:
+                        self._link_slots.wait()
+                    if self._interrupted is not None:
+                        return
+                    # 整批一次占用名额，多个遍历线程不会各占一部分而互相等待
+                    self._linked_ahead += len(batch)
+                self.pan.link_files(batch, self.list_workers)
+                with self._lock:
+                    for item in batch:
+                        self._futures.append(
+                            self._download_pool.submit(self._download_item, item, local_folder_path)
+                        )
+        except Exception as e:
+            print(f"递归下载文件夹失败: {str(e)}")
+            self._list_failed = True
+        finally:
+            with self._lock:
+                self._pending_lists -= 1
+                self._listing_done.notify_all()
+
+    def _download_item(self, item, local_folder_path):
+        with self._link_slots:
+            self._linked_ahead -= 1
+            self._link_slots.notify_all()
+        if self._interrupted is not None:
+            return
+
+        file_id = item["FileId"]
+        # 暂停后重新开始时，已经完整下载的文件直接跳过
+        local_path = os.path.join(local_folder_path, item["FileName"])
+        if os.path.exists(local_path) and not os.path.exists(local_path + ".part") \
+                and os.path.getsize(local_path) == item["Size"]:
+            with self._lock:
+                self.done_files += 1
+                self._file_bytes[file_id] = item["Size"]
+            return
+
+        def file_progress(progress_info):
+            with self._lock:
+                self._file_bytes[file_id] = max(progress_info.get('downloaded', 0), 0)
+            self._maybe_report()
+
+        print(f"下载文件: {item['FileName']}")
+        try:
+            if self.control:
+                self._check_control()
+            ok = self.pan.download_file(item, local_folder_path, file_progress, self.connections, self.task_bucket,
+                                        self.control)
+        except TaskInterrupted as e:
+            self._interrupted = e
+            return
+        except Exception as e:
+            print(f"文件下载失败: {item['FileName']}, {str(e)}")
+            ok = False
+        with self._lock:
+            if ok:
+                self.done_files += 1
+                self._file_bytes[file_id] = item["Size"]
+            else:
+                self.failed_files += 1
+                print(f"文件下载失败: {item['FileName']}")
+        self._maybe_report()
+
+    def _check_control(self):
+        """暂停时上报一次状态后阻塞等待继续"""
+        if self.control.paused and not self.control.release_on_pause:
+            self._report('已暂停', status='paused')
+        self.control.check()
+
+    def _maybe_report(self):
+        current_time = time.time()
+        if current_time - self._last_update >= 1.0:
+            self._last_update = current_time
+            self._report()
+
+    def _report(self, speed_text=None, final=False, status=None):
+        if not self.progress_callback:
+            return
+        downloaded = self.downloaded_bytes
+        total = self.total_bytes
+        if final and self.failed_files == 0 and not self._list_failed:
+            percentage = 100
+        else:
+            percentage = int((downloaded / total) * 100) if total > 0 else 0
+        if speed_text is None:
+            elapsed = time.time() - self._start_time
+            speed = format_speed(downloaded / elapsed if elapsed > 0 else 0)
+            speed_text = f"{self.done_files}/{self.total_files} 文件 {speed}"
+        self.progress_callback({
+            'filename': f"文件夹: {self.folder_detail['FileName']}",
+            'total': total,
+            'downloaded': downloaded,
+            'percentage': percentage,
+            'speed': speed_text,
+            'files_total': self.total_files,
+            'files_done': self.done_files,
+            'status': status or ('completed' if final and percentage == 100 else 'downloading'),
+        })
+
+
+def safe_file_name(name):
+    """清单等不可信来源给出的文件名只保留最后一段，不能指向下载目录之外
+
+    空名称、"." 和 ".." 抛出 ValueError。
+    """
+    base = os.path.basename(str(name).replace("\\", "/"))
+    if base in ("", ".", ".."):
+        raise ValueError(f"无效的文件名: {name!r}")
+    return base
+
+
+class VolumeDownloader:
+    """下载 StreamUploader 分卷上传的文件并还原
+
+    读取清单，在清单所在的文件夹中找到各分卷，逐个下载（按分卷的ETag校验）后按顺序
+    追加到 <原文件名>.part 并删除分卷，磁盘上除输出文件外最多多占一个分卷。全部拼接后
+    核对清单记录的总大小和MD5，一致时改名为原文件名。
+    """
+
+    def __init__(self, pan, manifest_detail, download_path="download/", connections=DEFAULT_CONNECTIONS,
+                 task_bucket=None, control=None):
+        self.pan = pan
+        self.manifest_detail = manifest_detail
+        self.download_path = download_path
+        self.connections = connections
+        self.task_bucket = task_bucket
+        self.control = control
+
+    def load_manifest(self):
+        url = self.pan.link_file(self.manifest_detail, showlink=False)
+        if not isinstance(url, str):
+            raise ValueError("获取清单下载链接失败")
+        r = self.pan.storage_session.get(url, timeout=30)
+        r.raise_for_status()
+        manifest = r.json()
+        # 清单内容不可信，文件名只能落在下载目录中
+        manifest["name"] = safe_file_name(manifest["name"])
+        for volume in manifest["volumes"]:
+            volume["name"] = safe_file_name(volume["name"])
+        return manifest
+
+    def find_volumes(self, manifest):
+        """返回清单中各分卷在云盘上的文件详情，缺少或内容不一致时抛出 ValueError"""
+        code, items = self.pan.list_dir(self.manifest_detail["ParentFileId"])
+        if code != 0:
+            raise ValueError(f"列出分卷所在文件夹失败, 错误代码: {code}")
+        files = {item["FileName"]: item for item in items if item["Type"] == 0}
+        volumes = []
+        for volume in manifest["volumes"]:
+            item = files.get(volume["name"])
+            if item is None:
+                raise ValueError(f"缺少分卷: {volume['name']}")
+            if item["Size"] != volume["size"] or str(item.get("Etag", "")).lower() != volume["md5"]:
+                raise ValueError(f"分卷与清单不一致: {volume['name']}")
+            volumes.append(item)
+        return volumes
+
+    def run(self):
+        """下载并拼接全部分卷，还原成功返回True"""
+        try:
+            manifest = self.load_manifest()
+            volumes = self.find_volumes(manifest)
+        except (ValueError, KeyError, TypeError, requests.exceptions.RequestException) as e:
+            print(f"读取分卷清单失败: {self.manifest_detail['FileName']}, {str(e)}")
+            return False
+
+        os.makedirs(self.download_path, exist_ok=True)
+        file_path = os.path.join(self.download_path, manifest["name"])
+        part_path = file_path + ".part"
+        md5 = hashlib.md5()
+        size = 0
+        try:
+            with open(part_path, "wb") as out:
+                for index, item in enumerate(volumes, 1):
+                    print(f"下载分卷 {index}/{len(volumes)}: {item['FileName']}")
+                    if not self.pan.download_file(item, self.download_path, connections=self.connections,
+                                                  task_bucket=self.task_bucket, control=self.control):
+                        return False
+                    volume_path = os.path.join(self.download_path, item["FileName"])
+                    with open(volume_path, "rb") as f:
+                        while True:
+                            data = f.read(HASH_READ_SIZE)
+                            if not data:
+                                break
+                            out.write(data)
+                            md5.update(data)
+                            size += len(data)
+                    os.remove(volume_path)
+            if size != manifest["size"] or md5.hexdigest() != manifest["md5"]:
+                print(f"还原后的文件与清单不一致: {manifest['name']}")
+                return False
+            os.replace(part_path, file_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        print(f"分卷还原完成: {manifest['name']}, 大小 {size}, MD5 {md5.hexdigest()}")
+        return True
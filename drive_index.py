@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# 云盘元数据索引的默认参数
+DRIVE_INDEX_FILE = "drive_index.db"  # 索引数据库
+CRAWL_WORKERS = 8  # 同时列出的文件夹数
+SEARCH_LIMIT = 100  # 每次查询默认返回的条数
+SEARCH_LIMIT_MAX = 1000  # 每次查询最多返回的条数
+
+
+class DriveIndex:
+    """云盘文件元数据的本地索引
+
+    把整个云盘的目录树（FileId、父文件夹、文件名、大小、Etag、UpdateAt）保存在一个SQLite
+    数据库中，按文件名、扩展名、大小查询时不需要访问服务器。
+
+    refresh() 并发列出所有文件夹来填充索引。子文件夹内的变化不一定反映到上级文件夹的
+    UpdateAt，所以每次刷新都遍历整棵树；列表与索引中记录相同的文件夹不写入数据库，
+    full=True 时重写所有文件夹。可以在多个线程中共用一个实例。
+    """
+
+    def __init__(self, pan, path=DRIVE_INDEX_FILE, workers=CRAWL_WORKERS):
+        self.pan = pan
+        self.path = path
+        self.workers = max(1, int(workers))
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "file_id INTEGER PRIMARY KEY, parent_id INTEGER, name TEXT, ext TEXT, type INTEGER, "
+                "size INTEGER, etag TEXT, update_at TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_parent ON files (parent_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_ext ON files (ext, size)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_size ON files (size)")
+            # 每个文件夹最近一次列出时的 UpdateAt，用于增量刷新
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS folders (folder_id INTEGER PRIMARY KEY, update_at TEXT, listed REAL)"
+            )
+
+    @staticmethod
+    def _row(item, parent_id):
+        name = item["FileName"]
+        ext = os.path.splitext(name)[1][1:].lower() if item["Type"] == 0 else ""
+        return (
+            item["FileId"],
+            parent_id,
+            name,
+            ext,
+            item["Type"],
+            item.get("Size", 0),
+            item.get("Etag", ""),
+            str(item.get("UpdateAt", "")),
+        )
+
+    def _apply(self, folder_id, update_at, items, force=False):
+        """用一个文件夹的最新列表替换索引中该文件夹的直接子项，返回是否有变化
+
+        列表与索引中记录的完全相同时不写入（force=True 时照样重写）。不在列表中的子项
+        连同其下的内容一起删除；移走的文件夹会在新位置被重新列出并写回，不会丢失。
+        """
+        rows = [self._row(item, folder_id) for item in items]
+        with self._lock, self._conn:
+            existing = set(self._conn.execute("SELECT * FROM files WHERE parent_id = ?", (folder_id,)))
+            changed = force or existing != set(rows)
+            if changed:
+                current = {row[0] for row in rows}
+                for file_id in {row[0] for row in existing} - current:
+                    self._conn.execute(
+                        "WITH RECURSIVE gone(id) AS (SELECT ? UNION ALL "
+                        "SELECT files.file_id FROM files JOIN gone ON files.parent_id = gone.id) "
+                        "DELETE FROM files WHERE file_id IN gone",
+                        (file_id,),
+                    )
+                    self._conn.execute("DELETE FROM folders WHERE folder_id = ?", (file_id,))
+                self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO folders (folder_id, update_at, listed) VALUES (?, ?, ?)",
+                (folder_id, update_at, time.time()),
+            )
+        return changed
+
+    def refresh(self, root_id=0, full=False, progress_callback=None):
+        """刷新 root_id 下的索引，返回统计信息
+
+        统计信息中 folders_listed 为列出的文件夹数，其中 folders_skipped 个与索引相同、没有重写。
+        progress_callback(统计信息) 在每个文件夹处理完后调用。
+        """
+        with self._refresh_lock:
+            stats = {'folders_listed': 0, 'folders_skipped': 0, 'folders_failed': 0, 'items': 0}
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                def submit(folder_id, update_at):
+                    # 逐个文件夹刷新，不经过（也不填充）浏览用的列表缓存
+                    future = pool.submit(self.pan.list_dir, folder_id, refresh=True, use_cache=False)
+                    futures[future] = (folder_id, update_at)
+
+                futures = {}
+                submit(root_id, None)
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        folder_id, update_at = futures.pop(future)
+                        try:
+                            code, items = future.result()
+                        except Exception as e:
+                            print(f"列出文件夹失败: {folder_id}, {str(e)}")
+                            code, items = -1, []
+                        if code != 0:
+                            stats['folders_failed'] += 1
+                            continue
+                        if not self._apply(folder_id, update_at, items, force=full):
+                            stats['folders_skipped'] += 1
+                        stats['folders_listed'] += 1
+                        stats['items'] += len(items)
+                        for item in items:
+                            if item["Type"] == 1:
+                                submit(item["FileId"], str(item.get("UpdateAt", "")))
+                        if progress_callback:
+                            progress_callback(dict(stats))
+            return stats
+
+    def search(self, name=None, ext=None, min_size=None, max_size=None, file_type=None, limit=SEARCH_LIMIT,
+               offset=0):
+        """按文件名（包含，不区分大小写）、扩展名、大小范围和类型查询，返回与文件列表相同字段的字典"""
+        conditions = []
+        params = []
+        if name:
+            escaped = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append("name LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if ext:
+            conditions.append("ext = ?")
+            params.append(ext.lower().lstrip("."))
+        if min_size is not None:
+            conditions.append("size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            conditions.append("size <= ?")
+            params.append(max_size)
+        if file_type is not None:
+            conditions.append("type = ?")
+            params.append(file_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # 在同一条查询中沿父子关系拼出每条结果的路径，取链条最长（到达根目录）的一行
+        with self._lock:
+            rows = self._conn.execute(
+                "WITH RECURSIVE hits AS ("
+                "SELECT file_id, parent_id, name, type, size, etag, update_at FROM files "
+                f"{where} ORDER BY file_id DESC LIMIT ? OFFSET ?), "
+                "chain(hit, parent, path, depth) AS ("
+                "SELECT file_id, parent_id, '/' || name, 0 FROM hits UNION ALL "
+                "SELECT chain.hit, files.parent_id, '/' || files.name || chain.path, chain.depth + 1 "
+                "FROM chain JOIN files ON files.file_id = chain.parent), "
+                "paths AS (SELECT hit, path, MAX(depth) FROM chain GROUP BY hit) "
+                "SELECT hits.file_id, hits.parent_id, hits.name, hits.type, hits.size, hits.etag, hits.update_at, "
+                "paths.path FROM hits JOIN paths ON paths.hit = hits.file_id ORDER BY hits.file_id DESC",
+                # SQLite 中负数的 LIMIT 表示不限制，这里限制在 [0, SEARCH_LIMIT_MAX]
+                params + [min(max(limit, 0), SEARCH_LIMIT_MAX), max(offset, 0)],
+            ).fetchall()
+        return [
+            {
+                "FileId": file_id,
+                "ParentFileId": parent_id,
+                "FileName": name,
+                "Type": file_type,
+                "Size": size,
+                "Etag": etag,
+                "UpdateAt": update_at,
+                "Path": path,
+            }
+            for file_id, parent_id, name, file_type, size, etag, update_at, path in rows
+        ]
+
+    def path_of(self, file_id):
+        """根据索引中的父子关系拼出文件在云盘中的路径"""
+        with self._lock:
+            rows = self._conn.execute(
+                "WITH RECURSIVE chain(id, parent, name, depth) AS ("
+                "SELECT file_id, parent_id, name, 0 FROM files WHERE file_id = ? UNION ALL "
+                "SELECT files.file_id, files.parent_id, files.name, chain.depth + 1 "
+                "FROM files JOIN chain ON files.file_id = chain.parent) "
+                "SELECT name FROM chain ORDER BY depth DESC",
+                (file_id,),
+            ).fetchall()
+        return "/" + "/".join(row[0] for row in rows)
+
+    def stats(self):
+        with self._lock:
+            files, folders, size = self._conn.execute(
+                "SELECT COALESCE(SUM(type = 0), 0), COALESCE(SUM(type = 1), 0), COALESCE(SUM(size), 0) FROM files"
+            ).fetchone()
+            listed = self._conn.execute("SELECT MAX(listed) FROM folders").fetchone()[0]
+        return {'files': files, 'folders': folders, 'size': size, 'updated': listed}
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM folders")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
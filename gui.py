@@ -1,10 +1,12 @@
 import webview
-from flask import Flask, jsonify, request, send_file, redirect, session
-from android import Pan123, folder_pause_flags
+from flask import Flask, Response, jsonify, request, send_file, redirect, session, stream_with_context
+from android import Pan123
+from downloader import MISMATCH, SegmentedDownloader, TaskInterrupted
+from drive_index import SEARCH_LIMIT, SEARCH_LIMIT_MAX
+from ratelimit import bandwidth_limiter
+from scheduler import DownloadScheduler
 import os
 import threading
-import requests
-import time
 import logging
 import datetime
 import json
@@ -41,21 +43,44 @@ app.secret_key = '123pan_secret_key'  # 设置session密钥
 pan = None
 download_path = 'downloads'
 download_progress = {}  # 存储下载进度信息
-download_queue = []  # 下载队列
-active_downloads = 0  # 当前活跃的下载任务数
+index_progress = {}  # 云盘元数据索引的刷新进度
+SEARCH_STREAM_LIMIT = 1000  # 一次搜索最多返回的条数
+# 当前文件夹列表的快照：进入文件夹或刷新时生成，之后的分页请求带上 version 从同一份快照返回，
+# 列表缓存过期也不会重新列目录，各页之间不会错位
+listing_snapshot = {'version': 0, 'path': 0, 'items': []}
+listing_snapshot_lock = threading.Lock()
 max_concurrent_downloads = 2  # 最大并发下载数（默认值，会被配置覆盖）
-download_lock = threading.Lock()  # 下载状态锁
-pause_flags = {}  # file_id: bool, True if paused
+# 限速设置（KB/s，0为不限速）
+SPEED_LIMIT_KEYS = ('download_limit', 'upload_limit', 'task_download_limit', 'task_upload_limit')
+speed_limits = {key: 0 for key in SPEED_LIMIT_KEYS}
+# 递归下载文件夹使用的传输引擎：thread 为线程池+分段下载，async 为异步引擎（适合大量小文件）
+FOLDER_ENGINES = ('thread', 'async')
+folder_download_engine = 'thread'
+
+def apply_speed_limits():
+    """把限速设置应用到全局限速器，正在进行的传输立即生效"""
+    bandwidth_limiter.configure(
+        download=speed_limits['download_limit'] * 1024,
+        upload=speed_limits['upload_limit'] * 1024,
+        task_download=speed_limits['task_download_limit'] * 1024,
+        task_upload=speed_limits['task_upload_limit'] * 1024,
+    )
 
 # 加载配置文件
 def load_config():
-    global max_concurrent_downloads
+    global max_concurrent_downloads, folder_download_engine
     try:
         if os.path.exists('config.json'):
             with open('config.json', 'r', encoding='utf-8') as f:
                 config = json.load(f)
                 max_concurrent_downloads = config.get('max_concurrent_downloads', 2)
                 logging.info(f"从配置文件加载并发下载数: {max_concurrent_downloads}")
+                for key in SPEED_LIMIT_KEYS:
+                    speed_limits[key] = int(config.get(key, 0) or 0)
+                apply_speed_limits()
+                logging.info(f"从配置文件加载限速设置: {speed_limits}")
+                if config.get('folder_download_engine') in FOLDER_ENGINES:
+                    folder_download_engine = config['folder_download_engine']
         else:
             logging.warning("配置文件不存在，使用默认并发下载数: 2")
     except Exception as e:
@@ -71,6 +96,8 @@ def save_config():
                 config = json.load(f)
         
         config['max_concurrent_downloads'] = max_concurrent_downloads
+        config.update(speed_limits)
+        config['folder_download_engine'] = folder_download_engine
         
         with open('config.json', 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=2, ensure_ascii=False)
@@ -83,8 +110,8 @@ def save_config():
 if not os.path.exists(download_path):
     os.makedirs(download_path)
 
-def progress_callback(filename, downloaded, total, speed, file_id=None, status='downloading'):
-    """下载进度回调函数"""
+def progress_callback(filename, downloaded, total, speed, file_id=None, status='downloading', verify=None):
+    """下载进度回调函数，verify为下载完成后的MD5校验结果"""
     global download_progress
     percentage = int((downloaded / total) * 100) if total > 0 else 0
     
@@ -96,6 +123,8 @@ def progress_callback(filename, downloaded, total, speed, file_id=None, status='
         if file_id:
             download_progress[filename]['file_id'] = file_id
         download_progress[filename]['status'] = status
+        if verify:
+            download_progress[filename]['verify'] = verify
     else:
         download_progress[filename] = {
             'downloaded': downloaded,
@@ -103,7 +132,8 @@ def progress_callback(filename, downloaded, total, speed, file_id=None, status='
             'percentage': percentage,
             'speed': speed,
             'file_id': file_id,
-            'status': status
+            'status': status,
+            'verify': verify
         }
     # 记录下载进度到日志
     logging.info(f"文件下载进度: {filename} - {percentage}% ({downloaded}/{total} bytes) 速度: {speed} 状态: {status}")
@@ -231,41 +261,87 @@ def check_login():
         return jsonify({"loggedIn": True})
     return jsonify({"loggedIn": False})
 
+def file_entry(item):
+    """文件列表中一项的可序列化字段"""
+    return {
+        "FileId": item.get("FileId"),
+        "ParentFileId": item.get("ParentFileId"),
+        "FileName": item.get("FileName"),
+        "Type": item.get("Type"),
+        "Size": item.get("Size"),
+        "CreateAt": str(item.get("CreateAt")) if item.get("CreateAt") else "",
+        "UpdateAt": str(item.get("UpdateAt")) if item.get("UpdateAt") else "",
+        "FileNum": item.get("FileNum")
+    }
+
+def take_listing_snapshot():
+    """把 pan 的当前列表保存为新的快照并返回"""
+    with listing_snapshot_lock:
+        listing_snapshot.update(
+            version=listing_snapshot['version'] + 1,
+            path=pan.parent_file_id,
+            items=pan.list,
+        )
+        return dict(listing_snapshot)
+
 @app.route('/api/files', methods=['GET'])
 def list_files():
+    """当前文件夹的文件列表
+
+    不带 version 时重新获取当前文件夹（有缓存，refresh=1 时强制重新列出）并生成新的快照；
+    带 version 时直接从该快照返回，快照已被替换时返回409。
+    offset/limit 指定返回的区间（不带 limit 时返回全部），format=ndjson 时逐行流式返回，
+    最后一行为汇总。
+    """
     if pan is None:
         logging.error("文件列表错误: 应用未初始化")
         return jsonify({"error": "App not initialized"}), 400
     
     try:
-        result = pan.get_dir()
-        
-        if result != 0:
-            error_msg = f"获取文件列表失败，错误代码: {result}"
-            logging.error(error_msg)
-            return jsonify({
-                "error": error_msg,
-                "code": result
-            }), 500
-        
+        version = request.args.get('version', type=int)
+        if version is not None:
+            with listing_snapshot_lock:
+                snapshot = dict(listing_snapshot)
+            if snapshot['version'] != version:
+                return jsonify({"error": "文件列表已变化", "version": snapshot['version']}), 409
+        else:
+            # 文件夹列表有缓存，refresh=1 时强制重新获取
+            result = pan.get_dir(refresh=request.args.get('refresh') == '1')
+            
+            if result != 0:
+                error_msg = f"获取文件列表失败，错误代码: {result}"
+                logging.error(error_msg)
+                return jsonify({
+                    "error": error_msg,
+                    "code": result
+                }), 500
+            snapshot = take_listing_snapshot()
         
+        items = snapshot['items']
+        current_path = snapshot['path']
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = request.args.get('limit', type=int)
+        end = len(items) if limit is None else min(len(items), offset + max(limit, 0))
+
+        if request.args.get('format') == 'ndjson':
+            def generate():
+                for index in range(offset, end):
+                    yield json.dumps(file_entry(items[index]), ensure_ascii=False) + "\n"
+                yield json.dumps({"done": True, "total": len(items), "currentPath": current_path,
+                                  "version": snapshot['version']}) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
         # 构建可序列化的文件列表
-        file_list = []
-        for item in pan.list:
-            file_list.append({
-                "FileId": item.get("FileId"),
-                "FileName": item.get("FileName"),
-                "Type": item.get("Type"),
-                "Size": item.get("Size"),
-                "CreateAt": str(item.get("CreateAt")) if item.get("CreateAt") else "",
-                "UpdateAt": str(item.get("UpdateAt")) if item.get("UpdateAt") else "",
-                "FileNum": item.get("FileNum")
-            })
+        file_list = [file_entry(item) for item in items[offset:end]]
             
-        logging.info(f"返回文件列表: {len(file_list)} 项")
+        logging.info(f"返回文件列表: {len(file_list)}/{len(items)} 项")
         return jsonify({
             "files": file_list,
-            "currentPath": pan.parent_file_id
+            "total": len(items),
+            "offset": offset,
+            "currentPath": current_path,
+            "version": snapshot['version']
         })
     except Exception as e:
         error_msg = f"文件列表异常: {str(e)}"
@@ -275,27 +351,49 @@ def list_files():
             "details": error_msg
         }), 500
 
-def download_file_task(file_id, recursive=False):
-    global active_downloads, download_queue
-    paused = False  # Initialize paused variable
-    
+@app.route('/api/search', methods=['GET'])
+def search_files():
+    """服务器端搜索，每取到一页就以NDJSON流式返回，每行一项，最后一行为汇总"""
+    if pan is None:
+        return jsonify({"error": "App not initialized"}), 400
+    keyword = request.args.get('q', '').strip()
+    if not keyword:
+        return jsonify({"error": "缺少搜索关键字"}), 400
+    limit = min(max(request.args.get('limit', SEARCH_STREAM_LIMIT, type=int), 0), SEARCH_LIMIT_MAX)
+    logging.info(f"搜索: {keyword}")
+
+    def generate():
+        count = 0
+        # 客户端断开时生成器被关闭，不再请求后面的页；limit 为 0 时不请求
+        for code, items in (pan.search(keyword) if limit else ()):
+            if code != 0:
+                logging.error(f"搜索失败，错误代码: {code}")
+                yield json.dumps({"error": f"搜索失败，错误代码: {code}", "code": code}, ensure_ascii=False) + "\n"
+                return
+            for item in items[:limit - count]:
+                yield json.dumps(file_entry(item), ensure_ascii=False) + "\n"
+            count += min(len(items), limit - count)
+            if count >= limit:
+                break
+        logging.info(f"搜索完成: {keyword}, {count} 项")
+        yield json.dumps({"done": True, "count": count}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def remove_progress_later(key, delay):
+    """延迟删除进度信息，不占用下载线程"""
+    timer = threading.Timer(delay, lambda: download_progress.pop(key, None))
+    timer.daemon = True
+    timer.start()
+
+def download_file_task(task, file_id, file_info, recursive=False):
+    """由下载调度器的工作线程执行，成功返回True；暂停或取消时抛出TaskInterrupted交还工作线程"""
     try:
-        # 获取文件详情
-        file_info = next((f for f in pan.list if f["FileNum"] == file_id), None)
-        if not file_info:
-            logging.error(f"下载错误: 找不到文件ID {file_id}")
-            return
-            
         if file_info["Type"] == 1 and recursive:
             # 递归下载文件夹
             folder_name = file_info["FileName"]
+            folder_key = f"文件夹: {folder_name}"
             logging.info(f"开始递归下载文件夹: {folder_name}")
-            
-            # 根据file_id获取文件索引
-            file_index = next((idx for idx, f in enumerate(pan.list) if f["FileNum"] == file_id), None)
-            if file_index is None:
-                logging.error(f"无法找到文件ID {file_id} 对应的文件")
-                return
                 
             # 使用新的递归下载功能
             def folder_progress_callback(progress_info):
@@ -304,7 +402,7 @@ def download_file_task(file_id, recursive=False):
                 filename = progress_info['filename']
                 
                 # 检查暂停状态
-                status = 'paused' if pause_flags.get(file_id, False) else 'downloading'
+                status = 'paused' if task.paused else progress_info.get('status', 'downloading')
                 
                 download_progress[filename] = {
                     'downloaded': progress_info['downloaded'],
@@ -318,33 +416,24 @@ def download_file_task(file_id, recursive=False):
                 # 记录下载进度到日志
                 logging.info(f"文件下载进度: {filename} - {progress_info['percentage']}% ({progress_info['downloaded']}/{progress_info['total']}) 速度: {progress_info['speed']} 状态: {status}")
             
-            # 添加暂停检查循环
-            def download_with_pause_check():
-                nonlocal file_index, folder_progress_callback
-                while pause_flags.get(file_id, False):
-                    time.sleep(0.5)
-                    # 更新状态为暂停
-                    folder_key = f"文件夹: {folder_name}"
-                    if folder_key in download_progress:
-                        download_progress[folder_key]['status'] = 'paused'
-                
-                success = pan.download(file_index, download_path, folder_progress_callback, recursive=True)
-                return success
-            
-            success = download_with_pause_check()
+            success = pan.download_folder_recursive(
+                file_info,
+                download_path,
+                folder_progress_callback,
+                task_bucket=bandwidth_limiter.task_bucket('download'),
+                control=task,
+                engine=folder_download_engine,
+            )
             
             if success:
                 logging.info(f"文件夹递归下载完成: {folder_name}")
                 # 延迟删除进度信息
-                time.sleep(2)
-                folder_key = f"文件夹: {folder_name}"
-                if folder_key in download_progress:
-                    del download_progress[folder_key]
+                remove_progress_later(folder_key, 2)
             else:
                 logging.error(f"文件夹递归下载失败: {folder_name}")
-                folder_key = f"文件夹: {folder_name}"
                 if folder_key in download_progress:
                     download_progress[folder_key]['speed'] = "下载失败"
+            return success
             
         else:
             # 单个文件或ZIP打包的文件夹下载
@@ -369,179 +458,219 @@ def download_file_task(file_id, recursive=False):
             if not os.path.exists(download_path):
                 os.makedirs(download_path)
                 
-            # 根据file_id获取文件索引
-            file_index = next((idx for idx, f in enumerate(pan.list) if f["FileNum"] == file_id), None)
-            if file_index is None:
-                logging.error(f"无法找到文件ID {file_id} 对应的文件")
-                return
-                
             # 获取下载链接
             try:
-                down_load_url = pan.link(file_index, showlink=False)
+                down_load_url = pan.link_file(file_info, showlink=False)
                 logging.debug(f"获取下载链接: {down_load_url}")  # 调试信息
             except Exception as e:
                 logging.error(f"获取下载链接失败: {str(e)}")
                 progress_callback(filename, -1, -1, f"获取链接失败: {str(e)}", file_id, 'error')
-                return
+                return False
                 
             # 确保获取到有效的下载链接
-            if down_load_url is None:
+            if down_load_url is None or isinstance(down_load_url, int):
                 progress_callback(filename, -1, -1, "获取下载链接失败", file_id, 'error')
-                return
+                return False
 
-            # 检查文件是否存在并获取当前大小用于恢复下载
-            if os.path.exists(file_path):
-                current_size = os.path.getsize(file_path)
-            else:
-                current_size = 0
+            file_size = file_info["Size"]  # 使用文件信息中的总大小
 
-            # 添加必要的请求头，支持断点续传
+            # 添加必要的请求头
             headers = {
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
                 "Referer": "https://www.123pan.com/",
             }
-            if current_size > 0:
-                headers["Range"] = f"bytes={current_size}-"
-            
-            # 使用优化后的下载逻辑
-            down = requests.get(down_load_url, headers=headers, stream=True, timeout=30)
-            file_size = file_info["Size"]  # 使用文件信息中的总大小
-            data_count = current_size  # 从当前大小开始计数
-            time1 = time.time()
-            time_temp = time1
-            data_count_temp = data_count
-            
-            paused = False
-            with open(file_path, "ab") as f:  # 使用追加模式支持断点续传
-                # 使用64KB分块提高效率
-                for chunk in down.iter_content(64*1024):  # 64KB chunks
-                    if not chunk:
-                        continue
-                        
-                    f.write(chunk)
-                    data_count += len(chunk)
-                    
-                    # 实时更新进度
-                    now_jd = (data_count / file_size) * 100 if file_size > 0 else 0
-                    
-                    # 计算下载速度（每100ms更新一次）
-                    current_time = time.time()
-                    elapsed = current_time - time_temp
-                    if elapsed > 0.1:  # 至少100ms更新一次
-                        speed = (data_count - data_count_temp) / elapsed
-                        data_count_temp = data_count
-                        time_temp = current_time
-                        
-                        if speed > 1048576:  # >1MB/s
-                            speed_print = f"{speed/1048576:.2f}M/S"
-                        else:
-                            speed_print = f"{speed/1024:.2f}K/S"
-                            
-                        # 调用进度回调
-                        progress_callback(
-                            filename,
-                            data_count,
-                            file_size,
-                            speed_print,
-                            file_id,
-                            'downloading'
-                        )
-
-                    # 检查暂停标志
-                    if pause_flags.get(file_id, False):
-                        paused = True
-                        progress_callback(filename, data_count, file_size, "Paused", file_id, 'paused')
-                        # 等待直到继续下载
-                        while pause_flags.get(file_id, False):
-                            time.sleep(0.5)
-                        # 继续下载后更新状态
-                        progress_callback(filename, data_count, file_size, "继续中", file_id, 'downloading')
-                        paused = False
-            
+
+            def task_progress(progress_info):
+                progress_callback(
+                    filename,
+                    progress_info['downloaded'],
+                    progress_info['total'],
+                    progress_info['speed'],
+                    file_id,
+                    'downloading'
+                )
+
+            # 写入.part临时文件并记录断点日志，中断或重启后从已完成的位置继续
+            downloader = SegmentedDownloader(
+                down_load_url,
+                file_path,
+                file_size,
+                session=pan.storage_session,
+                progress_callback=task_progress,
+                etag=file_info.get("Etag") or None,
+                control=task,
+                headers=headers,
+                url_resolver=pan.link_resolver(file_info),
+                task_bucket=bandwidth_limiter.task_bucket('download'),
+                expected_md5=file_info.get("Etag") if file_info["Type"] == 0 else None,
+            )
+
+            try:
+                success = downloader.run()
+            except TaskInterrupted as e:
+                # 暂停时断点已保存，工作线程去执行下一个任务
+                status = str(e)
+                speed = "Paused" if status == 'paused' else "已取消"
+                progress_callback(filename, downloader.downloaded, downloader.file_size, speed, file_id, status)
+                raise
+
             # 下载完成后检查
-            if file_size > 0 and data_count == file_size:
-                progress_callback(filename, file_size, file_size, "下载完成", file_id, 'completed')
+            if success:
+                progress_callback(filename, downloader.file_size, downloader.file_size, "下载完成", file_id, 'completed',
+                                  downloader.verify_status)
+            elif downloader.verify_status == MISMATCH:
+                progress_callback(filename, downloader.downloaded, downloader.file_size, "校验失败", file_id, 'error',
+                                  MISMATCH)
             else:
                 # 下载不完整
-                progress_callback(filename, data_count, file_size, "下载不完整", file_id, 'error')
-                
+                progress_callback(filename, downloader.downloaded, downloader.file_size, "下载不完整", file_id, 'error')
+
             # 延迟删除进度信息
-            time.sleep(5)
-            if filename in download_progress:
-                del download_progress[filename]
+            remove_progress_later(filename, 5)
+            return success
                 
+    except TaskInterrupted:
+        raise
     except Exception as e:
         logging.error(f"下载失败: {str(e)}")
         # 标记失败状态
-        if 'file_info' in locals():
-            filename = file_info["FileName"]
-            if file_info["Type"] == 1:
-                filename += ".zip"
-            progress_callback(filename, -1, -1, f"失败: {str(e)}", file_id, 'error')
-    finally:
-        # 只在下载真正完成时才减少活跃下载计数并处理队列
-        # 如果是暂停状态，线程会继续运行，不减少计数
-        if not paused:
-            global active_downloads, download_queue
-            with download_lock:
-                active_downloads -= 1
-                logging.info(f"下载任务完成，当前活跃下载数: {active_downloads}")
-                # 检查队列中是否有等待的任务
-                if download_queue and active_downloads < max_concurrent_downloads:
-                    next_file_id, next_recursive = download_queue.pop(0)
-                    active_downloads += 1
-                    threading.Thread(target=download_file_task, args=(next_file_id, next_recursive)).start()
-                    logging.info(f"从队列启动下载任务: {next_file_id}, 递归: {next_recursive}")
+        filename = file_info["FileName"]
+        if file_info["Type"] == 1:
+            filename += ".zip"
+        progress_callback(filename, -1, -1, f"失败: {str(e)}", file_id, 'error')
+        return False
+
+# 固定大小的下载线程池，暂停的任务会让出工作线程
+download_scheduler = DownloadScheduler(download_file_task, max_concurrent_downloads)
 
 @app.route('/api/download/<int:file_id>', methods=['GET'])
 def download_file(file_id):
-    global active_downloads, download_queue
-    
     if pan is None:
         return jsonify({"error": "App not initialized"}), 400
     
     # 获取查询参数，是否递归下载文件夹
     recursive = request.args.get('recursive', 'false').lower() == 'true'
+    # 优先级，数值越大越先下载
+    priority = request.args.get('priority', 0, type=int)
     
-    logging.info(f"收到下载请求: file_id={file_id}, recursive={recursive}")
+    logging.info(f"收到下载请求: file_id={file_id}, recursive={recursive}, priority={priority}")
     
-    # 查找文件信息
-    file_info = next((f for f in pan.list if f["FileNum"] == file_id), None)
+    # 按FileId查找文件信息，行号（FileNum）随打开的文件夹变化，不能用来标识任务
+    file_info = next((f for f in pan.list if f["FileId"] == file_id), None)
     if not file_info:
         logging.error(f"找不到文件ID: {file_id}")
         return jsonify({"error": "File not found"}), 404
     
-    # 使用锁控制并发下载
-    with download_lock:
-        if active_downloads < max_concurrent_downloads:
-            # 直接启动下载任务
-            active_downloads += 1
-            logging.info(f"直接启动下载任务: file_id={file_id}, 递归={recursive}, 当前活跃下载数: {active_downloads}")
-            threading.Thread(target=download_file_task, args=(file_id, recursive)).start()
-        else:
-            # 加入下载队列
-            download_queue.append((file_id, recursive))
-            logging.info(f"下载任务加入队列: file_id={file_id}, 递归={recursive}, 队列长度: {len(download_queue)}")
+    # 提交到下载调度器，文件详情在提交时确定，之后切换目录不影响任务
+    if download_scheduler.is_active(file_id):
+        logging.warning(f"文件已在下载队列中: file_id={file_id}")
+        return jsonify({"error": "该文件已在下载队列中"}), 409
+    started = download_scheduler.has_free_worker()
+    download_scheduler.submit(file_id, file_id, file_info, recursive, priority=priority)
+    queue_position = 0 if started else download_scheduler.queue_position(file_id)
+    logging.info(f"下载任务已提交: file_id={file_id}, 递归={recursive}, 队列位置: {queue_position}")
     
     return jsonify({
-        "status": "started" if active_downloads <= max_concurrent_downloads else "queued",
+        "status": "started" if started else "queued",
         "file": file_info,
         "recursive": recursive,
-        "queue_position": len(download_queue) if active_downloads >= max_concurrent_downloads else 0
+        "queue_position": queue_position
     })
 
+@app.route('/api/cancel/<int:file_id>', methods=['POST'])
+def cancel_download(file_id):
+    if not download_scheduler.cancel(file_id):
+        return jsonify({"error": "任务不存在或已结束"}), 404
+    logging.info(f"取消下载请求: file_id={file_id}")
+    for filename, progress in download_progress.items():
+        if progress.get('file_id') == file_id:
+            progress['status'] = 'cancelled'
+    return jsonify({"status": "cancelled"})
+
+@app.route('/api/links', methods=['POST'])
+def prefetch_links():
+    """批量获取选中文件的下载直链，随后的下载任务直接使用缓存"""
+    if pan is None:
+        return jsonify({"error": "App not initialized"}), 400
+
+    file_ids = set((request.json or {}).get('file_ids', []))
+    file_details = [f for f in pan.list if f["FileId"] in file_ids]
+    try:
+        links = pan.link_files(file_details)
+    except Exception as e:
+        logging.error(f"批量获取下载链接失败: {str(e)}")
+        return jsonify({"error": "批量获取下载链接失败", "details": str(e)}), 500
+
+    resolved = sum(1 for url in links.values() if url)
+    logging.info(f"批量获取下载链接: {resolved}/{len(links)} 个文件")
+    return jsonify({"resolved": resolved, "total": len(links)})
+
 @app.route('/api/cd/<int:dir_id>', methods=['POST'])
 def change_dir(dir_id):
     if pan is None:
         return jsonify({"error": "App not initialized"}), 400
     
-    pan.cdById(dir_id)
-    pan.get_dir()
+    pan.cdById(dir_id, show=False)
+    snapshot = take_listing_snapshot()
+    # 带 limit 时只返回前 limit 项，其余由 /api/files 带上 version 按需分页获取
+    limit = request.args.get('limit', type=int)
+    items = snapshot['items'] if limit is None else snapshot['items'][:max(limit, 0)]
     return jsonify({
-        "files": pan.list,
-        "currentPath": pan.parent_file_id
+        "files": [file_entry(item) for item in items],
+        "total": len(snapshot['items']),
+        "offset": 0,
+        "currentPath": snapshot['path'],
+        "version": snapshot['version']
     })
 
+@app.route('/api/index/refresh', methods=['POST'])
+def refresh_index():
+    """在后台刷新云盘元数据索引，full=true 时重新遍历整个云盘"""
+    if pan is None:
+        return jsonify({"error": "App not initialized"}), 400
+    if index_progress.get('status') == 'running':
+        return jsonify({"status": "running", "progress": index_progress})
+
+    full = request.args.get('full', 'false').lower() == 'true'
+    drive_index = pan.drive_index()
+    index_progress.clear()
+    index_progress.update(status='running', full=full)
+
+    def run():
+        try:
+            stats = drive_index.refresh(full=full, progress_callback=index_progress.update)
+            index_progress.update(stats, status='completed')
+            logging.info(f"索引刷新完成: {stats}")
+        except Exception as e:
+            logging.error(f"索引刷新失败: {str(e)}")
+            index_progress.update(status='error', error=str(e))
+
+    threading.Thread(target=run, daemon=True).start()
+    logging.info(f"开始刷新索引: full={full}")
+    return jsonify({"status": "started"})
+
+@app.route('/api/index/status', methods=['GET'])
+def get_index_status():
+    if pan is None:
+        return jsonify({"error": "App not initialized"}), 400
+    return jsonify({"progress": index_progress, "stats": pan.drive_index().stats()})
+
+@app.route('/api/index/search', methods=['GET'])
+def search_index():
+    """在本地索引中按文件名、扩展名、大小查询，不访问服务器"""
+    if pan is None:
+        return jsonify({"error": "App not initialized"}), 400
+    results = pan.drive_index().search(
+        name=request.args.get('name') or None,
+        ext=request.args.get('ext') or None,
+        min_size=request.args.get('min_size', type=int),
+        max_size=request.args.get('max_size', type=int),
+        file_type=request.args.get('type', type=int),
+        limit=min(max(request.args.get('limit', SEARCH_LIMIT, type=int), 0), SEARCH_LIMIT_MAX),
+        offset=max(request.args.get('offset', 0, type=int), 0),
+    )
+    return jsonify({"files": results, "count": len(results)})
+
 @app.route('/api/progress', methods=['GET'])
 def get_download_progress():
     """获取所有下载进度信息"""
@@ -556,7 +685,8 @@ def get_settings():
                 config = json.load(f)
                 return jsonify(config)
         else:
-            return jsonify({"max_concurrent_downloads": 2})
+            return jsonify({"max_concurrent_downloads": 2, **speed_limits,
+                            "folder_download_engine": folder_download_engine})
     except Exception as e:
         logging.error(f"获取设置失败: {str(e)}")
         return jsonify({"error": "获取设置失败"}), 500
@@ -566,15 +696,25 @@ def save_settings():
     """保存设置"""
     try:
         data = request.json
-        global max_concurrent_downloads
+        global max_concurrent_downloads, folder_download_engine
         
         # 更新全局变量
         max_concurrent_downloads = data.get('max_concurrent_downloads', 2)
+        download_scheduler.set_workers(max_concurrent_downloads)
+        
+        # 限速设置立即应用到正在进行的传输
+        for key in SPEED_LIMIT_KEYS:
+            if key in data:
+                speed_limits[key] = max(0, int(data.get(key) or 0))
+        apply_speed_limits()
+        if data.get('folder_download_engine') in FOLDER_ENGINES:
+            folder_download_engine = data['folder_download_engine']
         
         # 保存到配置文件
         save_config()
         
-        logging.info(f"设置已保存: 并发下载数 = {max_concurrent_downloads}")
+        logging.info(f"设置已保存: 并发下载数 = {max_concurrent_downloads}, 限速 = {speed_limits}, "
+                     f"文件夹下载引擎 = {folder_download_engine}")
         return jsonify({"status": "success"})
     except Exception as e:
         logging.error(f"保存设置失败: {str(e)}")
@@ -582,19 +722,10 @@ def save_settings():
 
 @app.route('/api/pause/<int:file_id>', methods=['POST'])
 def pause_download(file_id):
-    # 检查是否为文件夹下载
-    is_folder = False
-    for filename, progress in download_progress.items():
-        if progress.get('file_id') == file_id and progress.get('type') == 'folder':
-            is_folder = True
-            break
-    
-    if is_folder:
-        folder_pause_flags[file_id] = True
-        logging.info(f"暂停文件夹下载请求: file_id={file_id}, 设置folder_pause_flags[{file_id}]={folder_pause_flags[file_id]}")
-    else:
-        pause_flags[file_id] = True
-        logging.info(f"暂停文件下载请求: file_id={file_id}, 设置pause_flags[{file_id}]={pause_flags[file_id]}")
+    # 暂停的任务会保存断点并让出工作线程，队列中的下一个任务随即开始
+    if not download_scheduler.pause(file_id):
+        return jsonify({"error": "任务不存在或已结束"}), 404
+    logging.info(f"暂停下载请求: file_id={file_id}")
     
     # 更新进度状态为暂停
     for filename, progress in download_progress.items():
@@ -605,19 +736,10 @@ def pause_download(file_id):
 
 @app.route('/api/resume/<int:file_id>', methods=['POST'])
 def resume_download(file_id):
-    # 检查是否为文件夹下载
-    is_folder = False
-    for filename, progress in download_progress.items():
-        if progress.get('file_id') == file_id and progress.get('type') == 'folder':
-            is_folder = True
-            break
-    
-    if is_folder:
-        folder_pause_flags[file_id] = False
-        logging.info(f"继续文件夹下载请求: file_id={file_id}, 设置folder_pause_flags[{file_id}]={folder_pause_flags[file_id]}")
-    else:
-        pause_flags[file_id] = False
-        logging.info(f"继续文件下载请求: file_id={file_id}, 设置pause_flags[{file_id}]={pause_flags[file_id]}")
+    # 继续的任务重新进入队列，从断点继续下载
+    if not download_scheduler.resume(file_id):
+        return jsonify({"error": "任务不存在或已结束"}), 404
+    logging.info(f"继续下载请求: file_id={file_id}")
     
     # 更新进度状态为下载中
     for filename, progress in download_progress.items():
@@ -655,6 +777,7 @@ if __name__ == '__main__':
     
     # 加载配置文件设置
     load_config()
+    download_scheduler.set_workers(max_concurrent_downloads)
     
     # 应用启动时尝试自动登录
     auto_login()
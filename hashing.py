@@ -0,0 +1,273 @@
+import hashlib
+import mmap
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 哈希计算默认参数
+READ_SIZE = 4 * 1024 * 1024  # 每次读取的字节数，hashlib处理大块数据时会释放GIL
+READ_AHEAD = 4  # 预读队列深度（块数）
+HASH_CACHE_FILE = "hash_cache.db"  # 本地文件MD5缓存
+DEFAULT_HASH_WORKERS = min(4, os.cpu_count() or 1)  # 同时计算MD5的文件数
+
+
+def _advise(fd, offset, length, advice):
+    """向操作系统提示文件的访问方式，不支持 posix_fadvise 的平台（Windows）忽略"""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, advice))
+        except OSError:
+            pass
+
+
+def fits_in_cache(size):
+    """文件能否留在页缓存中：不超过物理内存的一半；无法获取内存大小时按能留存处理"""
+    try:
+        memory = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return True
+    return size <= memory // 2
+
+
+class ReadAheadReader:
+    """在后台线程中顺序读取文件，通过有界队列把数据块交给调用方
+
+    调用方计算当前块的同时，读取线程已经在读后面的块，磁盘I/O与计算重叠。
+    drop_cache=True 时每读完一段就提示系统丢弃对应的页缓存，避免一次性读取的大文件
+    把其他数据挤出缓存。
+    """
+
+    _END = object()
+
+    def __init__(self, file_path, block_size=READ_SIZE, depth=READ_AHEAD, drop_cache=False):
+        self.file_path = file_path
+        self.block_size = block_size
+        self.drop_cache = drop_cache
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._error = None
+
+    def _read_loop(self):
+        try:
+            with open(self.file_path, "rb", buffering=0) as f:
+                fd = f.fileno()
+                _advise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+                offset = 0
+                while not self._stop.is_set():
+                    data = f.read(self.block_size)
+                    if not data:
+                        break
+                    if self.drop_cache:
+                        _advise(fd, offset, len(data), "POSIX_FADV_DONTNEED")
+                    offset += len(data)
+                    self._queue.put(data)
+        except OSError as e:
+            self._error = e
+        finally:
+            self._queue.put(self._END)
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._read_loop, daemon=True)
+        thread.start()
+        try:
+            while True:
+                data = self._queue.get()
+                if data is self._END:
+                    break
+                yield data
+        finally:
+            # 调用方提前结束时让读取线程退出
+            self._stop.set()
+            while thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        if self._error is not None:
+            raise self._error
+
+
+def _mmap_md5(file_path, block_size, progress_callback):
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return md5.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, block_size):
+                    md5.update(view[offset:offset + block_size])
+                    if progress_callback:
+                        progress_callback(min(offset + block_size, size), size)
+            finally:
+                view.release()
+    return md5.hexdigest()
+
+
+def file_md5(file_path, block_size=READ_SIZE, use_mmap=False, drop_cache=None, progress_callback=None):
+    """计算文件的MD5
+
+    默认由 ReadAheadReader 在后台预读，计算与读盘并行；use_mmap=True 时改为内存映射，
+    省去一次数据拷贝。drop_cache 为None时按文件大小决定：能留在页缓存中的文件保留缓存，
+    随后的上传直接从缓存读取；放不下的大文件边读边丢弃缓存。
+    progress_callback(已处理字节数, 总字节数)
+    """
+    if use_mmap:
+        return _mmap_md5(file_path, block_size, progress_callback)
+    size = os.path.getsize(file_path)
+    if drop_cache is None:
+        drop_cache = not fits_in_cache(size)
+    md5 = hashlib.md5()
+    done = 0
+    for data in ReadAheadReader(file_path, block_size, drop_cache=drop_cache):
+        md5.update(data)
+        done += len(data)
+        if progress_callback:
+            progress_callback(done, size)
+    return md5.hexdigest()
+
+
+def read_range(file_path, offset, size, prefetch=0, drop_cache=False):
+    """读取文件的一段数据，供分块上传使用
+
+    prefetch 大于0时提示系统预读紧随其后的 prefetch 字节（下一个分块），
+    drop_cache=True 时读完即丢弃这段的页缓存。
+    """
+    with open(file_path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        if prefetch > 0:
+            _advise(fd, offset + size, prefetch, "POSIX_FADV_WILLNEED")
+        f.seek(offset)
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            data = f.read(remaining)
+            if not data:
+                break
+            chunks.append(data)
+            remaining -= len(data)
+        if drop_cache:
+            _advise(fd, offset, size, "POSIX_FADV_DONTNEED")
+    return b"".join(chunks) if len(chunks) != 1 else chunks[0]
+
+
+class HashCache:
+    """本地文件MD5的持久缓存
+
+    保存在一个SQLite数据库中，以文件绝对路径为键，同时记录大小、修改时间和inode。
+    三者都没有变化时直接返回缓存的MD5，未改动的大文件再次上传或扫描时只需要一次stat。
+    可以在多个线程中共用一个实例。
+    """
+
+    def __init__(self, path=HASH_CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS hashes ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, md5 TEXT, updated REAL)"
+            )
+
+    @staticmethod
+    def _key(file_path, stat):
+        return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, file_path, stat=None):
+        """返回缓存的MD5，文件变化过或没有缓存时返回None"""
+        path, size, mtime_ns, inode = self._key(file_path, stat or os.stat(file_path))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT md5 FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (path, size, mtime_ns, inode),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, file_path, md5, stat=None):
+        path, size, mtime_ns, inode = self._key(file_path, stat or os.stat(file_path))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, inode, md5, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, inode, md5, time.time()),
+            )
+
+    def file_md5(self, file_path, **kwargs):
+        """返回文件的MD5，命中缓存时不读取文件；参数同模块级 file_md5"""
+        stat = os.stat(file_path)
+        md5 = self.get(file_path, stat)
+        if md5 is not None:
+            return md5
+        md5 = file_md5(file_path, **kwargs)
+        # 计算期间文件被修改过时不写入缓存
+        if self._key(file_path, os.stat(file_path)) == self._key(file_path, stat):
+            self.put(file_path, md5, stat)
+        return md5
+
+    def remove(self, file_path):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM hashes WHERE path = ?", (os.path.abspath(file_path),))
+
+    def prune(self):
+        """删除已经不存在的文件的记录，返回删除的条数"""
+        with self._lock:
+            paths = [row[0] for row in self._conn.execute("SELECT path FROM hashes")]
+        missing = [(path,) for path in paths if not os.path.exists(path)]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM hashes WHERE path = ?", missing)
+        return len(missing)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class HashService:
+    """在线程池中计算本地文件的MD5
+
+    hashlib 处理大块数据时会释放GIL，多个文件可以真正并行计算。批量上传、秒传探测等需要
+    Etag 的地方共用一个实例：同一文件同时被多次请求时只计算一次，提供 cache 时先查缓存。
+    """
+
+    def __init__(self, workers=DEFAULT_HASH_WORKERS, block_size=READ_SIZE, cache=None):
+        self.workers = workers
+        self.block_size = block_size
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _hash(self, file_path):
+        if self.cache is not None:
+            return self.cache.file_md5(file_path, block_size=self.block_size)
+        return file_md5(file_path, self.block_size)
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def submit(self, file_path):
+        """提交一个文件，返回结果为MD5的 Future；该文件正在计算时返回同一个 Future"""
+        key = os.path.abspath(file_path)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._pool.submit(self._hash, file_path)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def file_md5(self, file_path):
+        """在线程池中计算单个文件的MD5并等待结果"""
+        return self.submit(file_path).result()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
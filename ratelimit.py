@@ -0,0 +1,137 @@
+import threading
+import time
+import weakref
+
+# 单次等待的最长时间（秒），限速在运行中被修改时能尽快生效
+MAX_WAIT_SLICE = 0.5
+
+
+class TokenBucket:
+    """令牌桶，rate为每秒字节数，0表示不限速，允许最多1秒的突发流量"""
+
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = max(0, int(rate or 0))
+            self._tokens = min(self._tokens, self.rate)
+            self._last = time.monotonic()
+
+    def consume(self, amount):
+        """取出amount个字节的令牌，不够时阻塞等待"""
+        with self._lock:
+            if self.rate <= 0:
+                return
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # 先记账再等待，并发的线程按到达顺序排队
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return
+        self._wait_for_tokens()
+
+    def reserve(self, amount):
+        """不阻塞地取出amount个字节的令牌，返回调用方需要等待的秒数（供异步代码使用）"""
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def _wait_for_tokens(self):
+        while True:
+            with self._lock:
+                if self.rate <= 0:
+                    self._tokens = 0.0
+                    return
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 0:
+                    return
+                wait = -self._tokens / self.rate
+            time.sleep(min(wait, MAX_WAIT_SLICE))
+
+
+class BandwidthLimiter:
+    """进程内所有传输共享的带宽限制
+
+    上传和下载各有一个全局令牌桶；每个任务还可以通过 task_bucket() 取得自己的
+    令牌桶，实现单任务限速。所有限速值都可以在运行中修改。
+    """
+
+    DIRECTIONS = ("download", "upload")
+
+    def __init__(self):
+        self.buckets = {direction: TokenBucket() for direction in self.DIRECTIONS}
+        self.task_rates = {direction: 0 for direction in self.DIRECTIONS}
+        self._task_buckets = {direction: weakref.WeakSet() for direction in self.DIRECTIONS}
+        self._lock = threading.Lock()
+
+    def configure(self, download=None, upload=None, task_download=None, task_upload=None):
+        """修改限速（字节/秒，0为不限速），传None的项保持不变"""
+        for direction, rate in (("download", download), ("upload", upload)):
+            if rate is not None:
+                self.buckets[direction].set_rate(rate)
+        for direction, rate in (("download", task_download), ("upload", task_upload)):
+            if rate is not None:
+                with self._lock:
+                    self.task_rates[direction] = max(0, int(rate))
+                    buckets = list(self._task_buckets[direction])
+                for bucket in buckets:
+                    bucket.set_rate(rate)
+
+    def task_bucket(self, direction, rate=None):
+        """为单个任务创建令牌桶，未指定rate时使用当前的单任务限速"""
+        bucket = TokenBucket(self.task_rates[direction] if rate is None else rate)
+        with self._lock:
+            self._task_buckets[direction].add(bucket)
+        return bucket
+
+    def consume(self, direction, amount, task_bucket=None):
+        if task_bucket is not None:
+            task_bucket.consume(amount)
+        self.buckets[direction].consume(amount)
+
+    def reserve(self, direction, amount, task_bucket=None):
+        """consume 的非阻塞版本，返回需要等待的秒数"""
+        wait = self.buckets[direction].reserve(amount)
+        if task_bucket is not None:
+            wait = max(wait, task_bucket.reserve(amount))
+        return wait
+
+
+class ThrottledReader:
+    """按上传限速读取内存数据的文件对象，requests会据此设置Content-Length并分块发送"""
+
+    def __init__(self, data, limiter, task_bucket=None, block_size=64 * 1024):
+        self._data = memoryview(data)
+        self._pos = 0
+        self._limiter = limiter
+        self._task_bucket = task_bucket
+        self._block_size = block_size
+
+    def __len__(self):
+        return len(self._data) - self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._block_size
+        chunk = self._data[self._pos:self._pos + min(size, self._block_size)]
+        self._pos += len(chunk)
+        if chunk:
+            self._limiter.consume("upload", len(chunk), self._task_bucket)
+        return chunk.tobytes()
+
+
+# 全局共享的限速器
+bandwidth_limiter = BandwidthLimiter()
@@ -0,0 +1,185 @@
+import heapq
+import itertools
+import logging
+import threading
+
+from downloader import TaskControl, TaskInterrupted
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+COMPLETED = 'completed'
+FAILED = 'failed'
+ACTIVE_STATES = (QUEUED, RUNNING, PAUSED)
+FINISHED_STATES = (CANCELLED, COMPLETED, FAILED)
+
+
+class DownloadTask(TaskControl):
+    """调度器中的一个下载任务，暂停时抛出 TaskInterrupted 让出工作线程"""
+
+    def __init__(self, task_id, args, priority, seq):
+        super().__init__(release_on_pause=True)
+        self.task_id = task_id
+        self.args = args
+        self.priority = priority
+        self.seq = seq
+        self.state = QUEUED
+
+
+class DownloadScheduler:
+    """固定大小的下载线程池
+
+    任务按优先级（数值越大越先执行）和提交顺序排队，由固定数量的工作线程执行。
+    暂停运行中的任务时立即断开其连接，传输代码通过 task.check() 抛出 TaskInterrupted
+    退出，工作线程随即去执行下一个任务；继续时任务重新排队，借助断点日志从中断处下载。
+
+    runner(task, *args) 成功时返回True，返回False或抛出异常时任务记为失败。
+    tasks 只保存未结束的任务，完成、失败或取消的任务随即移除。
+    """
+
+    def __init__(self, runner, workers=2):
+        self.runner = runner
+        self.tasks = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._target_workers = 0
+        self._worker_count = 0
+        self.set_workers(workers)
+
+    def set_workers(self, count):
+        """调整工作线程数量，多余的线程在当前任务结束后退出"""
+        with self._cond:
+            self._target_workers = max(1, int(count))
+            while self._worker_count < self._target_workers:
+                self._worker_count += 1
+                threading.Thread(target=self._worker_loop, daemon=True).start()
+            self._cond.notify_all()
+
+    @property
+    def running_count(self):
+        with self._cond:
+            return sum(1 for task in self.tasks.values() if task.state == RUNNING)
+
+    def has_free_worker(self):
+        with self._cond:
+            busy = sum(1 for task in self.tasks.values() if task.state in (RUNNING, QUEUED))
+            return busy < self._target_workers
+
+    def is_active(self, task_id):
+        """任务是否在排队、运行或暂停中"""
+        with self._cond:
+            task = self.tasks.get(task_id)
+            return task is not None and task.state in ACTIVE_STATES
+
+    def submit(self, task_id, *args, priority=0):
+        """提交任务，同一task_id的任务未结束时直接返回原任务"""
+        with self._cond:
+            task = self.tasks.get(task_id)
+            if task is not None and task.state in ACTIVE_STATES:
+                return task
+            task = DownloadTask(task_id, args, priority, next(self._seq))
+            self.tasks[task_id] = task
+            self._push(task)
+            self._cond.notify()
+            return task
+
+    def queue_position(self, task_id):
+        """返回任务在等待队列中的位置（从1开始），不在队列中返回0"""
+        with self._cond:
+            task = self.tasks.get(task_id)
+            if task is None or task.state != QUEUED:
+                return 0
+            waiting = sorted(t for t in self._heap if t[2].state == QUEUED)
+            for position, entry in enumerate(waiting, 1):
+                if entry[2] is task:
+                    return position
+            return 0
+
+    def pause(self, task_id):
+        with self._cond:
+            task = self.tasks.get(task_id)
+            if task is None or task.state not in ACTIVE_STATES:
+                return False
+            if task.state == QUEUED:
+                task.state = PAUSED
+            task.pause()
+            return True
+
+    def resume(self, task_id):
+        with self._cond:
+            task = self.tasks.get(task_id)
+            if task is None or task.state not in ACTIVE_STATES:
+                return False
+            task.resume()
+            if task.state == PAUSED:
+                # 重新排队，保留原来的优先级和顺序
+                task.state = QUEUED
+                self._push(task)
+                self._cond.notify()
+            return True
+
+    def cancel(self, task_id):
+        with self._cond:
+            task = self.tasks.get(task_id)
+            if task is None or task.state not in ACTIVE_STATES:
+                return False
+            task.cancel()
+            if task.state != RUNNING:
+                # 排队或暂停中的任务留在堆里，取出时跳过
+                task.state = CANCELLED
+                self._forget(task)
+            return True
+
+    def _forget(self, task):
+        """移除已结束的任务"""
+        if self.tasks.get(task.task_id) is task:
+            del self.tasks[task.task_id]
+
+    def _push(self, task):
+        heapq.heappush(self._heap, (-task.priority, task.seq, task))
+
+    def _pop_runnable(self):
+        while self._heap:
+            task = heapq.heappop(self._heap)[2]
+            # 已暂停或取消的任务留在堆里，取出时跳过
+            if task.state == QUEUED:
+                return task
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._worker_count > self._target_workers:
+                        self._worker_count -= 1
+                        return
+                    task = self._pop_runnable()
+                    if task is not None:
+                        break
+                    self._cond.wait()
+                task.state = RUNNING
+            logging.info(f"开始执行下载任务: {task.task_id}")
+
+            try:
+                state = COMPLETED if self.runner(task, *task.args) else FAILED
+            except TaskInterrupted as e:
+                state = str(e) or PAUSED
+            except Exception as e:
+                logging.error(f"下载任务异常: {task.task_id}, {str(e)}")
+                state = FAILED
+
+            with self._cond:
+                if task.cancelled:
+                    state = CANCELLED
+                elif state == PAUSED and not task.paused:
+                    # 暂停生效前已经被继续，直接重新排队
+                    state = QUEUED
+                    self._push(task)
+                    self._cond.notify()
+                if state in FINISHED_STATES:
+                    self._forget(task)
+                task.state = state
+            logging.info(f"下载任务结束: {task.task_id}, 状态: {state}")
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+from aio_transfer import AsyncTransferEngine, gather_or_cancel  # noqa: E402
+from android import LinkCache, ListingCache, Pan123  # noqa: E402
+from downloader import TaskControl, TaskInterrupted  # noqa: E402
+
+DATA = os.urandom(64 * 1024)
+CHUNK = 1024
+
+
+class FakeApi:
+    """本机的接口和存储节点：列目录分页、获取下载地址、跳转页和按 Range 慢速发送的文件数据"""
+
+    def __init__(self, items, chunk_delay=0.0):
+        self.items = items
+        self.chunk_delay = chunk_delay
+        self.requests = []
+        self.base = None
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/list", self.list_page)
+        app.router.add_post("/link", self.link)
+        app.router.add_get("/redirect/{file_id}", self.redirect)
+        app.router.add_get("/data/{file_id}", self.data)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def list_page(self, request):
+        self.requests.append(("list", request.query["Page"], request.headers.get("authorization")))
+        page, limit = int(request.query["Page"]), int(request.query["limit"])
+        items = self.items[(page - 1) * limit:page * limit]
+        return web.json_response({"code": 0, "data": {"InfoList": items, "Total": len(self.items)}})
+
+    async def link(self, request):
+        body = json.loads(await request.text())
+        self.requests.append(("link", body["fileId"], request.headers.get("authorization")))
+        return web.json_response({"code": 0, "data": {"DownloadUrl": f"{self.base}/redirect/{body['fileId']}"}})
+
+    async def redirect(self, request):
+        # 跳转页不应带登录请求头
+        self.requests.append(("redirect", request.match_info["file_id"], request.headers.get("authorization")))
+        return web.Response(text=f"<a href='{self.base}/data/{request.match_info['file_id']}?e=1'>")
+
+    async def data(self, request):
+        start = int(re.match(r"bytes=(\d+)-", request.headers.get("Range", "bytes=0-")).group(1))
+        status = 206 if start else 200
+        response = web.StreamResponse(status=status, headers={"Content-Length": str(len(DATA) - start)})
+        await response.prepare(request)
+        for offset in range(start, len(DATA), CHUNK):
+            await response.write(DATA[offset:offset + CHUNK])
+            await asyncio.sleep(self.chunk_delay)
+        return response
+
+
+class FakePan:
+    """只提供异步引擎用到的部分：请求头、缓存，以及改写到本机地址的 Pan123 请求"""
+
+    def __init__(self, api):
+        self.api = api
+        self.session = requests.Session()
+        self.session.headers.update({"authorization": "Bearer token"})
+        self.listing_cache = ListingCache()
+        self.link_cache = LinkCache()
+        self.parse_redirect = Pan123.parse_redirect
+
+    def list_page_request(self, parent_file_id, page, search_data=""):
+        _, params = Pan123.list_page_request(parent_file_id, page, search_data)
+        return self.api.base + "/list", params
+
+    def link_request(self, file_detail):
+        _, data = Pan123.link_request(file_detail)
+        return self.api.base + "/link", data
+
+
+def file_item(file_id, size=len(DATA)):
+    return {"FileId": file_id, "FileName": f"f{file_id}.bin", "Type": 0, "Size": size, "Etag": f"e{file_id}",
+            "S3KeyFlag": "x"}
+
+
+def run_with_engine(items, scenario, chunk_delay=0.0):
+    async def main():
+        api = FakeApi(items, chunk_delay)
+        await api.start()
+        try:
+            async with AsyncTransferEngine(FakePan(api), timeout=5) as engine:
+                return await scenario(api, engine)
+        finally:
+            await api.stop()
+    return asyncio.run(main())
+
+
+def test_list_dir_fetches_pages_and_fills_shared_cache():
+    items = [file_item(i) for i in range(250)]
+
+    async def scenario(api, engine):
+        code, lists = await engine.list_dir(7)
+        assert code == 0
+        assert [item["FileId"] for item in lists] == list(range(250))
+        assert [item["FileNum"] for item in lists] == list(range(250))
+        assert sorted(page for kind, page, _ in api.requests) == ["1", "2", "3"]
+        assert {auth for _, _, auth in api.requests} == {"Bearer token"}
+        # 第二次从与 Pan123 共用的列表缓存返回
+        assert engine.pan.listing_cache.get(7) == lists
+        assert (await engine.list_dir(7))[1] == lists
+        assert len(api.requests) == 3
+
+    run_with_engine(items, scenario)
+
+
+def test_link_files_resolve_redirects_and_fill_shared_cache():
+    items = [file_item(i) for i in range(1, 4)]
+
+    async def scenario(api, engine):
+        links = await engine.link_files(items + [{"FileId": 9, "FileName": "dir", "Type": 1}])
+        assert links == {i: f"{api.base}/data/{i}?e=1" for i in range(1, 4)}
+        assert engine.pan.link_cache.get((2, "e2")) == links[2]
+        # 登录请求头只发给接口，不发给跳转页
+        assert {auth for kind, _, auth in api.requests if kind == "link"} == {"Bearer token"}
+        assert {auth for kind, _, auth in api.requests if kind == "redirect"} == {None}
+        requests_before = len(api.requests)
+        assert await engine.link_file(items[0]) == links[1]
+        assert len(api.requests) == requests_before
+
+    run_with_engine(items, scenario)
+
+
+def test_paused_download_does_not_hold_a_thread(tmp_path):
+    async def scenario(api, engine):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1)
+        loop.set_default_executor(executor)
+        control = TaskControl()
+        paths = [str(tmp_path / f"{i}.bin") for i in range(3)]
+        downloads = [asyncio.ensure_future(engine.download_url(f"{api.base}/data/{i}", path, len(DATA),
+                                                               control=control))
+                     for i, path in enumerate(paths)]
+        await asyncio.sleep(0.1)
+        control.pause()
+        await asyncio.sleep(0.2)
+        # 暂停中的下载不占用默认线程池，唯一的线程仍然可用
+        assert await asyncio.wait_for(asyncio.to_thread(lambda: threading.current_thread().name), 2)
+        assert not any(download.done() for download in downloads)
+        control.resume()
+        assert await asyncio.wait_for(asyncio.gather(*downloads), 10) == [True, True, True]
+        for path in paths:
+            with open(path, "rb") as f:
+                assert f.read() == DATA
+
+    run_with_engine([], scenario, chunk_delay=0.005)
+
+
+def test_interruption_cancels_siblings_after_checkpoint(tmp_path):
+    async def scenario(api, engine):
+        path = str(tmp_path / "slow.bin")
+
+        async def interrupt():
+            await asyncio.sleep(0.2)
+            raise TaskInterrupted("paused")
+
+        with pytest.raises(TaskInterrupted):
+            await gather_or_cancel([engine.download_url(f"{api.base}/data/1", path, len(DATA), etag="v1"),
+                                    interrupt()])
+        # 异常抛出时兄弟下载已经结束并保存了断点，之后不再写入
+        with open(path + ".part.json", encoding="utf-8") as f:
+            saved = json.load(f)["segments"][0]["done"]
+        assert 0 < saved < len(DATA)
+        size = os.path.getsize(path + ".part")
+        await asyncio.sleep(0.2)
+        with open(path + ".part.json", encoding="utf-8") as f:
+            assert json.load(f)["segments"][0]["done"] == saved
+        assert os.path.getsize(path + ".part") == size
+
+        # 之后从断点继续
+        assert await engine.download_url(f"{api.base}/data/1", path, len(DATA), etag="v1")
+        with open(path, "rb") as f:
+            assert f.read() == DATA
+
+    run_with_engine([], scenario, chunk_delay=0.01)
@@ -0,0 +1,171 @@
+import calendar
+import json
+import time
+
+import pytest
+
+import android
+from android import LinkCache, ListingCache, Pan123, parse_url_expiry
+
+NOW = 1700000000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可以拨动的 time.time"""
+    now = [NOW]
+    monkeypatch.setattr(android.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.mark.parametrize("url, expected", [
+    (f"https://cdn/f?auth_key={NOW + 3600}-abc-0-sig", NOW + 3600),
+    (f"https://cdn/f?X-Amz-Date={time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(NOW))}&X-Amz-Expires=900",
+     NOW + 900),
+    (f"https://cdn/f?Expires={NOW + 60}&Signature=x", NOW + 60),
+    (f"https://cdn/f?e={NOW + 120}", NOW + 120),
+    (f"https://cdn/f?t={NOW + 5}&s=1", NOW + 5),
+    ("https://cdn/f?auth_key=soon-abc", None),
+    ("https://cdn/f?X-Amz-Date=yesterday&X-Amz-Expires=900", None),
+    ("https://cdn/f?e=later", None),
+    ("https://cdn/f", None),
+])
+def test_parse_url_expiry(url, expected):
+    assert parse_url_expiry(url) == expected
+
+
+def test_amz_date_is_utc():
+    url = "https://cdn/f?X-Amz-Date=20240101T000000Z&X-Amz-Expires=10"
+    assert parse_url_expiry(url) == calendar.timegm((2024, 1, 1, 0, 0, 0)) + 10
+
+
+def test_link_cache_expires_before_the_url(clock):
+    cache = LinkCache(default_ttl=600, margin=60)
+    cache.put((1, "e"), f"https://cdn/f?auth_key={NOW + 300}-x")
+    assert cache.get((1, "e")) == f"https://cdn/f?auth_key={NOW + 300}-x"
+    # 提前 margin 秒失效
+    clock[0] = NOW + 239
+    assert cache.get((1, "e")) is not None
+    clock[0] = NOW + 240
+    assert cache.get((1, "e")) is None
+
+
+@pytest.mark.parametrize("url", [
+    "https://cdn/f",
+    f"https://cdn/f?e={NOW - 10}",
+    f"https://cdn/f?e={NOW + 600 * 1000 + 1}",
+])
+def test_link_cache_falls_back_to_default_ttl(clock, url):
+    cache = LinkCache(default_ttl=600, margin=60)
+    cache.put(1, url)
+    clock[0] = NOW + 539
+    assert cache.get(1) == url
+    clock[0] = NOW + 540
+    assert cache.get(1) is None
+
+
+def test_link_cache_keys_include_etag(clock):
+    cache = LinkCache()
+    cache.put((1, "old"), "https://cdn/old")
+    assert cache.get((1, "new")) is None
+    cache.invalidate((1, "old"))
+    assert cache.get((1, "old")) is None
+
+
+class JsonResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class DriveSession:
+    """接口会话：按 tree 列文件夹，支持新建文件夹和移入回收站，记录列目录的请求"""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.listed = []
+
+    def get(self, url, params=None):
+        folder_id = int(params["parentFileId"])
+        self.listed.append(folder_id)
+        items = [dict(item) for item in self.tree.get(folder_id, [])]
+        return JsonResponse({"code": 0, "data": {"InfoList": items, "Total": len(items)}})
+
+    def post(self, url, data=None):
+        body = json.loads(data)
+        if url.endswith("/file/trash"):
+            file_id = body["fileTrashInfoList"]["FileId"]
+            for items in self.tree.values():
+                items[:] = [item for item in items if item["FileId"] != file_id]
+            return JsonResponse({"code": 0, "message": "ok"})
+        # 新建文件夹
+        file_id = 1000 + sum(len(items) for items in self.tree.values())
+        self.tree.setdefault(body["parentFileId"], []).append(
+            {"FileId": file_id, "FileName": body["fileName"], "Type": 1, "ParentFileId": body["parentFileId"]})
+        return JsonResponse({"code": 0, "data": {"FileId": file_id, "Info": {"FileId": file_id}}})
+
+
+@pytest.fixture
+def drive():
+    """不登录的 Pan123，接口请求发给 DriveSession"""
+    pan = Pan123.__new__(Pan123)
+    pan.session = DriveSession({
+        0: [{"FileId": 1, "FileName": "docs", "Type": 1, "ParentFileId": 0},
+            {"FileId": 2, "FileName": "a.txt", "Type": 0, "ParentFileId": 0},
+            {"FileId": 3, "FileName": "b.txt", "Type": 0, "ParentFileId": 0}],
+    })
+    pan.listing_cache = ListingCache()
+    pan.parent_file_id = 0
+    return pan
+
+
+def names(items):
+    return [item["FileName"] for item in items]
+
+
+def test_listing_cache_expires_and_returns_copies(clock):
+    cache = ListingCache(ttl=30)
+    items = [{"FileId": 1}]
+    cache.put(0, items)
+    cache.get(0).append({"FileId": 2})
+    assert cache.get(0) == items
+    clock[0] = NOW + 30
+    assert cache.get(0) is None
+
+
+def test_listing_is_cached_until_refresh(drive):
+    code, items = drive.list_dir(0)
+    assert code == 0 and names(items) == ["docs", "a.txt", "b.txt"]
+    assert drive.list_dir(0)[1] == items
+    assert drive.session.listed == [0]
+    drive.list_dir(0, refresh=True)
+    assert drive.session.listed == [0, 0]
+    # use_cache=False 既不读也不写缓存
+    drive.list_dir(5, use_cache=False)
+    assert drive.listing_cache.get(5) is None
+
+
+def test_create_folder_invalidates_parent_listing(drive):
+    drive.list_dir(0)
+    assert drive.create_folder("new", 0) is not None
+    assert names(drive.list_dir(0)[1]) == ["docs", "a.txt", "b.txt", "new"]
+    assert drive.session.listed == [0, 0]
+
+
+def test_trash_removes_item_without_relisting(drive):
+    items = drive.list_dir(0)[1]
+    assert drive.trash_file(items[1])
+    items = drive.list_dir(0)[1]
+    assert names(items) == ["docs", "b.txt"]
+    # 行号重新编号，与列表位置一致
+    assert [item["FileNum"] for item in items] == [0, 1]
+    assert drive.session.listed == [0]
+
+
+def test_restore_invalidates_parent_listing(drive):
+    items = drive.list_dir(0)[1]
+    drive._trash(items[2], operation=False)
+    drive.list_dir(0)
+    assert drive.session.listed == [0, 0]
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import pytest
+import requests
+
+import downloader
+from downloader import VERIFIED, FolderDownloader, SegmentedDownloader, VolumeDownloader
+
+DATA = bytes(range(256)) * 40  # 10240 字节
+ETAG = '"v1"'
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers, body, fail_after=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size=1):
+        for offset in range(0, len(self.body), chunk_size):
+            if self.fail_after is not None and offset >= self.fail_after:
+                raise requests.exceptions.ChunkedEncodingError("连接中断")
+            yield self.body[offset:offset + chunk_size]
+
+
+class RangeSession:
+    """按 Range 请求头返回 DATA 的片段，记录每个请求的区间
+
+    fail_after 不为None时，每个响应发送这么多字节后断开。
+    """
+
+    def __init__(self, data=DATA, etag=ETAG, fail_after=None):
+        self.data = data
+        self.etag = etag
+        self.fail_after = fail_after
+        self.ranges = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        match = re.match(r"bytes=(\d+)-(\d*)", (headers or {}).get("Range", ""))
+        if not match:
+            self.ranges.append(None)
+            return FakeResponse(200, {"ETag": self.etag, "Content-Length": str(len(self.data))}, self.data)
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(self.data) - 1
+        self.ranges.append((start, end))
+        headers = {"ETag": self.etag, "Content-Range": f"bytes {start}-{end}/{len(self.data)}"}
+        return FakeResponse(206, headers, self.data[start:end + 1], self.fail_after)
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    # 让 10KB 的测试数据也按多个分段下载
+    monkeypatch.setattr(downloader, "MIN_SEGMENT_SIZE", 1024)
+    monkeypatch.setattr(downloader, "CHUNK_SIZE", 512)
+
+
+def make_downloader(tmp_path, session, **kwargs):
+    kwargs.setdefault("connections", 2)
+    return SegmentedDownloader("http://cdn/file", str(tmp_path / "file.bin"), len(DATA), session=session, **kwargs)
+
+
+def write_partial(tmp_path, segments, etag=ETAG):
+    """伪造上次中断时留下的 .part 文件和断点日志，segments 为 [(start, end, done)]"""
+    with open(tmp_path / "file.bin.part", "wb") as f:
+        f.truncate(len(DATA))
+        for start, end, done in segments:
+            f.seek(start)
+            f.write(DATA[start:start + done])
+    journal = {"size": len(DATA), "etag": etag,
+               "segments": [{"start": start, "end": end, "done": done} for start, end, done in segments]}
+    with open(tmp_path / "file.bin.part.json", "w", encoding="utf-8") as f:
+        json.dump(journal, f)
+
+
+def test_resume_from_journal(tmp_path):
+    write_partial(tmp_path, [(0, 5119, 3000), (5120, 10239, 100)])
+    session = RangeSession()
+    expected_md5 = hashlib.md5(DATA).hexdigest()
+    d = make_downloader(tmp_path, session, expected_md5=expected_md5)
+
+    assert d.run()
+    # 探测之后只请求两个分段中缺少的部分
+    assert session.ranges[0] == (0, 0)
+    assert sorted(session.ranges[1:]) == [(3000, 5119), (5220, 10239)]
+    assert d.resumed == 3100
+    assert d.verify_status == VERIFIED
+    assert (tmp_path / "file.bin").read_bytes() == DATA
+    assert not (tmp_path / "file.bin.part").exists()
+    assert not (tmp_path / "file.bin.part.json").exists()
+
+
+def test_journal_ignored_when_etag_changes(tmp_path):
+    write_partial(tmp_path, [(0, 5119, 3000), (5120, 10239, 100)], etag='"v0"')
+    session = RangeSession()
+    d = make_downloader(tmp_path, session)
+
+    assert d.run()
+    assert d.resumed == 0
+    assert sorted(session.ranges[1:]) == [(0, 5119), (5120, 10239)]
+    assert (tmp_path / "file.bin").read_bytes() == DATA
+
+
+def test_interrupted_download_resumes_where_it_stopped(tmp_path):
+    first = RangeSession(fail_after=2048)
+    assert not make_downloader(tmp_path, first, max_retries=0).run()
+
+    # 断开前落盘的字节都记在日志里（另一个分段可能还没开始就因失败而停止）
+    with open(tmp_path / "file.bin.part.json", encoding="utf-8") as f:
+        journal = json.load(f)
+    done = [segment["done"] for segment in journal["segments"]]
+    assert 0 < sum(done) and all(value <= 2048 for value in done)
+    assert os.path.getsize(tmp_path / "file.bin.part") == len(DATA)
+
+    second = RangeSession()
+    d = make_downloader(tmp_path, second, expected_md5=hashlib.md5(DATA).hexdigest())
+    assert d.run()
+    assert d.resumed == sum(done)
+    assert sorted(start for start, _ in second.ranges[1:]) == [
+        segment["start"] + segment["done"] for segment in journal["segments"]
+    ]
+    assert d.verify_status == VERIFIED
+    assert (tmp_path / "file.bin").read_bytes() == DATA
+
+
+class ExpiringSession(RangeSession):
+    """stale 直链已过期，CDN返回403"""
+
+    def __init__(self, stale):
+        super().__init__()
+        self.stale = stale
+        self.urls = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        self.urls.append(url)
+        if url == self.stale:
+            return FakeResponse(403, {}, b"")
+        return super().get(url, headers, stream, timeout)
+
+
+def test_expired_link_is_refreshed_once(tmp_path):
+    session = ExpiringSession("http://cdn/file")
+    refreshes = []
+
+    def resolve(refresh=False):
+        refreshes.append(refresh)
+        return "http://cdn/fresh"
+
+    d = make_downloader(tmp_path, session, url_resolver=resolve)
+    assert d.run()
+    assert refreshes == [True]
+    assert set(session.urls[1:]) == {"http://cdn/fresh"}
+    assert (tmp_path / "file.bin").read_bytes() == DATA
+
+
+class TreePan:
+    """以 {文件夹ID: [子项]} 表示的云盘，记录获取直链的批次以及直链领先下载的文件数"""
+
+    def __init__(self, tree, download_delay=0.0):
+        self.tree = tree
+        self.download_delay = download_delay
+        self.batches = []
+        self.linked = set()
+        self.started = 0
+        self.max_ahead = 0
+        self._lock = threading.Lock()
+
+    def list_dir(self, folder_id):
+        return 0, list(self.tree.get(folder_id, []))
+
+    def link_files(self, files, workers):
+        with self._lock:
+            self.batches.append([item["FileId"] for item in files])
+            self.linked.update(item["FileId"] for item in files)
+            self.max_ahead = max(self.max_ahead, len(self.linked) - self.started)
+
+    def download_file(self, item, download_path, progress_callback, connections, task_bucket, control):
+        with self._lock:
+            # 下载前直链已经获取
+            assert item["FileId"] in self.linked
+            self.started += 1
+        time.sleep(self.download_delay)
+        with open(os.path.join(download_path, item["FileName"]), "wb") as f:
+            f.write(b"x" * item["Size"])
+        return True
+
+
+def tree_folder(file_id, name):
+    return {"FileId": file_id, "FileName": name, "Type": 1, "Size": 0}
+
+
+def tree_files(first_id, count):
+    return [{"FileId": first_id + i, "FileName": f"{first_id + i}.bin", "Type": 0, "Size": 10} for i in range(count)]
+
+
+def test_folder_links_are_fetched_in_batches(tmp_path):
+    pan = TreePan({1: [tree_folder(2, "sub")] + tree_files(100, 40), 2: tree_files(200, 5)})
+    assert FolderDownloader(pan, tree_folder(1, "root"), str(tmp_path)).run()
+
+    assert sorted(len(batch) for batch in pan.batches) == [5, 8, 16, 16]
+    # 每个文件的直链只获取一次
+    assert sorted(sum(pan.batches, [])) == list(range(100, 140)) + list(range(200, 205))
+    assert len(os.listdir(tmp_path / "root")) == 41 and len(os.listdir(tmp_path / "root" / "sub")) == 5
+
+
+def test_folder_links_stay_close_to_downloads(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "LINK_BATCH_SIZE", 4)
+    monkeypatch.setattr(downloader, "LINK_AHEAD", 8)
+    pan = TreePan({1: tree_files(100, 60)}, download_delay=0.002)
+    assert FolderDownloader(pan, tree_folder(1, "root"), str(tmp_path), workers=1).run()
+
+    assert pan.started == 60
+    # 名额用完时遍历线程等待下载跟上，最多多出一批
+    assert pan.max_ahead <= 8 + 4
+
+
+class VolumePan:
+    """清单和分卷都在同一个文件夹中的云盘，download_file 直接写出分卷内容"""
+
+    def __init__(self, manifest, volumes):
+        self.manifest = manifest
+        self.volumes = volumes
+        self.storage_session = self
+
+    def link_file(self, file_detail, showlink=True):
+        return "http://cdn/manifest"
+
+    def get(self, url, timeout=None):
+        manifest = self.manifest
+
+        class Response:
+            def raise_for_status(self):
+                pass
+
+            def json(self):
+                return json.loads(json.dumps(manifest))
+        return Response()
+
+    def list_dir(self, parent_file_id):
+        return 0, [{"FileName": name, "Type": 0, "Size": len(data), "Etag": hashlib.md5(data).hexdigest()}
+                   for name, data in self.volumes.items()]
+
+    def download_file(self, item, download_path, **kwargs):
+        with open(os.path.join(download_path, item["FileName"]), "wb") as f:
+            f.write(self.volumes[item["FileName"]])
+        return True
+
+
+def volume_manifest(name, volume_names, parts):
+    data = b"".join(parts)
+    return {"name": name, "size": len(data), "md5": hashlib.md5(data).hexdigest(),
+            "volumes": [{"name": volume, "size": len(part), "md5": hashlib.md5(part).hexdigest()}
+                        for volume, part in zip(volume_names, parts)]}
+
+
+def restore(tmp_path, manifest, volumes):
+    detail = {"FileName": "x.manifest.json", "ParentFileId": 1, "Type": 0}
+    out = tmp_path / "out"
+    return VolumeDownloader(VolumePan(manifest, volumes), detail, str(out)).run(), out
+
+
+def test_volumes_restore_inside_download_path(tmp_path):
+    parts = [DATA[:6000], DATA[6000:]]
+    manifest = volume_manifest("../../escape.bin", ["a.0001", "a.0002"], parts)
+    ok, out = restore(tmp_path, manifest, dict(zip(["a.0001", "a.0002"], parts)))
+
+    assert ok
+    # 清单中的路径只保留文件名
+    assert (out / "escape.bin").read_bytes() == DATA
+    assert not (tmp_path / "escape.bin").exists()
+    assert sorted(os.listdir(out)) == ["escape.bin"]
+
+
+@pytest.mark.parametrize("name, volume", [("..", "a.0001"), ("", "a.0001"), ("ok.bin", "../"),
+                                          ("ok.bin", "/etc/..")])
+def test_volumes_with_invalid_names_are_rejected(tmp_path, name, volume):
+    manifest = volume_manifest(name, [volume], [DATA])
+    ok, out = restore(tmp_path, manifest, {volume: DATA})
+    assert not ok
+    assert not out.exists() or os.listdir(out) == []
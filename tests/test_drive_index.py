@@ -0,0 +1,123 @@
+import pytest
+
+from drive_index import DriveIndex
+
+
+class FakePan:
+    """以 {文件夹ID: [子项]} 表示的云盘，记录每次列出的文件夹"""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.listed = []
+        self.failing = set()
+
+    def list_dir(self, folder_id, refresh=False, use_cache=True):
+        self.listed.append(folder_id)
+        if folder_id in self.failing:
+            return 1, []
+        return 0, list(self.tree.get(folder_id, []))
+
+
+def folder(file_id, name, update_at="t0"):
+    return {"FileId": file_id, "FileName": name, "Type": 1, "Size": 0, "Etag": "", "UpdateAt": update_at}
+
+
+def file(file_id, name, size=1, etag="e"):
+    return {"FileId": file_id, "FileName": name, "Type": 0, "Size": size, "Etag": etag, "UpdateAt": "t0"}
+
+
+@pytest.fixture
+def pan():
+    return FakePan({
+        0: [folder(1, "docs"), folder(2, "media"), file(3, "readme.txt")],
+        1: [folder(4, "old"), file(5, "report.pdf", 200)],
+        2: [file(6, "movie.mkv", 5000)],
+        4: [file(7, "archive.zip", 300)],
+    })
+
+
+@pytest.fixture
+def index(pan, tmp_path):
+    index = DriveIndex(pan, str(tmp_path / "index.db"), workers=2)
+    yield index
+    index.close()
+
+
+def names(index, **kwargs):
+    return sorted(item["FileName"] for item in index.search(**kwargs))
+
+
+def test_refresh_indexes_whole_tree(pan, index):
+    stats = index.refresh()
+    assert stats == {'folders_listed': 4, 'folders_skipped': 0, 'folders_failed': 0, 'items': 7}
+    assert index.stats()['files'] == 4 and index.stats()['folders'] == 3
+    assert [item["Path"] for item in index.search(name="archive")] == ["/docs/old/archive.zip"]
+    assert names(index, ext="PDF") == ["report.pdf"]
+    assert names(index, min_size=250, file_type=0) == ["archive.zip", "movie.mkv"]
+
+
+def test_refresh_removes_deleted_folder_with_contents(pan, index):
+    index.refresh()
+    # 删除 docs/old，docs 的 UpdateAt 随之变化
+    pan.tree[1] = [file(5, "report.pdf", 200)]
+    pan.tree[0][0] = folder(1, "docs", "t1")
+    del pan.tree[4]
+
+    index.refresh()
+    assert names(index) == ["docs", "media", "movie.mkv", "readme.txt", "report.pdf"]
+    assert index.stats()['folders'] == 2
+
+
+def test_refresh_finds_nested_changes(pan, index):
+    index.refresh()
+    # docs/old 中新增文件：old 的 UpdateAt 变化，docs 的不变
+    pan.tree[4].append(file(8, "new.iso", 900))
+    pan.tree[1][0] = folder(4, "old", "t1")
+    pan.listed.clear()
+
+    stats = index.refresh()
+    assert sorted(pan.listed) == [0, 1, 2, 4]
+    # 根目录和 media 的列表与索引相同，不重写
+    assert stats['folders_skipped'] == 2
+    assert [item["Path"] for item in index.search(name="new")] == ["/docs/old/new.iso"]
+
+
+def test_refresh_applies_changes_without_update_at(pan, index):
+    index.refresh()
+    # media 的内容变了，但它的 UpdateAt 没有变化
+    pan.tree[2] = [file(9, "other.mkv")]
+    pan.listed.clear()
+
+    stats = index.refresh()
+    assert sorted(pan.listed) == [0, 1, 2, 4]
+    # 根目录、docs、old 的列表与索引相同，不重写
+    assert stats['folders_skipped'] == 3
+    assert names(index, ext="mkv") == ["other.mkv"]
+
+
+def test_refresh_keeps_contents_of_moved_folder(pan, index):
+    index.refresh()
+    # docs/old 移到 media 下，old 自身的 UpdateAt 不变
+    pan.tree[1] = [file(5, "report.pdf", 200)]
+    pan.tree[2].append(folder(4, "old"))
+
+    index.refresh()
+    assert [item["Path"] for item in index.search(name="archive")] == ["/media/old/archive.zip"]
+    assert index.stats()['folders'] == 3
+
+
+def test_full_refresh_rewrites_every_folder(pan, index):
+    index.refresh()
+    pan.tree[2] = []
+    stats = index.refresh(full=True)
+    assert stats['folders_skipped'] == 0
+    assert index.search(name="movie") == []
+
+
+def test_failed_folder_keeps_previous_entries(pan, index):
+    index.refresh()
+    pan.failing.add(2)
+    pan.tree[2] = []
+    stats = index.refresh(full=True)
+    assert stats['folders_failed'] == 1
+    assert names(index, name="movie") == ["movie.mkv"]
@@ -0,0 +1,136 @@
+import importlib
+import json
+import os
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("flask")
+
+
+@pytest.fixture(scope="module")
+def gui(tmp_path_factory):
+    """导入 gui 模块：没有安装 webview 时用空模块代替，导入时创建的目录放在临时目录中"""
+    sys.modules.setdefault("webview", types.ModuleType("webview"))
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("gui"))
+    try:
+        yield importlib.import_module("gui")
+    finally:
+        os.chdir(cwd)
+
+
+def entry(file_id, name=None):
+    return {"FileId": file_id, "FileName": name or f"f{file_id}", "Type": 0, "Size": file_id, "FileNum": file_id}
+
+
+class FakePan:
+    """当前文件夹为 folders[parent_file_id]；search 按页返回 pages，记录取到第几页"""
+
+    def __init__(self, folders, pages=()):
+        self.folders = folders
+        self.parent_file_id = 0
+        self.list = None
+        self.pages = pages
+        self.refreshes = []
+        self.pages_fetched = 0
+
+    def get_dir(self, refresh=False):
+        self.refreshes.append(refresh)
+        self.list = list(self.folders[self.parent_file_id])
+        return 0
+
+    def cdById(self, file_id, show=True):
+        self.parent_file_id = file_id
+        self.get_dir()
+
+    def search(self, keyword, parent_file_id=0):
+        for code, items in self.pages:
+            self.pages_fetched += 1
+            yield code, items
+
+
+@pytest.fixture
+def client(gui):
+    return gui.app.test_client()
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_search_streams_items_then_summary(gui, client, monkeypatch):
+    pan = FakePan({}, pages=[(0, [entry(1), entry(2)]), (0, [entry(3)])])
+    monkeypatch.setattr(gui, "pan", pan)
+    response = client.get("/api/search?q=f")
+    assert response.mimetype == "application/x-ndjson"
+    lines = ndjson(response)
+    assert [line["FileId"] for line in lines[:-1]] == [1, 2, 3]
+    assert lines[-1] == {"done": True, "count": 3}
+
+
+def test_search_stops_fetching_at_limit(gui, client, monkeypatch):
+    pan = FakePan({}, pages=[(0, [entry(1), entry(2)]), (0, [entry(3), entry(4)]), (0, [entry(5)])])
+    monkeypatch.setattr(gui, "pan", pan)
+    lines = ndjson(client.get("/api/search?q=f&limit=3"))
+    assert [line["FileId"] for line in lines[:-1]] == [1, 2, 3]
+    assert lines[-1]["count"] == 3
+    # 第三页不再请求
+    assert pan.pages_fetched == 2
+
+    pan.pages_fetched = 0
+    assert ndjson(client.get("/api/search?q=f&limit=0")) == [{"done": True, "count": 0}]
+    assert pan.pages_fetched == 0
+
+
+def test_search_reports_errors(gui, client, monkeypatch):
+    monkeypatch.setattr(gui, "pan", FakePan({}, pages=[(0, [entry(1)]), (5, [])]))
+    lines = ndjson(client.get("/api/search?q=f"))
+    assert lines[0]["FileId"] == 1
+    assert lines[-1]["code"] == 5 and "done" not in lines[-1]
+    assert client.get("/api/search?q=%20").status_code == 400
+
+
+@pytest.fixture
+def folders(gui, monkeypatch):
+    folders = {0: [entry(i) for i in range(5)], 7: [entry(i) for i in range(100, 103)]}
+    monkeypatch.setattr(gui, "pan", FakePan(folders))
+    return folders
+
+
+def test_files_pages_come_from_one_snapshot(gui, client, folders):
+    first = client.get("/api/files?offset=0&limit=2").get_json()
+    assert [item["FileId"] for item in first["files"]] == [0, 1]
+    assert first["total"] == 5 and first["currentPath"] == 0
+
+    # 云盘上的列表变了，带 version 的分页仍然从同一份快照返回，不重新列目录
+    folders[0].insert(0, entry(99))
+    version = first["version"]
+    page = client.get(f"/api/files?version={version}&offset=2&limit=2").get_json()
+    assert [item["FileId"] for item in page["files"]] == [2, 3]
+    assert page["offset"] == 2 and page["total"] == 5 and page["version"] == version
+    last = client.get(f"/api/files?version={version}&offset=4&limit=2").get_json()
+    assert [item["FileId"] for item in last["files"]] == [4]
+    assert gui.pan.refreshes == [False]
+
+
+def test_files_with_replaced_snapshot_conflict(gui, client, folders):
+    version = client.get("/api/files?limit=2").get_json()["version"]
+    # 进入另一个文件夹后旧快照失效
+    entered = client.post("/api/cd/7?limit=1").get_json()
+    assert entered["version"] != version and entered["total"] == 3
+    stale = client.get(f"/api/files?version={version}&offset=2&limit=2")
+    assert stale.status_code == 409
+    assert stale.get_json()["version"] == entered["version"]
+
+    page = client.get(f"/api/files?version={entered['version']}&offset=1").get_json()
+    assert [item["FileId"] for item in page["files"]] == [101, 102]
+
+
+def test_files_refresh_and_ndjson(gui, client, folders):
+    response = client.get("/api/files?refresh=1&format=ndjson&offset=3")
+    assert gui.pan.refreshes == [True]
+    lines = ndjson(response)
+    assert [line["FileId"] for line in lines[:-1]] == [3, 4]
+    assert lines[-1]["done"] and lines[-1]["total"] == 5 and lines[-1]["currentPath"] == 0
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+import hashing
+from hashing import HashCache, HashService
+
+DATA = b"hello world" * 100
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """记录真正读取文件计算MD5的次数"""
+    calls = []
+    real_file_md5 = hashing.file_md5
+
+    def counting_file_md5(file_path, *args, **kwargs):
+        calls.append(os.path.basename(file_path))
+        return real_file_md5(file_path, *args, **kwargs)
+
+    monkeypatch.setattr(hashing, "file_md5", counting_file_md5)
+    return calls
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = HashCache(str(tmp_path / "hashes.db"))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def sample(tmp_path):
+    path = tmp_path / "a.bin"
+    path.write_bytes(DATA)
+    return path
+
+
+def test_unchanged_file_is_read_once(cache, sample, reads):
+    assert cache.file_md5(str(sample)) == hashlib.md5(DATA).hexdigest()
+    assert cache.file_md5(str(sample)) == hashlib.md5(DATA).hexdigest()
+    assert reads == ["a.bin"]
+    # 缓存保存在数据库中，重新打开后仍然命中
+    reopened = HashCache(cache.path)
+    assert reopened.get(str(sample)) == hashlib.md5(DATA).hexdigest()
+    reopened.close()
+
+
+def test_size_change_invalidates(cache, sample, reads):
+    cache.file_md5(str(sample))
+    stat = os.stat(sample)
+    sample.write_bytes(DATA + b"!")
+    os.utime(sample, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.get(str(sample)) is None
+    assert cache.file_md5(str(sample)) == hashlib.md5(DATA + b"!").hexdigest()
+    assert reads == ["a.bin", "a.bin"]
+
+
+def test_mtime_change_invalidates(cache, sample, reads):
+    cache.file_md5(str(sample))
+    # 同样大小的内容被改写，只有修改时间不同
+    sample.write_bytes(DATA.upper())
+    stat = os.stat(sample)
+    os.utime(sample, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.get(str(sample)) is None
+    assert cache.file_md5(str(sample)) == hashlib.md5(DATA.upper()).hexdigest()
+
+
+def test_inode_change_invalidates(cache, sample, reads, tmp_path):
+    cache.file_md5(str(sample))
+    stat = os.stat(sample)
+    # 另一个文件替换到原路径，大小和修改时间都相同
+    other = tmp_path / "other.bin"
+    other.write_bytes(DATA.upper())
+    os.utime(other, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(other, sample)
+    assert os.stat(sample).st_ino != stat.st_ino
+    assert cache.get(str(sample)) is None
+    assert cache.file_md5(str(sample)) == hashlib.md5(DATA.upper()).hexdigest()
+
+
+def test_remove_and_prune(cache, sample, tmp_path):
+    gone = tmp_path / "gone.bin"
+    gone.write_bytes(DATA)
+    cache.file_md5(str(sample))
+    cache.file_md5(str(gone))
+    gone.unlink()
+    assert cache.prune() == 1
+    assert cache.get(str(sample)) is not None
+    cache.remove(str(sample))
+    assert cache.get(str(sample)) is None
+
+
+def test_service_computes_concurrent_requests_once(sample, reads, monkeypatch, tmp_path):
+    gate = threading.Event()
+    real_file_md5 = hashing.file_md5
+
+    def gated_file_md5(file_path, *args, **kwargs):
+        gate.wait(5)
+        return real_file_md5(file_path, *args, **kwargs)
+
+    monkeypatch.setattr(hashing, "file_md5", gated_file_md5)
+    monkeypatch.chdir(tmp_path)
+    service = HashService(workers=4)
+    try:
+        # 同一文件的不同写法在计算期间都得到同一个 Future
+        futures = [service.submit(str(sample)) for _ in range(5)] + [service.submit("a.bin")]
+        assert all(future is futures[0] for future in futures)
+        gate.set()
+        assert {future.result(5) for future in futures} == {hashlib.md5(DATA).hexdigest()}
+        assert reads == ["a.bin"]
+        # 计算结束后不再保留，没有缓存时再次请求会重新计算
+        assert service.file_md5(str(sample)) == hashlib.md5(DATA).hexdigest()
+        assert reads == ["a.bin", "a.bin"]
+    finally:
+        service.close()
+
+
+def test_service_uses_cache(cache, sample, reads):
+    service = HashService(workers=2, cache=cache)
+    try:
+        assert service.file_md5(str(sample)) == hashlib.md5(DATA).hexdigest()
+        assert service.file_md5(str(sample)) == hashlib.md5(DATA).hexdigest()
+        assert reads == ["a.bin"]
+    finally:
+        service.close()
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+import ratelimit
+from ratelimit import MAX_WAIT_SLICE, BandwidthLimiter, ThrottledReader, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """假的 time.monotonic，sleep 只推进时钟并记录等待的时长"""
+
+    class Clock:
+        def __init__(self):
+            self.now = 1000.0
+            self.sleeps = []
+
+        def sleep(self, seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+    fake = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: fake.now)
+    monkeypatch.setattr(ratelimit.time, "sleep", fake.sleep)
+    return fake
+
+
+def test_unlimited_bucket_never_waits(clock):
+    bucket = TokenBucket(0)
+    bucket.consume(10 ** 9)
+    assert clock.sleeps == [] and bucket.reserve(10 ** 9) == 0
+
+
+def test_bucket_holds_average_rate(clock):
+    bucket = TokenBucket(1000)
+    for _ in range(10):
+        bucket.consume(500)
+    # 桶从空开始，5000 字节按每秒 1000 字节用去 5 秒，单次等待不超过 MAX_WAIT_SLICE
+    assert sum(clock.sleeps) == pytest.approx(5.0)
+    assert max(clock.sleeps) <= MAX_WAIT_SLICE
+
+
+def test_bucket_burst_is_capped_at_one_second(clock):
+    bucket = TokenBucket(1000)
+    clock.now += 60
+    # 空闲很久之后最多攒下 1 秒的令牌
+    bucket.consume(1000)
+    assert clock.sleeps == []
+    bucket.consume(1000)
+    assert sum(clock.sleeps) == pytest.approx(1.0)
+
+
+def test_reserve_returns_wait_without_blocking(clock):
+    bucket = TokenBucket(1000)
+    assert bucket.reserve(250) == pytest.approx(0.25)
+    assert bucket.reserve(250) == pytest.approx(0.5)
+    assert clock.sleeps == []
+
+
+def test_lifting_the_limit_releases_waiters():
+    bucket = TokenBucket(1)
+    waiter = threading.Thread(target=bucket.consume, args=(100,))
+    started = time.monotonic()
+    waiter.start()
+    time.sleep(0.05)
+    bucket.set_rate(0)
+    waiter.join(timeout=5)
+    assert not waiter.is_alive()
+    assert time.monotonic() - started < MAX_WAIT_SLICE * 3
+
+
+def test_limiter_applies_global_and_task_limits(clock):
+    limiter = BandwidthLimiter()
+    limiter.configure(upload=1000, task_upload=100)
+    task = limiter.task_bucket("upload")
+    other = limiter.task_bucket("upload", rate=0)
+    # 等待时间取全局和单任务中较长的一个
+    assert limiter.reserve("upload", 100, task) == pytest.approx(1.0)
+    assert limiter.reserve("upload", 100, other) == pytest.approx(0.2)
+    assert limiter.reserve("download", 10 ** 6) == 0
+
+    # 修改单任务限速，已经创建的任务令牌桶随之生效
+    limiter.configure(task_upload=500)
+    assert task.rate == 500 and limiter.task_bucket("upload").rate == 500
+    assert limiter.buckets["upload"].rate == 1000
+
+
+def test_throttled_reader_consumes_per_block():
+    calls = []
+
+    class Limiter:
+        def consume(self, direction, amount, task_bucket=None):
+            calls.append((direction, amount, task_bucket))
+
+    bucket = object()
+    data = bytes(range(256)) * 10
+    reader = ThrottledReader(data, Limiter(), bucket, block_size=1000)
+    assert len(reader) == 2560
+    chunks = [reader.read(), reader.read(4096), reader.read(100), reader.read(-1)]
+    assert b"".join(chunks) == data and [len(chunk) for chunk in chunks] == [1000, 1000, 100, 460]
+    assert len(reader) == 0 and reader.read() == b""
+    assert calls == [("upload", n, bucket) for n in (1000, 1000, 100, 460)]
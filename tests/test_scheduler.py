@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import CANCELLED, COMPLETED, FAILED, DownloadScheduler
+
+
+class Runner:
+    """按 task_id 返回预设结果的下载函数，gate 中的任务等待放行后才结束"""
+
+    def __init__(self, results):
+        self.results = results
+        self.gates = {}
+
+    def __call__(self, task, *args):
+        gate = self.gates.get(task.task_id)
+        if gate is not None:
+            gate.wait(5)
+            task.check()
+        result = self.results.get(task.task_id, True)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def wait(*tasks):
+    """等待这些任务结束，返回 {task_id: 最终状态}"""
+    for task in tasks:
+        for _ in range(500):
+            if task.state in (COMPLETED, FAILED, CANCELLED):
+                break
+            time.sleep(0.01)
+    return {task.task_id: task.state for task in tasks}
+
+
+@pytest.mark.parametrize("result, state", [(True, COMPLETED), (False, FAILED), (RuntimeError("boom"), FAILED)])
+def test_task_state_follows_runner_result(result, state):
+    runner = Runner({1: result})
+    scheduler = DownloadScheduler(runner, workers=1)
+    task = scheduler.submit(1)
+    assert wait(task) == {1: state}
+    # 结束的任务不再保存在调度器中
+    assert scheduler.tasks == {}
+    assert not scheduler.is_active(1)
+
+
+def test_finished_tasks_are_removed():
+    runner = Runner({})
+    runner.gates[1] = threading.Event()
+    scheduler = DownloadScheduler(runner, workers=1)
+    first, second = scheduler.submit(1), scheduler.submit(2)
+    scheduler.submit(3)
+    # 排队中的任务取消后立即移除
+    assert scheduler.cancel(3)
+    assert set(scheduler.tasks) == {1, 2}
+    # 运行中的任务取消后，在工作线程退出时移除
+    assert scheduler.cancel(1)
+    runner.gates[1].set()
+    assert wait(first, second) == {1: CANCELLED, 2: COMPLETED}
+    assert scheduler.tasks == {}
@@ -0,0 +1,464 @@
+import hashlib
+import io
+import json
+import os
+import threading
+
+import pytest
+
+import uploader
+from uploader import (
+    MAX_PART_SIZE,
+    MAX_PARTS,
+    MIN_PART_SIZE,
+    PART_MEMORY_LIMIT,
+    PART_SIZE_ALIGN,
+    ByteBudget,
+    MultipartUploader,
+    StreamUploader,
+    UploadError,
+    UploadSessionExpired,
+    UploadSessionStore,
+    choose_part_size,
+)
+
+PART_SIZE = 1024
+UPLOAD_INFO = {"Bucket": "b", "Key": "k", "UploadId": "u", "StorageNode": "s", "FileId": 1}
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None, data=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeApi:
+    """接口会话：返回预签名链接，并按 storage 已收到的分块回答 s3_list_upload_parts"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.batches = []
+        self.calls = []
+        self.expired = False
+        self._lock = threading.Lock()
+
+    def post(self, url, data=None):
+        name = url.rsplit("/", 1)[1]
+        body = json.loads(data)
+        with self._lock:
+            self.calls.append(name)
+        if name == "s3_repare_upload_parts_batch":
+            start, end = body["partNumberStart"], body["partNumberEnd"]
+            with self._lock:
+                self.batches.append((start, end))
+            urls = {str(number): f"http://storage/{number}" for number in range(start, end)}
+            return FakeResponse(data={"code": 0, "data": {"presignedUrls": urls}})
+        if name == "s3_list_upload_parts":
+            if self.expired:
+                return FakeResponse(data={"code": 1, "message": "upload id not found"})
+            parts = [{"PartNumber": number, "ETag": f'"{etag}"'} for number, etag in self.storage.parts.items()]
+            return FakeResponse(data={"code": 0, "data": {"Parts": parts}})
+        return FakeResponse(data={"code": 0, "data": {}})
+
+
+class FakeStorage:
+    """对象存储：PUT 返回分块内容的MD5作为ETag
+
+    corrupt 为 {分块编号: 次数}，这些分块的前几次PUT返回错误的ETag，模拟传输中损坏。
+    """
+
+    def __init__(self, corrupt=None):
+        self.corrupt = dict(corrupt or {})
+        self.parts = {}
+        self.puts = []
+        self._lock = threading.Lock()
+
+    def put(self, url, data=None):
+        number = int(url.rsplit("/", 1)[1])
+        body = b"".join(iter(lambda: data.read(65536), b""))
+        etag = hashlib.md5(body).hexdigest()
+        with self._lock:
+            self.puts.append(number)
+            if self.corrupt.get(number, 0) > 0:
+                self.corrupt[number] -= 1
+                etag = hashlib.md5(body + b"x").hexdigest()
+            self.parts[number] = etag
+        return FakeResponse(headers={"ETag": f'"{etag}"'})
+
+
+class FakePan:
+    def __init__(self, corrupt=None):
+        self.storage_session = FakeStorage(corrupt)
+        self.session = FakeApi(self.storage_session)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(uploader.time, "sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def source(tmp_path):
+    data = bytes(range(256)) * 4 * 7 + b"tail"  # 7 个整块加一个不满的尾块
+    path = tmp_path / "source.bin"
+    path.write_bytes(data)
+    return str(path), data
+
+
+def make_uploader(pan, source, **kwargs):
+    path, data = source
+    kwargs.setdefault("buffers", ByteBudget(PART_SIZE * 16))
+    return MultipartUploader(pan, path, UPLOAD_INFO, len(data), part_size=PART_SIZE, **kwargs)
+
+
+def part_md5(data, number):
+    return hashlib.md5(data[(number - 1) * PART_SIZE:number * PART_SIZE]).hexdigest()
+
+
+def test_etag_mismatch_retries_only_that_part(source):
+    pan = FakePan(corrupt={3: 1})
+    u = make_uploader(pan, source)
+    u.run()
+
+    _, data = source
+    assert sorted(pan.storage_session.puts) == [1, 2, 3, 3, 4, 5, 6, 7, 8]
+    assert u.etags == {number: part_md5(data, number) for number in range(1, 9)}
+    assert u.uploaded == len(data)
+    assert pan.session.calls[-2:] == ["s3_complete_multipart_upload", "upload_complete"]
+
+
+def test_etag_mismatch_fails_after_retries(source):
+    pan = FakePan(corrupt={2: 10})
+    u = make_uploader(pan, source, max_retries=2)
+    with pytest.raises(UploadError):
+        u.upload_part(2)
+    assert pan.storage_session.puts == [2, 2, 2]
+    assert 2 not in u.etags
+
+
+def test_presigned_urls_requested_in_aligned_batches(source):
+    pan = FakePan()
+    u = make_uploader(pan, source, url_batch=3, workers=8)
+    # 无论哪个分块先申请，批次都按 url_batch 对齐，每批只申请一次
+    for number in (5, 4, 8, 1, 6):
+        assert u.presigned_url(number) == f"http://storage/{number}"
+    assert pan.session.batches == [(4, 7), (7, 9), (1, 4)]
+
+    u.upload_parts(range(1, 9))
+    assert sorted(pan.session.batches) == [(1, 4), (4, 7), (7, 9)]
+
+
+class BrokenUrlApi(FakeApi):
+    """前 failures 次申请预签名链接时返回 bad_response"""
+
+    def __init__(self, storage, bad_response, failures):
+        super().__init__(storage)
+        self.bad_response = bad_response
+        self.failures = failures
+
+    def post(self, url, data=None):
+        if url.endswith("s3_repare_upload_parts_batch") and self.failures > 0:
+            self.failures -= 1
+            return self.bad_response
+        return super().post(url, data)
+
+
+class NotJson(FakeResponse):
+    def json(self):
+        raise ValueError("Expecting value: line 1 column 1 (char 0)")
+
+
+@pytest.mark.parametrize("bad_response", [
+    FakeResponse(data={"code": 0, "data": {}}),
+    FakeResponse(data={"code": 0, "data": {"presignedUrls": None}}),
+    FakeResponse(data={"code": 0, "data": {"presignedUrls": {"x": "http://storage/x"}}}),
+    FakeResponse(data={"message": "busy"}),
+    NotJson(status_code=502),
+])
+def test_malformed_presigned_url_response_is_retried(source, bad_response):
+    pan = FakePan()
+    pan.session = BrokenUrlApi(pan.storage_session, bad_response, failures=1)
+    u = make_uploader(pan, source, url_batch=1)
+    with pytest.raises(UploadError):
+        u.presigned_url(1)
+    # 错误走分块的重试流程，第二次申请成功
+    u.upload_part(1)
+    assert pan.storage_session.puts == [1]
+
+    # 一直失败时重试用尽，抛出 UploadError
+    pan.session.failures = 10
+    with pytest.raises(UploadError):
+        u.upload_part(4)
+    assert pan.storage_session.puts == [1]
+
+
+def test_resume_uploads_only_missing_parts(source):
+    _, data = source
+    pan = FakePan()
+    # 上次上传中断时服务器已经收到第1、2、5块
+    pan.storage_session.parts = {number: part_md5(data, number) for number in (1, 2, 5)}
+    u = make_uploader(pan, source)
+    u.run(resume=True)
+
+    assert sorted(pan.storage_session.puts) == [3, 4, 6, 7, 8]
+    assert u.uploaded == len(data)
+    assert u.etags == {number: part_md5(data, number) for number in range(1, 9)}
+
+
+def test_resume_with_expired_session(source):
+    pan = FakePan()
+    pan.session.expired = True
+    with pytest.raises(UploadSessionExpired):
+        make_uploader(pan, source).run(resume=True)
+    assert pan.storage_session.puts == []
+
+
+def test_session_store_matches_file_and_folder(tmp_path, source):
+    path, _ = source
+    store = UploadSessionStore(str(tmp_path / "sessions.json"))
+    store.save(path, 7, "etag", UPLOAD_INFO, PART_SIZE)
+
+    session = store.find(path, 7)
+    assert session["UploadId"] == "u" and session["part_size"] == PART_SIZE
+    # 换了目标文件夹不沿用
+    assert store.find(path, 8) is None
+
+    # 文件被修改后不沿用
+    with open(path, "ab") as f:
+        f.write(b"more")
+    assert store.find(path, 7) is None
+
+    store.save(path, 7, "etag", UPLOAD_INFO, PART_SIZE)
+    store.remove(path)
+    assert store.find(path, 7) is None
+
+
+def test_session_store_reads_file_once_and_writes_only_changes(tmp_path, source, monkeypatch):
+    path, _ = source
+    sessions_file = tmp_path / "sessions.json"
+    UploadSessionStore(str(sessions_file)).save(path, 7, "etag", UPLOAD_INFO, PART_SIZE)
+
+    store = UploadSessionStore(str(sessions_file))
+    loads, dumps = [], []
+    real_load, real_dump = store._load, store._dump
+    monkeypatch.setattr(store, "_load", lambda: loads.append(1) or real_load())
+    monkeypatch.setattr(store, "_dump", lambda: dumps.append(1) or real_dump())
+    for _ in range(5):
+        assert store.find(path, 7)["UploadId"] == "u"
+    # 删除不存在的会话不写文件
+    store.remove(str(tmp_path / "other.bin"))
+    assert len(loads) == 1 and dumps == []
+
+    store.remove(path)
+    assert dumps == [1]
+    assert UploadSessionStore(str(sessions_file)).find(path, 7) is None
+
+
+@pytest.mark.parametrize("file_size", [0, 1, MIN_PART_SIZE, 3 * MIN_PART_SIZE + 1, 50 * 1024 ** 3,
+                                       MAX_PART_SIZE * MAX_PARTS])
+@pytest.mark.parametrize("throughput", [None, 100 * 1024, 50 * 1024 * 1024, 10 * 1024 ** 3])
+def test_part_size_within_bounds(file_size, throughput):
+    part_size = choose_part_size(file_size, throughput)
+    assert MIN_PART_SIZE <= part_size <= MAX_PART_SIZE
+    assert part_size % PART_SIZE_ALIGN == 0
+    assert -(-file_size // part_size) <= MAX_PARTS
+
+
+def test_part_size_follows_throughput():
+    size = 10 * 1024 ** 3
+    assert choose_part_size(size) == MIN_PART_SIZE
+    # 每块约上传 TARGET_PART_SECONDS 秒，但不超过单块的内存上限
+    assert choose_part_size(size, 4 * 1024 * 1024) == 4 * 1024 * 1024 * uploader.TARGET_PART_SECONDS
+    assert choose_part_size(size, 10 * 1024 ** 3) == PART_MEMORY_LIMIT
+    # 整个文件放得进一个分块时不再放大
+    assert choose_part_size(20 * 1024 * 1024 + 1, 10 * 1024 ** 3) == 21 * 1024 * 1024
+
+
+def test_part_size_rejects_oversized_file():
+    with pytest.raises(UploadError):
+        choose_part_size(MAX_PART_SIZE * MAX_PARTS + 1)
+
+
+def test_byte_budget_blocks_until_released():
+    budget = ByteBudget(100)
+    assert budget.acquire(60) == 60
+    # 超过总额的请求按总额计
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(budget.acquire(1000)))
+    waiter.start()
+    waiter.join(timeout=0.1)
+    assert waiter.is_alive() and budget.used == 60
+    budget.release(60)
+    waiter.join(timeout=5)
+    assert acquired == [100] and budget.used == 100
+    budget.release(100)
+    assert budget.used == 0
+
+
+def test_parts_in_memory_stay_within_budget(source):
+    budget = ByteBudget(PART_SIZE * 2)
+    peak = []
+    real_upload_part = MultipartUploader._upload_part
+
+    def tracking_upload_part(self, part_number):
+        peak.append(budget.used)
+        real_upload_part(self, part_number)
+
+    u = make_uploader(FakePan(), source, workers=8, buffers=budget)
+    u._upload_part = tracking_upload_part.__get__(u)
+    u.upload_parts(range(1, 9))
+    assert len(peak) == 8 and 0 < max(peak) <= PART_SIZE * 2
+    assert budget.used == 0
+
+
+class Recorder:
+    """什么也不做的哈希缓存和会话存储"""
+
+    def put(self, path, md5):
+        pass
+
+    def remove(self, path):
+        pass
+
+
+class StreamPan:
+    """记录流上传的每次 upload_file 调用；fail_on 中的文件名上传失败"""
+
+    def __init__(self, existing=(), fail_on=()):
+        self.files = [{"FileId": i, "FileName": name, "Type": 0, "Etag": ""} for i, name in enumerate(existing)]
+        self.fail_on = set(fail_on)
+        self.uploads = []
+        self.trashed = []
+        self.hash_cache = Recorder()
+        self.upload_sessions = Recorder()
+
+    def list_dir(self, parent_file_id, refresh=False):
+        return 0, list(self.files)
+
+    def upload_file(self, path, parent_file_id, duplicate=None, task_bucket=None):
+        name = os.path.basename(path)
+        self.uploads.append((name, duplicate, task_bucket))
+        if name in self.fail_on:
+            return False
+        with open(path, "rb") as f:
+            etag = hashlib.md5(f.read()).hexdigest()
+        self.files.append({"FileId": len(self.files) + 100, "FileName": name, "Type": 0, "Etag": etag})
+        return True
+
+    def trash_file(self, file_detail):
+        self.trashed.append(file_detail["FileName"])
+        self.files.remove(file_detail)
+        return True
+
+
+def upload_stream(pan, data, **kwargs):
+    return StreamUploader(pan, io.BytesIO(data), "db.sql", 0, volume_size=100, **kwargs).run()
+
+
+def test_stream_volumes_and_manifest_do_not_overwrite():
+    pan = StreamPan()
+    bucket = object()
+    assert upload_stream(pan, b"x" * 250, task_bucket=bucket)
+    assert pan.uploads == [("db.sql.0001", 0, bucket), ("db.sql.0002", 0, bucket), ("db.sql.0003", 0, bucket),
+                           ("db.sql" + uploader.MANIFEST_SUFFIX, 0, bucket)]
+
+
+@pytest.mark.parametrize("existing", ["db.sql", "db.sql.0002", "db.sql" + uploader.MANIFEST_SUFFIX])
+def test_stream_refuses_name_clash_before_reading(existing):
+    pan = StreamPan(existing=[existing, "other.sql"])
+    stream = io.BytesIO(b"x" * 250)
+    assert not StreamUploader(pan, stream, "db.sql", 0, volume_size=100).run()
+    assert pan.uploads == [] and stream.tell() == 0
+    # 明确要求覆盖时照常上传
+    assert StreamUploader(pan, stream, "db.sql", 0, volume_size=100, duplicate=1).run()
+
+
+@pytest.mark.parametrize("fail_on, uploaded", [
+    ("db.sql.0003", ["db.sql.0001", "db.sql.0002"]),
+    ("db.sql" + uploader.MANIFEST_SUFFIX, ["db.sql.0001", "db.sql.0002", "db.sql.0003"]),
+])
+def test_failed_stream_removes_uploaded_volumes(fail_on, uploaded):
+    pan = StreamPan(existing=["other.sql"], fail_on=[fail_on])
+    assert not upload_stream(pan, b"x" * 250)
+    assert sorted(pan.trashed) == uploaded
+    assert [item["FileName"] for item in pan.files] == ["other.sql"]
+
+
+class CountingHasher:
+    """记录提前计算MD5的文件，以及提交时还没上传完的最多文件数"""
+
+    def __init__(self, pan):
+        self.pan = pan
+        self.submitted = []
+        self.peak = 0
+
+    def submit(self, path):
+        self.submitted.append(path)
+        self.peak = max(self.peak, len(self.submitted) - len(self.pan.uploads))
+
+    def file_md5(self, path):
+        with open(path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+
+class FolderPan:
+    """目标文件夹 0 已存在，remote 为其中已有的 {文件名: ETag}"""
+
+    def __init__(self, remote=None):
+        self.remote = remote or {}
+        self.uploads = []
+        self.hasher = CountingHasher(self)
+        self._lock = threading.Lock()
+
+    def list_dir(self, parent_file_id, refresh=False):
+        if parent_file_id == 0:
+            return 0, [{"FileId": 1, "FileName": "tree", "Type": 1}]
+        return 0, [{"FileId": 10 + i, "FileName": name, "Type": 0, "Etag": etag}
+                   for i, (name, etag) in enumerate(self.remote.items())]
+
+    def create_folder(self, name, parent_file_id):
+        return 2
+
+    def upload_file(self, path, parent_file_id, duplicate=None, task_bucket=None):
+        with self._lock:
+            self.uploads.append((os.path.basename(path), duplicate))
+        return True
+
+
+@pytest.fixture
+def tree(tmp_path):
+    folder = tmp_path / "tree"
+    folder.mkdir()
+    for i in range(30):
+        (folder / f"{i:02d}.txt").write_bytes(b"%d" % i)
+    return str(folder)
+
+
+def test_folder_upload_asks_once_for_name_clashes(tree, monkeypatch):
+    pan = FolderPan({"00.txt": "different", "01.txt": "other", "02.txt": hashlib.md5(b"2").hexdigest()})
+    answers = []
+    monkeypatch.setattr("builtins.input", lambda prompt: answers.append(prompt) or "0")
+    u = uploader.FolderUploader(pan, tree, 0, workers=4)
+    assert u.run()
+    assert len(answers) == 1
+    # 内容不同的同名文件跳过，内容相同的算作已上传，其他文件不覆盖
+    assert u.skipped_files == 2 and u.done_files == 28
+    assert sorted(name for name, _ in pan.uploads) == [f"{i:02d}.txt" for i in range(3, 30)]
+    assert {duplicate for _, duplicate in pan.uploads} == {0}
+
+
+def test_folder_upload_overwrites_only_when_asked(tree):
+    pan = FolderPan({"00.txt": "different"})
+    assert uploader.FolderUploader(pan, tree, 0, workers=2, duplicate=1).run()
+    assert dict(pan.uploads)["00.txt"] == 1 and dict(pan.uploads)["05.txt"] == 1
+
+
+def test_folder_upload_bounds_prehash_look_ahead(tree):
+    pan = FolderPan()
+    assert uploader.FolderUploader(pan, tree, 0, workers=1).run()
+    assert len(pan.uploads) == 30
+    assert pan.hasher.peak <= uploader.PREHASH_AHEAD
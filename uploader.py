@@ -0,0 +1,911 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+from downloader import MANIFEST_SUFFIX, MD5_PATTERN, format_size
+from hashing import READ_SIZE, fits_in_cache, read_range
+from ratelimit import ThrottledReader, bandwidth_limiter
+
+# 秒传探测结果
+REUSED = "reused"  # 服务器已有相同MD5的文件，秒传完成
+NEEDS_TRANSFER = "transfer"  # 需要实际上传数据
+CONFLICT = "conflict"  # 云盘上已有内容不同的同名文件，探测不覆盖
+
+# 分块上传默认参数
+DEFAULT_PART_SIZE = 5242880  # 没有测速数据时的分块大小
+MIN_PART_SIZE = 5 * 1024 * 1024  # 存储后端允许的最小分块（最后一块除外）
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024  # 存储后端允许的最大分块
+MAX_PARTS = 10000  # 存储后端允许的最大分块数
+PART_MEMORY_LIMIT = 256 * 1024 * 1024  # 每个分块在内存中的上限，只有分块数超限时才会突破
+PART_BUFFER_LIMIT = 512 * 1024 * 1024  # 进程内所有上传同时读入内存的分块总大小上限
+TARGET_PART_SECONDS = 10  # 按实测速度，每个分块大约上传这么长时间
+PART_SIZE_ALIGN = 1024 * 1024  # 分块大小按1MB对齐
+DEFAULT_UPLOAD_WORKERS = 4  # 同时上传的分块数
+URL_BATCH_SIZE = 10  # 每次申请的预签名链接数
+LARGE_FILE_SIZE = 64 * 1024 * 1024  # 超过此大小的文件合并分块需要等待服务器处理
+API_URL = "https://www.123pan.com/b/api/file/"
+UPLOAD_SESSIONS_FILE = "upload_sessions.json"  # 未完成上传的会话记录
+DEFAULT_VOLUME_SIZE = 1024 * 1024 * 1024  # 流上传的默认分卷大小
+PREHASH_AHEAD = 4  # 文件夹上传时每个上传线程最多提前计算MD5的文件数
+
+
+class UploadError(Exception):
+    """上传接口返回错误，或分块多次重试后仍然失败"""
+
+
+class UploadSessionExpired(UploadError):
+    """保存的上传会话在服务器上已失效，只能重新开始上传"""
+
+
+class ThroughputMeter:
+    """单个连接上传速度的滑动平均（字节/秒），用于选择后续上传的分块大小"""
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.rate = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, size, seconds):
+        # 太小的分块测得的速度主要反映请求延迟，不计入
+        if seconds <= 0 or size < MIN_PART_SIZE:
+            return
+        with self._lock:
+            speed = size / seconds
+            self.rate = speed if self.rate == 0 else self.rate + self.alpha * (speed - self.rate)
+
+
+# 进程内共享的上传测速
+upload_throughput = ThroughputMeter()
+
+
+class ByteBudget:
+    """按字节计数的信号量，限制同时读入内存的分块总大小
+
+    超过总额的单个请求按总额计，等其他占用全部释放后放行，不会永远阻塞。
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, amount):
+        """占用amount个字节，额度不够时阻塞等待，返回实际占用的字节数（传给 release）"""
+        amount = min(amount, self.limit)
+        with self._cond:
+            while self.used + amount > self.limit:
+                self._cond.wait()
+            self.used += amount
+        return amount
+
+    def release(self, amount):
+        with self._cond:
+            self.used -= amount
+            self._cond.notify_all()
+
+
+# 进程内所有分块上传共享的内存额度，多个文件、多个分块线程同时上传时总内存有上限
+part_buffers = ByteBudget(PART_BUFFER_LIMIT)
+
+
+def choose_part_size(file_size, throughput=None):
+    """根据文件大小和实测速度选择分块大小
+
+    有测速数据时让每个分块上传约 TARGET_PART_SECONDS 秒，减少快速链路上的请求往返；
+    同时保证分块数不超过 MAX_PARTS，并限制在存储后端允许的范围内。
+    """
+    if file_size > MAX_PART_SIZE * MAX_PARTS:
+        raise UploadError(f"文件过大，超过存储后端 {MAX_PARTS} 个分块的上限")
+    part_size = DEFAULT_PART_SIZE
+    if throughput:
+        part_size = min(max(part_size, int(throughput * TARGET_PART_SECONDS)), PART_MEMORY_LIMIT)
+    part_size = max(part_size, math.ceil(file_size / MAX_PARTS), MIN_PART_SIZE)
+    part_size = math.ceil(part_size / PART_SIZE_ALIGN) * PART_SIZE_ALIGN
+    part_size = min(part_size, MAX_PART_SIZE)
+    # 整个文件放得进一个分块时不必更大
+    if file_size <= part_size:
+        part_size = max(MIN_PART_SIZE, math.ceil(file_size / PART_SIZE_ALIGN) * PART_SIZE_ALIGN)
+    return part_size
+
+
+class UploadSessionStore:
+    """本地保存的未完成上传会话
+
+    以文件绝对路径为键，记录 upload_request 返回的 Bucket、Key、UploadId、StorageNode、
+    FileId，以及分块大小和文件指纹（大小、修改时间、MD5、目标文件夹）。文件没有变化时，
+    重新上传可以沿用原来的会话，只补传服务器上缺少的分块。
+
+    会话在第一次使用时读入内存，之后查找不读文件；只有保存或删除了会话时才写回文件。
+    """
+
+    def __init__(self, path=UPLOAD_SESSIONS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sessions = None
+
+    def _loaded(self):
+        """内存中的会话，第一次调用时从文件读入；调用方持有锁"""
+        if self._sessions is None:
+            self._sessions = self._load()
+        return self._sessions
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取上传会话失败: {str(e)}")
+            return {}
+
+    def _dump(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self._sessions, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def fingerprint(file_path):
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+    def find(self, file_path, parent_file_id):
+        """返回与当前文件和目标文件夹匹配的会话，没有时返回None"""
+        key, size, mtime = self.fingerprint(file_path)
+        with self._lock:
+            session = self._loaded().get(key)
+        if session and session["size"] == size and session["mtime"] == mtime \
+                and session["parent_file_id"] == parent_file_id:
+            return dict(session)
+        return None
+
+    def save(self, file_path, parent_file_id, etag, upload_info, part_size):
+        key, size, mtime = self.fingerprint(file_path)
+        session = {
+            "size": size,
+            "mtime": mtime,
+            "etag": etag,
+            "parent_file_id": parent_file_id,
+            "part_size": part_size,
+            "Bucket": upload_info["Bucket"],
+            "Key": upload_info["Key"],
+            "UploadId": upload_info["UploadId"],
+            "StorageNode": upload_info["StorageNode"],
+            "FileId": upload_info["FileId"],
+        }
+        with self._lock:
+            self._loaded()[key] = session
+            self._dump()
+        return session
+
+    def remove(self, file_path):
+        key = os.path.abspath(file_path)
+        with self._lock:
+            if self._loaded().pop(key, None) is not None:
+                self._dump()
+
+
+class MultipartUploader:
+    """并行分块上传
+
+    把文件按 part_size 切分，分批向服务器申请预签名上传链接，用有界线程池并发PUT
+    各分块，同时读入内存的分块总大小受 buffers（默认为进程内共享的 part_buffers）限制。
+    单个分块失败时只重试该分块，链接失效（403）时重新申请。每个分块的ETag
+    与本地计算的MD5核对，合并前再用 s3_list_upload_parts 确认服务器收到的分块，
+    缺失或不一致的分块重新上传。
+
+    upload_info 为 upload_request 返回的 data（Bucket、Key、UploadId、StorageNode、FileId）。
+    """
+
+    def __init__(
+            self,
+            pan,
+            file_path,
+            upload_info,
+            file_size,
+            part_size=DEFAULT_PART_SIZE,
+            workers=DEFAULT_UPLOAD_WORKERS,
+            url_batch=URL_BATCH_SIZE,
+            max_retries=3,
+            task_bucket=None,
+            progress_callback=None,
+            buffers=None,
+    ):
+        self.pan = pan
+        self.file_path = file_path
+        self.bucket = upload_info["Bucket"]
+        self.key = upload_info["Key"]
+        self.upload_id = upload_info["UploadId"]
+        self.storage_node = upload_info["StorageNode"]
+        self.file_id = upload_info["FileId"]
+        self.file_size = file_size
+        self.part_size = part_size
+        self.part_count = max(1, math.ceil(file_size / part_size))
+        self.workers = max(1, int(workers))
+        self.url_batch = max(1, int(url_batch))
+        self.max_retries = max_retries
+        self.task_bucket = task_bucket
+        self.progress_callback = progress_callback
+        self.buffers = part_buffers if buffers is None else buffers
+        # 放不下页缓存的大文件，分块读完即丢弃缓存
+        self.drop_cache = not fits_in_cache(file_size)
+
+        self.etags = {}  # 分块编号 -> ETag
+        self.uploaded = 0
+        self._urls = {}
+        self._url_requests = {}  # 批次的第一个分块编号 -> 正在进行的申请
+        self._url_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def _api(self, name, data):
+        try:
+            res = self.pan.session.post(API_URL + name, data=json.dumps(data)).json()
+        except ValueError as e:
+            # 网关错误页等非JSON响应按可重试的接口错误处理
+            raise UploadError(f"{name} 返回的不是JSON: {str(e)}")
+        if not isinstance(res, dict) or res.get("code") != 0:
+            raise UploadError(f"{name} 失败: {res}")
+        return res.get("data") or {}
+
+    def _session_data(self):
+        return {
+            "bucket": self.bucket,
+            "key": self.key,
+            "uploadId": self.upload_id,
+            "storageNode": self.storage_node,
+        }
+
+    def presigned_url(self, part_number, refresh=False):
+        """返回分块的上传链接
+
+        链接按 url_batch 对齐分批申请（第1～10块、第11～20块……），未缓存时申请分块所在的
+        整批；同一批同时只有一个请求，其他需要这一批链接的线程等待它的结果。
+        """
+        start = (part_number - 1) // self.url_batch * self.url_batch + 1
+        with self._url_lock:
+            if refresh:
+                self._urls.pop(part_number, None)
+            url = self._urls.get(part_number)
+            if url:
+                return url
+            request = self._url_requests.get(start)
+            owner = request is None
+            if owner:
+                request = Future()
+                self._url_requests[start] = request
+        if owner:
+            try:
+                data = self._api("s3_repare_upload_parts_batch", {
+                    "bucket": self.bucket,
+                    "key": self.key,
+                    "partNumberEnd": min(start + self.url_batch, self.part_count + 1),
+                    "partNumberStart": start,
+                    "uploadId": self.upload_id,
+                    "StorageNode": self.storage_node,
+                })
+                try:
+                    urls = {int(number): url for number, url in data["presignedUrls"].items()}
+                except (KeyError, AttributeError, TypeError, ValueError) as e:
+                    raise UploadError(f"预签名链接的格式不正确: {data}") from e
+            except Exception as e:
+                with self._url_lock:
+                    self._url_requests.pop(start, None)
+                request.set_exception(e)
+                raise
+            with self._url_lock:
+                self._urls.update(urls)
+                self._url_requests.pop(start, None)
+            request.set_result(urls)
+        urls = request.result()
+        if part_number not in urls:
+            raise UploadError(f"没有返回分块 {part_number} 的上传链接")
+        return urls[part_number]
+
+    def read_part(self, part_number):
+        """读取分块数据，同时提示系统预读后面的分块"""
+        offset = (part_number - 1) * self.part_size
+        prefetch = self.part_size * self.workers if part_number < self.part_count else 0
+        return read_range(self.file_path, offset, self.part_size, prefetch, self.drop_cache)
+
+    def upload_part(self, part_number):
+        """上传单个分块，失败时只重试这一块
+
+        分块从读入内存到上传结束一直占用 buffers 的额度，额度不够时等待其他分块传完。
+        """
+        offset = (part_number - 1) * self.part_size
+        reserved = self.buffers.acquire(min(self.part_size, self.file_size - offset))
+        try:
+            self._upload_part(part_number)
+        finally:
+            self.buffers.release(reserved)
+
+    def _upload_part(self, part_number):
+        data = self.read_part(part_number)
+        local_md5 = hashlib.md5(data).hexdigest()
+        refresh = False
+        for attempt in range(1, self.max_retries + 2):
+            try:
+                url = self.presigned_url(part_number, refresh)
+                started = time.time()
+                r = self.pan.storage_session.put(url, data=ThrottledReader(data, bandwidth_limiter, self.task_bucket))
+                if r.status_code == 200:
+                    upload_throughput.record(len(data), time.time() - started)
+                    etag = r.headers.get("ETag", "").strip('"')
+                    # 普通分块的ETag就是分块内容的MD5，不一致说明数据在传输中损坏
+                    if etag and MD5_PATTERN.match(etag) and etag.lower() != local_md5:
+                        raise UploadError(f"ETag不一致: {etag} != {local_md5}")
+                    with self._lock:
+                        self.etags[part_number] = etag or local_md5
+                        self.uploaded += len(data)
+                    self._report()
+                    return
+                # 预签名链接过期时重新申请
+                refresh = r.status_code == 403
+                error = f"HTTP {r.status_code}"
+            except (requests.exceptions.RequestException, UploadError) as e:
+                error = str(e)
+            print(f"\n分块 {part_number} 上传失败 (重试 {attempt}/{self.max_retries}): {error}")
+            if attempt <= self.max_retries:
+                time.sleep(2)
+        raise UploadError(f"分块 {part_number} 上传失败")
+
+    def upload_parts(self, part_numbers):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # 任一分块最终失败时抛出异常
+            list(pool.map(self.upload_part, part_numbers))
+
+    def list_parts(self):
+        """返回服务器已收到的分块 {分块编号: ETag}"""
+        data = self._api("s3_list_upload_parts", self._session_data())
+        parts = {}
+        for part in data.get("Parts") or []:
+            number = part.get("PartNumber") or part.get("partNumber")
+            if number is not None:
+                parts[int(number)] = str(part.get("ETag") or part.get("etag") or "").strip('"')
+        return parts
+
+    def _unconfirmed_parts(self):
+        server_parts = self.list_parts()
+        if not server_parts:
+            # 接口没有返回分块列表时以PUT响应为准
+            return []
+        bad = []
+        for number in range(1, self.part_count + 1):
+            etag = server_parts.get(number)
+            local = self.etags.get(number)
+            if etag is None or (etag and local and etag.lower() != local.lower()):
+                bad.append(number)
+        return bad
+
+    def confirm_parts(self):
+        """确认服务器收到了全部分块且ETag一致，否则重新上传有问题的分块"""
+        bad = self._unconfirmed_parts()
+        if not bad:
+            return
+        print(f"\n{len(bad)} 个分块未被服务器确认，重新上传")
+        self.upload_parts(bad)
+        bad = self._unconfirmed_parts()
+        if bad:
+            raise UploadError(f"分块未能确认: {bad}")
+
+    def complete(self):
+        self._api("s3_complete_multipart_upload", self._session_data())
+        if self.file_size > LARGE_FILE_SIZE:
+            time.sleep(3)
+        self._api("upload_complete", {"fileId": self.file_id})
+
+    def run(self, resume=False):
+        """上传全部分块并完成上传，失败时抛出 UploadError
+
+        resume=True 时先查询服务器已收到的分块，只上传缺少的部分。
+        """
+        part_numbers = range(1, self.part_count + 1)
+        if resume:
+            try:
+                server_parts = self.list_parts()
+            except UploadError as e:
+                raise UploadSessionExpired(str(e))
+            part_numbers = [number for number in part_numbers if number not in server_parts]
+            self.etags.update(server_parts)
+            done = self.part_count - len(part_numbers)
+            self.uploaded = min(done * self.part_size, self.file_size)
+            print(f"继续上传: 服务器已有 {done}/{self.part_count} 个分块")
+        self._report()
+        self.upload_parts(part_numbers)
+        self.confirm_parts()
+        self.complete()
+
+    def _report(self):
+        if self.progress_callback:
+            self.progress_callback(self.uploaded, self.file_size)
+
+
+class FolderUploader:
+    """递归上传本地文件夹
+
+    用一个有界线程池按层级并发创建远程目录（只在目录已存在于云盘时才列出其内容，
+    新建的目录不重新列目录），每建好一个目录，其中的文件立即交给上传线程池；
+    同时把这些文件提交给 Pan123.hasher 预先计算MD5（走 HashCache），上传线程轮到某个文件时
+    哈希通常已经算好或正在计算，哈希、upload_request 和分块上传互相并行。提前计算的文件
+    最多 PREHASH_AHEAD × workers 个，其余的等前面的文件上传完再提交，不会一次提交整棵目录树。
+
+    duplicate 为同名文件的处理方式（1覆盖，2保留两者，0跳过）。为None时第一次遇到同名文件
+    询问一次，本次上传的其他同名文件都按这个选择处理。已存在的文件夹中内容相同（ETag与
+    本地MD5一致）的同名文件直接算作已上传。
+    """
+
+    def __init__(
+            self,
+            pan,
+            folder_path,
+            parent_file_id,
+            workers=4,
+            mkdir_workers=4,
+            duplicate=None,
+            task_bucket=None,
+            progress_callback=None,
+    ):
+        self.pan = pan
+        self.folder_path = os.path.abspath(folder_path)
+        self.parent_file_id = parent_file_id
+        self.workers = max(1, int(workers))
+        self.mkdir_workers = max(1, int(mkdir_workers))
+        self.duplicate = duplicate
+        self.task_bucket = task_bucket
+        self.progress_callback = progress_callback
+
+        self.total_files = 0
+        self.total_bytes = 0
+        self.done_files = 0
+        self.done_bytes = 0
+        self.failed_files = 0
+        self.failed_folders = 0
+        self.skipped_files = 0
+        self._listings = {}  # 已存在的远程文件夹 -> Future(({子文件夹名: FileId}, {文件名: 文件详情}))
+        self._pending_folders = 0
+        self._listing_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._folders_done = threading.Condition(self._lock)
+        self._duplicate_lock = threading.Lock()
+        self._prehash_limit = PREHASH_AHEAD * self.workers
+        self._prehash_queue = {}  # 等待提前计算MD5的文件，按上传顺序
+        self._prehashed = set()  # 已提交计算、还没上传完的文件
+        self._mkdir_pool = None
+        self._upload_pool = None
+        self._futures = []
+
+    def run(self):
+        """执行上传，全部成功返回True"""
+        self._walk()
+        success = self.failed_files == 0 and self.failed_folders == 0
+        name = os.path.basename(self.folder_path)
+        if success:
+            print(f"文件夹上传完成: {name} ({self.done_files} 个文件)")
+            if self.skipped_files:
+                print(f"跳过 {self.skipped_files} 个同名文件")
+        else:
+            print(f"文件夹上传未完成: {name}, 失败 {self.failed_files} 个文件, {self.failed_folders} 个文件夹")
+        self._report()
+        return success
+
+    def _walk(self):
+        """创建目录树并处理其中的所有文件，全部完成后返回"""
+        with ThreadPoolExecutor(max_workers=self.mkdir_workers) as mkdir_pool, \
+                ThreadPoolExecutor(max_workers=self.workers) as upload_pool:
+            self._mkdir_pool = mkdir_pool
+            self._upload_pool = upload_pool
+            self._submit_folder(self.folder_path, self.parent_file_id, True)
+            # 目录树建完之后不会再提交新的文件
+            with self._folders_done:
+                while self._pending_folders > 0:
+                    self._folders_done.wait()
+            for future in list(self._futures):
+                future.result()
+
+    def _submit_folder(self, local_path, remote_parent_id, parent_existed):
+        with self._lock:
+            self._pending_folders += 1
+        self._mkdir_pool.submit(self._make_folder, local_path, remote_parent_id, parent_existed)
+
+    def _existing_folders(self, remote_id):
+        """云盘上已有文件夹中的子文件夹 {名称: FileId}"""
+        return self._listing(remote_id)[0]
+
+    def _existing_files(self, remote_id):
+        """云盘上已有文件夹中的文件 {文件名: 文件详情}"""
+        return self._listing(remote_id)[1]
+
+    def _listing(self, remote_id):
+        """列出云盘上已有的文件夹，每个文件夹只列一次
+
+        锁只用来查找或登记该文件夹的列表结果，列目录在锁外进行，不同文件夹可以同时列出。
+        """
+        with self._listing_lock:
+            listing = self._listings.get(remote_id)
+            owner = listing is None
+            if owner:
+                listing = Future()
+                self._listings[remote_id] = listing
+        if owner:
+            try:
+                code, items = self.pan.list_dir(remote_id)
+                if code != 0:
+                    raise UploadError(f"列出文件夹失败, 错误代码: {code}")
+                listing.set_result((
+                    {item["FileName"]: item["FileId"] for item in items if item["Type"] == 1},
+                    {item["FileName"]: item for item in items if item["Type"] == 0},
+                ))
+            except Exception as e:
+                # 失败的结果不保留，下次需要时重新列出
+                with self._listing_lock:
+                    self._listings.pop(remote_id, None)
+                listing.set_exception(e)
+        return listing.result()
+
+    def _make_folder(self, local_path, remote_parent_id, parent_existed):
+        """创建一个远程目录，然后提交其中的子目录和文件"""
+        name = os.path.basename(local_path)
+        try:
+            folder_id = None
+            existed = False
+            if parent_existed:
+                folder_id = self._existing_folders(remote_parent_id).get(name)
+                existed = folder_id is not None
+            if folder_id is None:
+                folder_id = self.pan.create_folder(name, remote_parent_id)
+            if folder_id is None:
+                raise UploadError(f"创建文件夹失败: {name}")
+
+            with os.scandir(local_path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self._submit_folder(entry.path, folder_id, existed)
+                    elif entry.is_file():
+                        size = entry.stat().st_size
+                        with self._lock:
+                            self.total_files += 1
+                            self.total_bytes += size
+                            self._prehash_queue[entry.path] = None
+                            self._futures.append(
+                                self._upload_pool.submit(self._run_item, entry.path, folder_id, size, existed)
+                            )
+                        self._prehash()
+        except (UploadError, OSError, requests.exceptions.RequestException) as e:
+            print(f"上传文件夹失败: {local_path}, {str(e)}")
+            with self._lock:
+                self.failed_folders += 1
+        finally:
+            with self._lock:
+                self._pending_folders -= 1
+                self._folders_done.notify_all()
+
+    def _prehash(self):
+        """把排在前面的文件提交给 hasher 预先计算MD5，上传时 hasher 返回同一个 Future 或命中 HashCache"""
+        with self._lock:
+            paths = []
+            while self._prehash_queue and len(self._prehashed) < self._prehash_limit:
+                path = next(iter(self._prehash_queue))
+                del self._prehash_queue[path]
+                self._prehashed.add(path)
+                paths.append(path)
+        for path in paths:
+            self.pan.hasher.submit(path)
+
+    def _run_item(self, file_path, folder_id, size, existed):
+        with self._lock:
+            # 轮到上传时还没提前计算的文件，由上传本身计算
+            self._prehash_queue.pop(file_path, None)
+        try:
+            self._upload_item(file_path, folder_id, size, existed)
+        finally:
+            with self._lock:
+                self._prehashed.discard(file_path)
+            self._prehash()
+
+    def _duplicate_choice(self):
+        """同名文件的处理方式，duplicate 为None时询问一次"""
+        with self._duplicate_lock:
+            if self.duplicate is None:
+                sure_upload = input("文件夹中有同名文件,输入1覆盖，2保留两者，0跳过（本次上传的同名文件都按此处理）：")
+                self.duplicate = int(sure_upload) if sure_upload in ("1", "2") else 0
+            return self.duplicate
+
+    def _upload_item(self, file_path, folder_id, size, existed=False):
+        ok = skipped = False
+        try:
+            # 不覆盖时，上传期间才出现的同名文件只会让请求失败
+            duplicate = self.duplicate or 0
+            remote = self._existing_files(folder_id).get(os.path.basename(file_path)) if existed else None
+            if remote is not None and str(remote.get("Etag", "")).lower() == self.pan.hasher.file_md5(file_path):
+                ok = True
+            else:
+                if remote is not None:
+                    duplicate = self._duplicate_choice()
+                    skipped = duplicate == 0
+                if not skipped:
+                    ok = self.pan.upload_file(file_path, folder_id, duplicate=duplicate,
+                                              task_bucket=self.task_bucket)
+        except Exception as e:
+            print(f"文件上传失败: {file_path}, {str(e)}")
+            ok = False
+        with self._lock:
+            if ok:
+                self.done_files += 1
+                self.done_bytes += size
+            elif skipped:
+                self.skipped_files += 1
+            else:
+                self.failed_files += 1
+        self._report()
+
+    def _report(self):
+        if self.progress_callback:
+            self.progress_callback({
+                'folder': os.path.basename(self.folder_path),
+                'files_total': self.total_files,
+                'files_done': self.done_files,
+                'files_failed': self.failed_files,
+                'files_skipped': self.skipped_files,
+                'total': self.total_bytes,
+                'uploaded': self.done_bytes,
+            })
+
+
+class UploadProbe(FolderUploader):
+    """本地文件夹的秒传探测
+
+    目录结构的创建与 FolderUploader 相同，但每个文件只计算MD5并发送 upload_request，
+    不上传数据。服务器能按MD5复用的文件就此完成上传；需要传输的文件保存上传会话，
+    之后正式上传时沿用。统计各类文件的数量和字节数，用来估计迁移实际需要的流量。
+    探测从不覆盖云盘上已有的文件（见 Pan123.probe_file），同名而内容不同的文件单独统计。
+    """
+
+    def __init__(self, pan, folder_path, parent_file_id, workers=16, **kwargs):
+        super().__init__(pan, folder_path, parent_file_id, workers=workers, **kwargs)
+        self.transfer_files = 0
+        self.transfer_bytes = 0
+        self.conflict_files = 0
+        self.conflict_bytes = 0
+
+    def run(self):
+        """执行探测，全部文件都得到结果时返回True"""
+        self._walk()
+        summary = self.summary()
+        print(f"秒传探测完成: {os.path.basename(self.folder_path)}")
+        print(f"  可秒传: {summary['reused_files']} 个文件, {format_size(summary['reused_bytes'])}")
+        print(f"  需传输: {summary['transfer_files']} 个文件, {format_size(summary['transfer_bytes'])}")
+        if self.conflict_files:
+            print(f"  同名未探测: {summary['conflict_files']} 个文件, {format_size(summary['conflict_bytes'])}")
+        if self.failed_files or self.failed_folders:
+            print(f"  失败: {self.failed_files} 个文件, {self.failed_folders} 个文件夹")
+        self._report()
+        return self.failed_files == 0 and self.failed_folders == 0
+
+    def _upload_item(self, file_path, folder_id, size, existed=False):
+        try:
+            # 新建的文件夹是空的；已有的文件夹每个只列一次，不必每个文件各查一次
+            remote_files = self._existing_files(folder_id) if existed else {}
+            result = self.pan.probe_file(file_path, folder_id, remote_files)
+        except Exception as e:
+            print(f"秒传探测失败: {file_path}, {str(e)}")
+            result = None
+        with self._lock:
+            if result == REUSED:
+                self.done_files += 1
+                self.done_bytes += size
+            elif result == NEEDS_TRANSFER:
+                self.transfer_files += 1
+                self.transfer_bytes += size
+            elif result == CONFLICT:
+                self.conflict_files += 1
+                self.conflict_bytes += size
+            else:
+                self.failed_files += 1
+        self._report()
+
+    def summary(self):
+        with self._lock:
+            return {
+                'files_total': self.total_files,
+                'bytes_total': self.total_bytes,
+                'reused_files': self.done_files,
+                'reused_bytes': self.done_bytes,
+                'transfer_files': self.transfer_files,
+                'transfer_bytes': self.transfer_bytes,
+                'conflict_files': self.conflict_files,
+                'conflict_bytes': self.conflict_bytes,
+                'failed_files': self.failed_files,
+                'failed_folders': self.failed_folders,
+            }
+
+
+class StreamUploader:
+    """从只能读一次的流（标准输入、管道）上传
+
+    upload_request 需要事先给出整个文件的MD5和大小，服务器也没有事后修改的接口，
+    所以流必须先落到本地才能上传。这里把流切成 volume_size 大小的分卷：每个分卷边读边
+    计算MD5写入临时目录，读完就作为普通文件上传（同样走秒传检查和分块上传），上传的
+    同时继续读取下一个分卷，磁盘上最多同时存在两个分卷。全部分卷上传后再上传一个清单，
+    记录各分卷和整个流的MD5、大小，用 VolumeDownloader（Pan123.download_volumes）还原。
+    整个流不超过一个分卷时不分卷，直接以 file_name 上传，不生成清单。
+
+    duplicate 为1时覆盖云盘上的同名文件（包括同名的分卷和清单）；否则开始读取流之前
+    先检查目标文件夹，有同名文件时不上传，上传中出现同名文件时该分卷的请求失败。
+    上传失败时删除已经上传的分卷，不在云盘上留下没有清单的分卷。
+    """
+
+    def __init__(
+            self,
+            pan,
+            stream,
+            file_name,
+            parent_file_id,
+            volume_size=DEFAULT_VOLUME_SIZE,
+            spool_dir=None,
+            duplicate=0,
+            task_bucket=None,
+            block_size=READ_SIZE,
+    ):
+        self.pan = pan
+        self.stream = stream
+        self.file_name = file_name
+        self.parent_file_id = parent_file_id
+        self.volume_size = max(1, int(volume_size or DEFAULT_VOLUME_SIZE))
+        self.spool_dir = spool_dir
+        self.duplicate = duplicate
+        self.task_bucket = task_bucket
+        self.block_size = block_size
+
+        self.size = 0
+        self.md5 = None
+        self.volumes = []
+        self._uploaded = {}
+        self._md5 = hashlib.md5()
+        self._eof = False
+
+    def _volume_name(self, index):
+        return f"{self.file_name}.{index:04d}"
+
+    def _spool_volume(self, directory, index):
+        """把流的下一段写入临时文件，返回 (路径, MD5, 大小)"""
+        path = os.path.join(directory, self._volume_name(index))
+        md5 = hashlib.md5()
+        size = 0
+        with open(path, "wb") as f:
+            while size < self.volume_size:
+                data = self.stream.read(min(self.block_size, self.volume_size - size))
+                if not data:
+                    self._eof = True
+                    break
+                f.write(data)
+                md5.update(data)
+                self._md5.update(data)
+                size += len(data)
+        self.size += size
+        return path, md5.hexdigest(), size
+
+    def _upload_volume(self, path, md5):
+        # 写入时已经算出MD5，记入缓存后上传不再重新读取计算
+        self.pan.hash_cache.put(path, md5)
+        try:
+            ok = self.pan.upload_file(path, self.parent_file_id, duplicate=self.duplicate,
+                                      task_bucket=self.task_bucket)
+            if ok:
+                self._uploaded[os.path.basename(path)] = md5
+            return ok
+        finally:
+            # 流无法重新读取，分卷不能续传，会话和缓存记录随临时文件一起删除
+            self.pan.upload_sessions.remove(path)
+            self.pan.hash_cache.remove(path)
+            os.remove(path)
+
+    def _conflicts(self):
+        """目标文件夹中与本次上传同名的文件（原文件名、分卷、清单）"""
+        code, items = self.pan.list_dir(self.parent_file_id, refresh=True)
+        if code != 0:
+            raise UploadError(f"列出目标文件夹失败, 错误代码: {code}")
+        volume = re.compile(re.escape(self.file_name) + r"\.\d{4}$")
+        names = (self.file_name, self.file_name + MANIFEST_SUFFIX)
+        return [item["FileName"] for item in items
+                if item["Type"] == 0 and (item["FileName"] in names or volume.match(item["FileName"]))]
+
+    def _discard_volumes(self):
+        """上传失败时把已上传的分卷移入回收站，删不掉的记录到日志"""
+        # 只有一个分卷时它以原文件名上传，同样删除
+        uploaded = self._uploaded
+        if not uploaded:
+            return
+        left = set(uploaded)
+        try:
+            code, items = self.pan.list_dir(self.parent_file_id, refresh=True)
+            for item in items if code == 0 else []:
+                name = item["FileName"]
+                # 只删除内容与本次上传一致的分卷
+                if name in left and str(item.get("Etag", "")).lower() == uploaded[name] \
+                        and self.pan.trash_file(item):
+                    left.discard(name)
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            logging.error(f"删除已上传的分卷失败: {str(e)}")
+        if left:
+            logging.warning(f"流上传失败，以下分卷留在云盘上需要手动删除: {', '.join(sorted(left))}")
+        else:
+            logging.info(f"流上传失败，已删除 {len(uploaded)} 个已上传的分卷")
+
+    def _manifest(self):
+        return {
+            "name": self.file_name,
+            "size": self.size,
+            "md5": self.md5,
+            "volume_size": self.volume_size,
+            "volumes": self.volumes,
+        }
+
+    def run(self):
+        """读取整个流并上传，全部成功返回True"""
+        if self.duplicate != 1:
+            try:
+                conflicts = self._conflicts()
+            except (UploadError, requests.exceptions.RequestException) as e:
+                logging.error(f"流上传失败: {str(e)}")
+                return False
+            if conflicts:
+                logging.error(f"目标文件夹中已有同名文件，未上传: {', '.join(conflicts)}")
+                return False
+        directory = tempfile.mkdtemp(prefix="upload_stream_", dir=self.spool_dir)
+        ok = False
+        try:
+            ok = self._run(directory)
+            return ok
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+            if not ok:
+                self._discard_volumes()
+
+    def _run(self, directory):
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = None
+            index = 0
+            while not self._eof:
+                index += 1
+                path, md5, size = self._spool_volume(directory, index)
+                if size == 0 and index > 1:
+                    # 流的长度恰好是分卷大小的整数倍
+                    os.remove(path)
+                    break
+                if index == 1 and self._eof:
+                    # 整个流不超过一个分卷，按原文件名上传，不生成清单
+                    single_path = os.path.join(directory, self.file_name)
+                    os.replace(path, single_path)
+                    self.md5 = md5
+                    if not self._upload_volume(single_path, md5):
+                        return False
+                    logging.info(f"流上传完成: {self.file_name}, 大小 {self.size}, MD5 {self.md5}")
+                    return True
+                self.volumes.append({"name": os.path.basename(path), "size": size, "md5": md5})
+                # 上一个分卷上传完成后才提交下一个，磁盘上最多两个分卷
+                if pending is not None and not pending.result():
+                    return False
+                pending = pool.submit(self._upload_volume, path, md5)
+            if pending is not None and not pending.result():
+                return False
+
+        self.md5 = self._md5.hexdigest()
+        manifest_path = os.path.join(directory, self.file_name + MANIFEST_SUFFIX)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest(), f, ensure_ascii=False, indent=2)
+        if not self.pan.upload_file(manifest_path, self.parent_file_id, duplicate=self.duplicate,
+                                    task_bucket=self.task_bucket):
+            return False
+        logging.info(f"流上传完成: {self.file_name}, {len(self.volumes)} 个分卷, 大小 {self.size}, MD5 {self.md5}")
+        return True